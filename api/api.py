@@ -6,20 +6,33 @@
 
 import os
 import time
+import logging
 import uuid
 import json
+import asyncio
+import importlib
 import uvicorn
 import uuid
 
+from contextlib import asynccontextmanager, nullcontext
 from typing import List, Optional
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse
-from langchain_core.messages import AIMessageChunk
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 #from langgraph.checkpoint.memory import MemorySaver 
 
-from assistant.graph import graph
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+# The research graph (LangGraph, LangChain, Qdrant) is imported in the background after start-up
+from assistant.configuration import Configuration
+from assistant.index import search_index
+from assistant.streaming import stream_research
+from assistant.sse import ChunkEncoder, ClosingStreamingResponse, DONE, coalesce
+from assistant.scheduler import FairScheduler, QueueFullError
+from assistant.metrics import CONTENT_TYPE, REGISTRY, stats_collector
+from assistant.tracing import TraceStore, trace_run
 
 """ # Load the environment variables for API credentials
 VLLM_URL = os.getenv("VLLM_URL")
@@ -42,21 +55,101 @@ class ChatRequest(BaseModel):
     model: str
     temperature: float = 0.0
     stream: bool = False
+    thread_id: Optional[str] = None  # resume (or fetch the answer of) the run of an earlier request
     # chatOptions field is no longer needed
 
+class BatchResearchRequest(BaseModel):
+    topics: List[str]
+    max_concurrency: Optional[int] = None
+    max_research_loops: Optional[int] = None
+
 # Initialize RAG graph at module level
 #graph = AgentGraph()
 
 # Initialize memory
 #memory = MemorySaver() 
 
+# Recent traces of traced requests ("X-Trace: 1" header or TRACE_REQUESTS), optionally written to TRACE_DIR
+trace_store = TraceStore(
+    max_traces=Configuration.trace_buffer_size,
+    directory=Configuration.trace_dir,
+    format=Configuration.trace_format,
+)
+
+# Set by the warm-up once the research graph is imported and the search index is built
+graph = None
+vectorstore = None
+warm_up_error: Optional[str] = None
+
+# Semantic cache of final answers, invalidated whenever the vector store contents change
+answer_cache = None
+
+
+# Bounded concurrency and fair queueing of research runs
+scheduler = FairScheduler(
+    max_concurrent=Configuration.max_concurrent_runs,
+    max_queued=Configuration.max_queued_runs,
+    max_queued_per_client=Configuration.max_queued_runs_per_client,
+)
+
+# Load of the scheduler and state of the search index, read when /metrics is scraped
+REGISTRY.add_collector(stats_collector("research_scheduler", scheduler.stats, {
+    "running": "gauge", "queued": "gauge", "admitted": "counter", "rejected": "counter", "completed": "counter",
+    "avg_wait_seconds": "gauge", "p95_wait_seconds": "gauge"}, "Research scheduler"))
+REGISTRY.add_collector(stats_collector("search_index", lambda: {
+    "ready": search_index.ready, "documents": len(search_index.vectorstore.manifest) if search_index.vectorstore else 0,
+    "indexed_chunks": search_index.vectorstore.progress.chunks if search_index.vectorstore else 0},
+    {"ready": "gauge", "documents": "gauge", "indexed_chunks": "gauge"}, "Search index"))
+
+
+async def warm_up():
+    """ Import the research graph and wait for the search index, then start serving research requests """
+    global graph, vectorstore, answer_cache, warm_up_error
+    try:
+        graph_module = await asyncio.to_thread(importlib.import_module, "assistant.graph")
+        vectorstore = await search_index.get()
+        if Configuration.answer_cache_enabled:
+            from assistant.answer_cache import AnswerCache
+            answer_cache = AnswerCache(
+                vectorstore.dense_embedding_model,
+                index_version=lambda: vectorstore.version,
+                threshold=Configuration.answer_cache_threshold,
+                max_bytes=Configuration.answer_cache_max_bytes,
+            )
+            REGISTRY.add_collector(stats_collector("answer_cache", answer_cache.stats, {
+                "size": "gauge", "bytes": "gauge", "hits": "counter", "misses": "counter"}, "Answer cache"))
+        from assistant.grading import grade_cache
+        REGISTRY.add_collector(stats_collector("grade_cache", grade_cache.stats, {
+            "size": "gauge", "hits": "counter", "misses": "counter"}, "Grade cache"))
+        if graph_module.graph.checkpointer is not None:
+            REGISTRY.add_collector(stats_collector("checkpointer", graph_module.graph.checkpointer.stats, {
+                "threads": "gauge", "bytes": "gauge", "evictions": "counter", "disk_bytes": "gauge"}, "Checkpointer"))
+    except Exception as e:
+        warm_up_error = f"{type(e).__name__}: {e}"
+        logger.exception("Warm-up failed")
+        return
+    graph = graph_module.graph
+    logger.info("Ready to serve research requests")
+
+
+def require_ready():
+    """ Research endpoints answer 503 until the warm-up has finished """
+    if graph is None:
+        raise HTTPException(status_code=503, detail="The research service is starting, the search index is loading",
+                            headers={"Retry-After": "5"})
 
-thread_id = str(uuid.uuid4())
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing heavy runs before the server binds its port, /readyz reports when the warm-up is done
+    search_index.start()
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
 
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Helper function to format and add system messages
 def add_system_message(messages: List[ChatMessage], system_prompt: Optional[str] = None) -> List[ChatMessage]:
@@ -70,6 +163,28 @@ def add_system_message(messages: List[ChatMessage], system_prompt: Optional[str]
     return messages
 
 
+# Define the liveness probe, fails only when the warm-up failed for good (a restart is needed)
+@app.get("/healthz")
+async def healthz():
+    if warm_up_error is not None or search_index.state == "failed":
+        return JSONResponse({"status": "failed", "error": warm_up_error or search_index.error}, status_code=503)
+    return {"status": "ok"}
+
+
+# Define the readiness probe, with the progress of the search index build
+@app.get("/readyz")
+async def readyz():
+    ready = graph is not None
+    return JSONResponse({"status": "ready" if ready else "starting", "graph_loaded": graph is not None,
+                         "index": search_index.status()}, status_code=200 if ready else 503)
+
+
+# Define the endpoint for Prometheus metrics
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
 # Define the endpoint for retrieving available models
 @app.get("/v1/models")
 async def get_models():
@@ -108,7 +223,7 @@ async def get_models():
 
 # Define the endpoint for chat interaction
 @app.post("/v1/chat/completions")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     try:
         # Convert Pydantic messages to LangChain messages
         messages = [
@@ -121,153 +236,92 @@ async def chat(request: ChatRequest):
 
         if not request.model:
             raise HTTPException(status_code=400, detail="Model is required")
+        require_ready()
+
+        # Every request runs in its own thread, unless it continues the run of an earlier request
+        thread_id = request.thread_id or str(uuid.uuid4())
+        config = {"configurable": {"thread_id": thread_id}}
+        research_topic = messages[-1]["content"]  # Use the last message content as the research topic
+        inputs = {"research_topic": research_topic}
+        finished_summary = None
+        restart_thread = False
+        if request.thread_id and graph.checkpointer is not None:
+            snapshot = await graph.aget_state(config)
+            same_topic = snapshot.values.get("research_topic") == research_topic
+            if snapshot.next:
+                # interrupted run, continue from its last checkpoint
+                if not same_topic:
+                    raise HTTPException(status_code=409, detail=f"Thread {thread_id} has an interrupted run of another "
+                                                                "research topic, resume it with the same topic")
+                inputs = None
+            elif snapshot.values:
+                if same_topic:
+                    finished_summary = snapshot.values.get("running_summary")
+                else:
+                    # a new topic starts a fresh run in the thread, the state of the finished run is dropped
+                    restart_thread = True
+
+        # Answer repeated or near-duplicate topics from the answer cache, finished runs from their checkpoint
+        configurable = Configuration.from_runnable_config(config)
+        cache_namespace = (configurable.openai_model, configurable.max_research_loops)
+        cached_summary = finished_summary
+        if cached_summary is None and answer_cache is not None and inputs is not None:
+            cached_summary = await answer_cache.lookup(research_topic, namespace=cache_namespace)
+
+        # Research runs are admitted before the response starts, so a full queue is a fast 429
+        client_id = http_request.headers.get("X-Client-Id") or (http_request.client.host if http_request.client else "anonymous")
+        ticket = scheduler.admit(client_id) if cached_summary is None else None
+        traced = ticket is not None and (Configuration.trace_requests or
+                                         http_request.headers.get("X-Trace", "").lower() in ("1", "true", "yes"))
 
         async def generate_stream():
-            async for token_ in graph.astream(
-                {"research_topic": messages[-1]["content"]},  # Use the last message content as the research topic
-                {"configurable": {"thread_id": thread_id}},
-                stream_mode="messages"):
-
-                    token = token_[0]
-                    # Stream intermediate research updates
-                    if isinstance(token, AIMessageChunk):
-                        content = token.content
-                        
-                        # Stream regular content
-                        yield f"data: {json.dumps({
-                            'id': f'chat-{str(uuid.uuid4())}',
-                            'object': 'chat.completion.chunk',
-                            'created': int(time.time()), 
-                            'model': request.model,
-                            'choices': [{
-                                'index': 0,
-                                'delta': {
-                                    'role': 'assistant',
-                                    'content': content
-                                },
-                                'finish_reason': None
-                            }]
-                        })}\n\n"
-                            
-                        """ # Check if content contains JSON-like structure
-                        if '"query"' in content or '"aspect"' in content or '"rationale"' in content:
-                            try:
-                                # Try to parse JSON from content
-                                json_data = json.loads(content)
-                                # Extract values directly from parsed JSON
-                                query = json_data.get('query', '')
-                                aspect = json_data.get('aspect', '')
-                                rationale = json_data.get('rationale', '')
-                                
-                                # Stream as a single message
-                                message = f"Query: {query}\nAspect: {aspect}\nRationale: {rationale}\n"
-                                yield f"data: {json.dumps({
-                                    'id': f'chat-{str(uuid.uuid4())}',
-                                    'object': 'chat.completion.chunk',
-                                    'created': int(time.time()),
-                                    'model': request.model, 
-                                    'choices': [{
-                                        'index': 0,
-                                        'delta': {
-                                            'role': 'assistant',
-                                            'content': message
-                                        },
-                                        'finish_reason': None
-                                    }]
-                                })}\n\n"
-                            except json.JSONDecodeError:
-                            # If JSON parsing fails, stream content as-is
-                            yield f"data: {json.dumps({
-                                'id': f'chat-{str(uuid.uuid4())}',
-                                'object': 'chat.completion.chunk',
-                                'created': int(time.time()),
-                                'model': request.model,
-                                'choices': [{
-                                    'index': 0,
-                                    'delta': {
-                                        'role': 'assistant', 
-                                        'content': content
-                                    },
-                                    'finish_reason': None
-                                }]
-                            })}\n\n"
-                        else:
-                            # Stream regular content
-                            yield f"data: {json.dumps({
-                                'id': f'chat-{str(uuid.uuid4())}',
-                                'object': 'chat.completion.chunk',
-                                'created': int(time.time()), 
-                                'model': request.model,
-                                'choices': [{
-                                    'index': 0,
-                                    'delta': {
-                                        'role': 'assistant',
-                                        'content': content
-                                    },
-                                    'finish_reason': None
-                                }]
-                            })}\n\n" """
-                            
-                        """ if 'generate_query' in token.content:
-                            # Extract query, aspect, rationale from token content
-                            content_lines = token.content.split('\n')
-                            query = next((line.split('": "')[1].rstrip('",') for line in content_lines if '"query"' in line), '')
-                            aspect = next((line.split('": "')[1].rstrip('",') for line in content_lines if '"aspect"' in line), '')
-                            rationale = next((line.split('": "')[1].rstrip('",') for line in content_lines if '"rationale"' in line), '')
-                            
-                            yield f"data: {json.dumps({
-                                'id': f'chat-{str(uuid.uuid4())}', 
-                                'object': 'chat.completion.chunk',
-                                'created': int(time.time()),
-                                'model': request.model,
-                                'choices': [{
-                                    'index': 0,
-                                    'delta': {
-                                        'role': 'assistant',
-                                        'content': f"Query: {query}\nAspect: {aspect}\nRationale: {rationale}\n"
-                                    },
-                                    'finish_reason': None
-                                }]
-                            })}\n\n" """
-
-                        """ # Handle 'finalize_summary' condition
-                        elif 'finalize_summary' in token:
-                            running_summary = token['finalize_summary'].get('running_summary', '')
-                            yield f"data: {json.dumps({
-                                'id': f'chat-{str(uuid.uuid4())}',
-                                'object': 'chat.completion.chunk',
-                                'created': int(time.time()),
-                                'model': request.model,
-                                'choices': [{
-                                    'index': 0,
-                                    'delta': {
-                                        'role': 'assistant',
-                                        'content': f"{running_summary}"
-                                    },
-                                    'finish_reason': None
-                                }]
-                            })}\n\n"
-
-                        # If neither condition is matched, you can handle it as a default case (if necessary)
-                        else:
-                            yield f"data: {json.dumps({
-                                'id': f'chat-{str(uuid.uuid4())}',
-                                'object': 'chat.completion.chunk',
-                                'created': int(time.time()),
-                                'model': request.model,
-                                'choices': [{
-                                    'index': 0,
-                                    'delta': {
-                                        'role': 'assistant',
-                                        'content': "Processing... please wait."
-                                    },
-                                    'finish_reason': None
-                                }]
-                            })}\n\n" """
+            # One completion id and timestamp for all chunks of the response
+            encoder = ChunkEncoder(request.model, progress_as_content=Configuration.stream_progress_as_content)
+
+            if cached_summary is not None:
+                yield encoder.content(cached_summary)
+                yield encoder.finish()
+                yield DONE
+                return
+
+            # the ticket is given up however the stream ends, also when the client disconnects mid-run
+            try:
+                if ticket.queued:
+                    yield encoder.progress({'node': None, 'message': f"Waiting for a free research slot ({scheduler.queued} queued)",
+                                            'queued': scheduler.queued})
+
+                # the trace of a run has the id of its thread
+                with trace_run(thread_id, trace_store, research_topic=research_topic) if traced else nullcontext() as trace:
+                    async with ticket:
+                        if trace is not None:
+                            trace.attributes["queue_wait_ms"] = round(1000 * (ticket.started_at - ticket.enqueued_at), 3)
+                        if restart_thread:
+                            await asyncio.to_thread(graph.checkpointer.delete_thread, thread_id)
+                        index_version = vectorstore.version
+                        running_summary = None
+                        events = coalesce(stream_research(graph, inputs, config),
+                                          max_delay=Configuration.stream_coalesce_ms / 1000,
+                                          max_bytes=Configuration.stream_coalesce_bytes)
+                        async for event in events:
+
+                            # Keep the final answer for the answer cache
+                            if event.type == "final":
+                                running_summary = event.text
+                                continue
+
+                            # Progress events carry no content, OpenAI-compatible clients ignore the extra field
+                            yield encoder.event(event)
+
+                if answer_cache is not None and running_summary and inputs is not None:
+                    await answer_cache.store(research_topic, running_summary, namespace=cache_namespace,
+                                             index_version=index_version)
+
+                # Send final "done" message
+                yield encoder.finish()
+                yield DONE
+            finally:
+                ticket.cancel()
 
-            # Send final "done" message
-            yield "data: [DONE]\n\n"
-            
         # Stream response using Server-Sent Events (SSE)
         async def _generate_stream():
             async for token in graph.astream(
@@ -347,10 +401,89 @@ async def chat(request: ChatRequest):
             # Send final "done" message
             yield "data: [DONE]\n\n"
 
-        return StreamingResponse(generate_stream(), media_type="text/event-stream")
+        # the ticket is also given up if the client disconnects before the stream starts
+        headers = {"X-Thread-Id": thread_id, **({"X-Trace-Id": thread_id} if traced else {})}
+        return ClosingStreamingResponse(generate_stream(), media_type="text/event-stream", headers=headers,
+                                        on_close=ticket.cancel if ticket else None)
 
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+
+# Define the endpoint for batch research, results are streamed as NDJSON as each topic finishes
+@app.post("/v1/research/batch")
+async def research_batch(request: BatchResearchRequest):
+    require_ready()
+    from assistant.batch import run_batch
+
+    topics = [topic.strip() for topic in request.topics if topic.strip()]
+    if not topics:
+        raise HTTPException(status_code=400, detail="At least one topic is required")
+    if len(topics) > Configuration.batch_max_topics:
+        raise HTTPException(status_code=400, detail=f"At most {Configuration.batch_max_topics} topics per batch")
+
+    max_concurrency = min(request.max_concurrency or Configuration.batch_max_concurrency, Configuration.batch_max_concurrency)
+    # the cap is applied after the configuration is resolved, MAX_RESEARCH_LOOPS in the environment cannot lift it
+    configurable = {"max_research_loops_cap": Configuration.batch_max_research_loops}
+    if request.max_research_loops is not None:
+        configurable["max_research_loops"] = request.max_research_loops
+        configurable["max_research_loops_cap"] = min(request.max_research_loops, Configuration.batch_max_research_loops)
+
+    async def generate_results():
+        async for result in run_batch(topics, max_concurrency=max_concurrency, configurable=configurable,
+                                      answer_cache=answer_cache, scheduler=scheduler):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(generate_results(), media_type="application/x-ndjson")
+
+
+# Define the endpoint for the load of the research scheduler
+@app.get("/v1/scheduler")
+async def get_scheduler():
+    return scheduler.stats()
+
+
+# Define the endpoints for the traces of recent traced requests
+@app.get("/v1/traces")
+async def list_traces():
+    return {"traces": trace_store.list()}
+
+
+@app.get("/v1/traces/{trace_id}")
+async def get_trace(trace_id: str, format: str = "json"):
+    trace = trace_store.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found")
+    if format not in ("json", "chrome"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'chrome'")
+    return trace.to_chrome() if format == "chrome" else trace.to_dict()
+
+
+# Define the endpoint for inspecting the state of a run
+@app.get("/v1/threads/{thread_id}")
+async def get_thread(thread_id: str):
+    require_ready()
+    if graph.checkpointer is None:
+        raise HTTPException(status_code=404, detail="Checkpointing is disabled")
+
+    snapshot = await graph.aget_state({"configurable": {"thread_id": thread_id}})
+    if not snapshot.values:
+        raise HTTPException(status_code=404, detail=f"Thread {thread_id} not found")
+
+    return {
+        "thread_id": thread_id,
+        "status": "interrupted" if snapshot.next else "finished",
+        "next": list(snapshot.next),
+        "created_at": snapshot.created_at,
+        "research_topic": snapshot.values.get("research_topic"),
+        "search_query": snapshot.values.get("search_query"),
+        "research_loop_count": snapshot.values.get("research_loop_count"),
+        "running_summary": snapshot.values.get("running_summary"),
+    }
     
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8443)
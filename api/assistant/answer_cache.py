@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Rough per-entry bookkeeping overhead on top of the vector and the strings
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+@dataclass
+class _Entry:
+    namespace: Hashable
+    research_topic: str
+    running_summary: str
+    vector: np.ndarray
+    nbytes: int
+
+
+class AnswerCache:
+    """Semantic cache of final research answers
+
+    The research topic is embedded and compared (cosine similarity) with the topics of cached
+    answers; a cached running_summary is returned when the best match is above the threshold.
+    All entries are dropped when the vector store contents change (its version differs from the
+    version the answers were produced with), and the least recently used entries are evicted
+    to keep the cache under max_bytes.
+    """
+    def __init__(self, embeddings: Embeddings, index_version: Callable[[], int] = lambda: 0,
+                 threshold: float = 0.97, max_bytes: int = 64 * 1024 * 1024):
+        self.embeddings = embeddings
+        self.index_version = index_version
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._next_id = 0
+        self._version = index_version()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def _embed(self, research_topic: str) -> np.ndarray:
+        vector = np.asarray(await self.embeddings.aembed_query(research_topic), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        version = self.index_version()
+        if version != self._version:
+            self._entries.clear()
+            self.nbytes = 0
+            self._version = version
+
+    async def lookup(self, research_topic: str, namespace: Hashable = None) -> Optional[str]:
+        """Returns the cached answer of the most similar topic above the threshold, if any"""
+        with self._lock:
+            self._check_version()
+            if not self._entries:
+                self.misses += 1
+                return None
+
+        vector = await self._embed(research_topic)
+        with self._lock:
+            self._check_version()
+            candidates = [(entry_id, entry) for entry_id, entry in self._entries.items() if entry.namespace == namespace]
+            if candidates:
+                similarities = np.stack([entry.vector for _, entry in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry.running_summary
+            self.misses += 1
+        return None
+
+    async def store(self, research_topic: str, running_summary: str, namespace: Hashable = None,
+                    index_version: Optional[int] = None):
+        """Cache the final answer of a research run
+
+        index_version is the vector store version when the run started; answers produced while the
+        index changed are not cached.
+        """
+        vector = await self._embed(research_topic)
+        nbytes = vector.nbytes + len(research_topic) + len(running_summary) + _ENTRY_OVERHEAD_BYTES
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_version()
+            if index_version is not None and index_version != self._version:
+                return
+            self._entries[self._next_id] = _Entry(namespace, research_topic, running_summary, vector, nbytes)
+            self._next_id += 1
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            size, nbytes, hits, misses = len(self._entries), self.nbytes, self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "size": size,
+            "bytes": nbytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,147 @@
+"""Batch research: many topics with bounded concurrency and pooled embedding / grading requests
+
+Usage:
+    python -m assistant.batch topics.txt > results.ndjson
+
+topics.txt holds one research topic per line (or a JSON list of topics). One JSON result per
+topic is written as soon as the topic finishes.
+"""
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import contextlib
+import contextvars
+import dataclasses
+from typing import AsyncIterator, List, Optional
+
+from assistant.configuration import Configuration
+from assistant.grading import grade_pairs
+from assistant.metrics import research_run
+from assistant.pooling import RequestPool, use_pool
+from assistant.scheduler import FairScheduler, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+async def run_batch(topics: List[str], max_concurrency: Optional[int] = None,
+                    configurable: Optional[dict] = None, answer_cache=None,
+                    scheduler: Optional[FairScheduler] = None) -> AsyncIterator[dict]:
+    """Research every topic and yield one result per topic in completion order
+
+    At most max_concurrency research runs are in flight. With a scheduler (the API's), each run
+    also needs a ticket of the batch's client, so batches share MAX_CONCURRENT_RUNS fairly with
+    the interactive requests; a full queue delays the topic instead of failing it. Their query
+    embeddings and grading requests are pooled into larger batches (grading always uses the
+    single-request batch mode).
+    Results are dicts with index, topic, status ("ok" or "error"), running_summary or error,
+    and the run time in seconds.
+    """
+    from assistant.graph import graph
+    from assistant.index import get_vectorstore
+
+    vectorstore = await get_vectorstore()
+
+    batch_id = uuid.uuid4().hex[:12]
+    config = {"configurable": dict(configurable or {})}
+    settings = Configuration.from_runnable_config(config)
+    max_concurrency = max_concurrency or Configuration.batch_max_concurrency
+
+    grading_config = dataclasses.replace(settings, grading_mode="batch")
+    pool = RequestPool(
+        embed_documents=vectorstore.dense_embedding_model.aembed_documents,
+        grade_pairs=lambda pairs: grade_pairs(pairs, grading_config),
+        embedding_batch_size=Configuration.pool_embedding_batch_size,
+        grading_batch_size=Configuration.pool_grading_batch_size,
+        max_delay=Configuration.pool_max_delay_ms / 1000,
+    )
+    cache_namespace = (settings.openai_model, settings.max_research_loops)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    client_id = f"batch-{batch_id}"
+
+    async def admit():
+        while True:
+            try:
+                return scheduler.admit(client_id)
+            except QueueFullError as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def research(index: int, topic: str) -> dict:
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                running_summary = None
+                if answer_cache is not None:
+                    running_summary = await answer_cache.lookup(topic, namespace=cache_namespace)
+                if running_summary is None:
+                    index_version = vectorstore.version
+                    run_config = {"configurable": {**config["configurable"], "thread_id": f"batch-{batch_id}-{index}"}}
+                    ticket = await admit() if scheduler is not None else contextlib.nullcontext()
+                    async with ticket:
+                        with research_run():
+                            result = await graph.ainvoke({"research_topic": topic}, run_config)
+                    running_summary = result["running_summary"]
+                    if answer_cache is not None:
+                        await answer_cache.store(topic, running_summary, namespace=cache_namespace,
+                                                 index_version=index_version)
+                return {"index": index, "topic": topic, "status": "ok", "running_summary": running_summary,
+                        "seconds": round(time.monotonic() - started, 3)}
+            except Exception as e:
+                logger.exception("Research of batch topic %d failed", index)
+                return {"index": index, "topic": topic, "status": "error", "error": str(e),
+                        "seconds": round(time.monotonic() - started, 3)}
+
+    # the runs share the pool through their context
+    context = contextvars.copy_context()
+    context.run(use_pool, pool)
+    tasks = [asyncio.create_task(research(index, topic), context=context) for index, topic in enumerate(topics)]
+    started = time.monotonic()
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+        logger.info("Batch %s: %d topics in %.1fs, pooled requests %s", batch_id, len(topics),
+                    time.monotonic() - started, pool.stats())
+
+
+def _read_topics(path: str) -> List[str]:
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return [str(topic) for topic in json.loads(text)]
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+async def _main(args: argparse.Namespace) -> None:
+    topics = _read_topics(args.topics)
+    configurable = {}
+    if args.max_research_loops is not None:
+        # the cap also bounds MAX_RESEARCH_LOOPS of the environment
+        configurable = {"max_research_loops": args.max_research_loops, "max_research_loops_cap": args.max_research_loops}
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        # keep progress prints of the graph out of the NDJSON output
+        with contextlib.redirect_stdout(sys.stderr):
+            async for result in run_batch(topics, max_concurrency=args.concurrency, configurable=configurable):
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Research many topics and write NDJSON results")
+    parser.add_argument("topics", help="file with one topic per line or a JSON list ('-' reads stdin)")
+    parser.add_argument("-o", "--output", help="NDJSON output file (default: stdout)")
+    parser.add_argument("-c", "--concurrency", type=int, default=None, help="research runs in flight")
+    parser.add_argument("--max-research-loops", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s", stream=sys.stderr)
+    asyncio.run(_main(args))
@@ -0,0 +1,282 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import MemorySaver
+
+from assistant.cache import eviction_victims
+from assistant.configuration import Configuration
+
+logger = logging.getLogger(__name__)
+
+
+def _checkpoint_size(saved: tuple) -> int:
+    (_, checkpoint), (_, metadata), _ = saved
+    return len(checkpoint) + len(metadata)
+
+
+def _writes_size(writes: dict) -> int:
+    return sum(len(value) for _, _, (_, value), _ in writes.values())
+
+
+class BoundedMemorySaver(MemorySaver):
+    """In-memory checkpointer with a cap on the bytes of retained state
+
+    Checkpoints and pending writes are accounted per thread; when the serialized state of all
+    threads exceeds max_bytes, the least recently used threads are dropped. The thread that is
+    being written is never evicted, so a single run larger than the cap still completes.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.evictions = 0
+        self._thread_bytes: "OrderedDict[str, int]" = OrderedDict()
+        self._write_keys: dict = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._thread_bytes
+
+    def _account(self, thread_id: str, nbytes: int = 0) -> None:
+        self._thread_bytes[thread_id] = self._thread_bytes.get(thread_id, 0) + nbytes
+        self._thread_bytes.move_to_end(thread_id)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self._thread_bytes) > 1:
+            evicted = next(iter(self._thread_bytes))
+            logger.debug("Evicting checkpoints of thread %s from memory", evicted)
+            self._drop(evicted)
+            self.evictions += 1
+
+    def _drop(self, thread_id: str) -> None:
+        self.nbytes -= self._thread_bytes.pop(thread_id, 0)
+        self.storage.pop(thread_id, None)
+        for key in self._write_keys.pop(thread_id, ()):
+            self.writes.pop(key, None)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._drop(thread_id)
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            # unknown threads are not looked up, the defaultdicts would retain an empty entry
+            if thread_id not in self._thread_bytes:
+                return None
+            self._thread_bytes.move_to_end(thread_id)
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        if config and config["configurable"]["thread_id"] not in self._thread_bytes:
+            return
+        with self._lock:
+            checkpoints = list(super().list(config, filter=filter, before=before, limit=limit))
+        yield from checkpoints
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            previous = self.storage.get(thread_id, {}).get(checkpoint_ns, {}).get(checkpoint["id"])
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            saved = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            self._account(thread_id, _checkpoint_size(saved) - (_checkpoint_size(previous) if previous else 0))
+            self._saved(thread_id, checkpoint_ns, checkpoint["id"], saved)
+        return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        with self._lock:
+            previous = _writes_size(self.writes.get(key, {}))
+            super().put_writes(config, writes, task_id, task_path)
+            self._write_keys.setdefault(thread_id, set()).add(key)
+            self._account(thread_id, _writes_size(self.writes[key]) - previous)
+            self._saved_writes(key, self.writes[key])
+
+    def _saved(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, saved: tuple) -> None:
+        """Hook for persistent subclasses, called with each stored checkpoint"""
+
+    def _saved_writes(self, key: tuple, writes: dict) -> None:
+        """Hook for persistent subclasses, called with the pending writes of a checkpoint"""
+
+    def stats(self) -> dict:
+        return {"threads": len(self._thread_bytes), "bytes": self.nbytes, "evictions": self.evictions}
+
+
+class SqliteCheckpointSaver(BoundedMemorySaver):
+    """Checkpointer persisted to a local SQLite file, with a cap on the bytes of retained state
+
+    Checkpoints are written through to SQLite, so interrupted runs can be resumed after a restart;
+    recently used threads are kept in memory. When the file holds more than max_bytes of
+    serialized state, the least recently used threads are deleted from it.
+    """
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        super().__init__(max_bytes=max_bytes)
+        self.path = path
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, "
+            "checkpoint_type TEXT NOT NULL, checkpoint BLOB NOT NULL, metadata_type TEXT NOT NULL, metadata BLOB NOT NULL, "
+            "parent_checkpoint_id TEXT, PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS writes ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, "
+            "task_id TEXT NOT NULL, idx INTEGER NOT NULL, channel TEXT NOT NULL, value_type TEXT NOT NULL, value BLOB NOT NULL, "
+            "task_path TEXT NOT NULL, PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS threads_accessed ON threads (accessed)")
+        self.disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM threads").fetchone()[0]
+
+    def _load(self, thread_id: str) -> None:
+        """Load a thread that is not in memory from SQLite"""
+        if thread_id in self._thread_bytes:
+            return
+        checkpoints = self._conn.execute(
+            "SELECT checkpoint_ns, checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata, parent_checkpoint_id "
+            "FROM checkpoints WHERE thread_id = ?", (thread_id,)
+        ).fetchall()
+        if not checkpoints:
+            return
+
+        nbytes = 0
+        for checkpoint_ns, checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata, parent_id in checkpoints:
+            saved = ((checkpoint_type, checkpoint), (metadata_type, metadata), parent_id)
+            self.storage[thread_id][checkpoint_ns][checkpoint_id] = saved
+            nbytes += _checkpoint_size(saved)
+        for checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path in self._conn.execute(
+            "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path "
+            "FROM writes WHERE thread_id = ? ORDER BY checkpoint_id, task_id, idx", (thread_id,)
+        ):
+            key = (thread_id, checkpoint_ns, checkpoint_id)
+            self.writes[key][(task_id, idx)] = (task_id, channel, (value_type, value), task_path)
+            self._write_keys.setdefault(thread_id, set()).add(key)
+            nbytes += len(value)
+        self._account(thread_id, nbytes)
+
+    def get_tuple(self, config):
+        with self._lock:
+            self._load(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        # without a thread, only the threads in memory are listed
+        if config:
+            with self._lock:
+                self._load(config["configurable"]["thread_id"])
+        yield from super().list(config, filter=filter, before=before, limit=limit)
+
+    # MemorySaver runs the sync methods on the event loop, the SQLite reads and commits run in a worker thread
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        checkpoints = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    def _saved(self, thread_id, checkpoint_ns, checkpoint_id, saved):
+        (checkpoint_type, checkpoint), (metadata_type, metadata), parent_id = saved
+        self._conn.execute("BEGIN")
+        previous = self._conn.execute(
+            "SELECT LENGTH(checkpoint) + LENGTH(metadata) FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (thread_id, checkpoint_ns, checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata, parent_id),
+        )
+        self._update_thread(thread_id, _checkpoint_size(saved) - (previous[0] if previous else 0))
+        self._conn.execute("COMMIT")
+        self._evict(thread_id)
+
+    def _saved_writes(self, key, writes):
+        thread_id, checkpoint_ns, checkpoint_id = key
+        self._conn.execute("BEGIN")
+        previous = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            key,
+        ).fetchone()[0]
+        self._conn.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", key)
+        self._conn.executemany(
+            "INSERT INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path)
+             for (_, idx), (task_id, channel, (value_type, value), task_path) in writes.items()],
+        )
+        self._update_thread(thread_id, _writes_size(writes) - previous)
+        self._conn.execute("COMMIT")
+        self._evict(thread_id)
+
+    def _update_thread(self, thread_id: str, nbytes: int) -> None:
+        self._conn.execute(
+            "INSERT INTO threads (thread_id, size, accessed) VALUES (?, ?, ?) "
+            "ON CONFLICT (thread_id) DO UPDATE SET size = size + excluded.size, accessed = excluded.accessed",
+            (thread_id, nbytes, time.time()),
+        )
+        self.disk_bytes += nbytes
+
+    def _evict(self, current_thread_id: str) -> None:
+        if self.disk_bytes <= self.max_bytes:
+            return
+        threads = self._conn.execute(
+            "SELECT thread_id, size FROM threads WHERE thread_id != ? ORDER BY accessed", (current_thread_id,)
+        ).fetchall()
+        for thread_id, size in eviction_victims(threads, self.disk_bytes, self.max_bytes):
+            logger.debug("Deleting checkpoints of thread %s (%d bytes)", thread_id, size)
+            self._delete(thread_id)
+            self.evictions += 1
+
+    def _delete(self, thread_id: str) -> None:
+        self._drop(thread_id)
+        self._conn.execute("BEGIN")
+        size = self._conn.execute("SELECT size FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        for table in ("checkpoints", "writes", "threads"):
+            self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+        self._conn.execute("COMMIT")
+        self.disk_bytes -= size[0] if size else 0
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._delete(thread_id)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "disk_bytes": self.disk_bytes}
+
+
+def create_checkpointer(backend: Optional[str] = None, path: Optional[str] = None,
+                        max_bytes: Optional[int] = None) -> Optional[BaseCheckpointSaver]:
+    """Create the checkpointer configured with CHECKPOINTER ("memory", "sqlite" or "none")"""
+    backend = (backend or Configuration.checkpointer).lower()
+    max_bytes = max_bytes or Configuration.checkpoint_max_bytes
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return BoundedMemorySaver(max_bytes=max_bytes)
+    if backend == "sqlite":
+        return SqliteCheckpointSaver(path or Configuration.checkpoint_path, max_bytes=max_bytes)
+    raise ValueError(f"Unknown checkpointer: {backend}")
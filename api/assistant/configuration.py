@@ -1,10 +1,14 @@
 import os
-from dataclasses import dataclass, fields
-from typing import Any, Optional
+from dataclasses import dataclass, fields, Field
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Optional
 
-from langchain_core.runnables import RunnableConfig
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    # langchain_core takes about a second to import, the API serves its probes before that
+    from langchain_core.runnables import RunnableConfig
+
 from enum import Enum
 load_dotenv()
 class SearchAPI(Enum):
@@ -18,31 +22,104 @@ class Configuration:
     """The configurable fields for the research assistant."""
     #max_web_research_loops: int = int(os.environ.get("MAX_WEB_RESEARCH_LOOPS", "3"))
     max_research_loops: int = int(os.environ.get("MAX_RESEARCH_LOOPS", "0"))
+    num_search_queries: int = int(os.environ.get("NUM_SEARCH_QUERIES", "1"))  # queries searched in parallel on the first loop
     openai_model: str = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
     openai_embedding_model: str = os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
     search_api: SearchAPI = SearchAPI(os.environ.get("SEARCH_API", SearchAPI.DOCUMENT_SEARCH.value))  # Default to DUCKDUCKGO
     fetch_full_page: bool = os.environ.get("FETCH_FULL_PAGE", "False").lower() in ("true", "1", "t")
     openai_base_url: str = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
     openai_api_key: str = os.environ.get("OPENAI_API_KEY")
+    vectorstore_path: Optional[str] = os.environ.get("VECTORSTORE_PATH")  # None keeps the index in memory
+    vectorstore_collection: str = os.environ.get("VECTORSTORE_COLLECTION", "deep_researcher")
+    qdrant_url: Optional[str] = os.environ.get("QDRANT_URL")  # use a Qdrant server instead of local storage
+    qdrant_api_key: Optional[str] = os.environ.get("QDRANT_API_KEY")
+    embedding_cache_path: Optional[str] = os.environ.get("EMBEDDING_CACHE_PATH", "./cache/embeddings.sqlite")  # empty disables the cache
+    embedding_cache_max_bytes: int = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+    ingest_batch_size: int = int(os.environ.get("INGEST_BATCH_SIZE", "64"))  # chunks embedded and upserted per batch
+    ingest_max_concurrent_embeddings: int = int(os.environ.get("INGEST_MAX_CONCURRENT_EMBEDDINGS", "4"))  # embedding requests in flight
+    grading_mode: str = os.environ.get("GRADING_MODE", "per_chunk")  # "per_chunk" or "batch" (one request for all chunks)
+    grade_cache_size: int = int(os.environ.get("GRADE_CACHE_SIZE", "4096"))  # in-memory relevance grades
+    grade_cache_ttl: float = float(os.environ.get("GRADE_CACHE_TTL", "86400"))  # seconds a grade is reused
+    grade_cache_path: Optional[str] = os.environ.get("GRADE_CACHE_PATH")  # optional on-disk layer
+    answer_cache_enabled: bool = os.environ.get("ANSWER_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+    answer_cache_threshold: float = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.97"))  # cosine similarity of research topics
+    answer_cache_max_bytes: int = int(os.environ.get("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    llm_max_connections: int = int(os.environ.get("LLM_MAX_CONNECTIONS", "100"))  # HTTP connection pool of the LLM clients
+    llm_max_keepalive_connections: int = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    llm_keepalive_expiry: float = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "30"))  # seconds an idle connection is kept
+    ingest_upsert_workers: int = int(os.environ.get("INGEST_UPSERT_WORKERS", "2"))  # parallel upserts (Qdrant server only)
+    ingest_load_workers: int = int(os.environ.get("INGEST_LOAD_WORKERS", str(os.cpu_count() or 1)))  # processes unpickling parsed documents
+    checkpointer: str = os.environ.get("CHECKPOINTER", "memory")  # "memory", "sqlite" or "none"
+    checkpoint_path: str = os.environ.get("CHECKPOINT_PATH", "./cache/checkpoints.sqlite")  # used by the sqlite checkpointer
+    checkpoint_max_bytes: int = int(os.environ.get("CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024)))  # retained run state
+    max_concurrent_runs: int = int(os.environ.get("MAX_CONCURRENT_RUNS", "8"))  # research runs executing at once
+    max_queued_runs: int = int(os.environ.get("MAX_QUEUED_RUNS", "32"))  # runs waiting for a slot before requests get a 429
+    max_queued_runs_per_client: int = int(os.environ.get("MAX_QUEUED_RUNS_PER_CLIENT", "8"))
+    stream_coalesce_ms: float = float(os.environ.get("STREAM_COALESCE_MS", "0"))  # merge content deltas within this window
+    stream_coalesce_bytes: int = int(os.environ.get("STREAM_COALESCE_BYTES", "0"))  # or until this many bytes are buffered
+    stream_progress_as_content: bool = os.environ.get("STREAM_PROGRESS_AS_CONTENT", "True").lower() in ("true", "1", "t")  # progress lines in the content, for clients that ignore the progress field
+    batch_max_concurrency: int = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))  # research runs in flight per batch job
+    batch_max_topics: int = int(os.environ.get("BATCH_MAX_TOPICS", "1000"))
+    batch_max_research_loops: int = int(os.environ.get("BATCH_MAX_RESEARCH_LOOPS", "5"))  # cap of the loops a batch request may ask for
+    pool_embedding_batch_size: int = int(os.environ.get("POOL_EMBEDDING_BATCH_SIZE", "64"))  # query embeddings per pooled request
+    pool_grading_batch_size: int = int(os.environ.get("POOL_GRADING_BATCH_SIZE", "16"))  # chunks per pooled grading request
+    pool_max_delay_ms: float = float(os.environ.get("POOL_MAX_DELAY_MS", "20"))  # wait for more requests before sending a batch
+    context_max_tokens: int = int(os.environ.get("CONTEXT_MAX_TOKENS", "8000"))  # prompt budget of the summarizer
+    context_max_tokens_per_source: int = int(os.environ.get("CONTEXT_MAX_TOKENS_PER_SOURCE", "1000"))
+    summary_mode: str = os.environ.get("SUMMARY_MODE", "rewrite")  # "rewrite" or "incremental" (the model only writes new facts)
+    summary_compact_tokens: int = int(os.environ.get("SUMMARY_COMPACT_TOKENS", "1500"))  # incremental summaries above this are condensed
+    adaptive_stop: bool = os.environ.get("ADAPTIVE_STOP", "True").lower() in ("true", "1", "t")  # end research early when loops stop finding new information
+    stop_min_new_chunk_fraction: float = float(os.environ.get("STOP_MIN_NEW_CHUNK_FRACTION", "0.25"))  # of a loop's relevant chunks not seen before
+    stop_min_relevant_fraction: float = float(os.environ.get("STOP_MIN_RELEVANT_FRACTION", "0.2"))  # of a loop's retrieved chunks graded relevant
+    stop_min_summary_growth: float = float(os.environ.get("STOP_MIN_SUMMARY_GROWTH", "0.05"))  # relative summary growth of the previous loop
+    trace_requests: bool = os.environ.get("TRACE_REQUESTS", "False").lower() in ("true", "1", "t")  # trace every request, not only "X-Trace: 1" ones
+    trace_dir: Optional[str] = os.environ.get("TRACE_DIR")  # write finished traces to this directory
+    trace_format: str = os.environ.get("TRACE_FORMAT", "chrome")  # "chrome" (trace event format) or "json" (span tree)
+    trace_buffer_size: int = int(os.environ.get("TRACE_BUFFER_SIZE", "50"))  # recent traces kept for /v1/traces
     
 
     @classmethod
     def from_runnable_config(
-        cls, config: Optional[RunnableConfig] = None
+        cls, config: Optional["RunnableConfig"] = None
     ) -> "Configuration":
         """Create a Configuration instance from a RunnableConfig."""
         configurable = (
             config["configurable"] if config and "configurable" in config else {}
         )
         values: dict[str, Any] = {
-            f.name: os.environ.get(f.name.upper(), configurable.get(f.name))
+            f.name: configurable.get(f.name)
             for f in fields(cls)
             if f.init
         }
-        return cls(**{k: v for k, v in values.items() if v})
+        # environment variables take precedence, they are read once per process
+        values.update(_environment_overrides())
+        configuration = cls(**{k: v for k, v in values.items() if v is not None})
+        # a cap set by the caller (e.g. the batch endpoint) also bounds the loops set in the environment
+        max_research_loops_cap = configurable.get("max_research_loops_cap")
+        if max_research_loops_cap is not None:
+            configuration.max_research_loops = min(configuration.max_research_loops, max_research_loops_cap)
+        return configuration
 
     def clear_api_key(self) -> None:
         """Clear the OpenAI API key from environment variables and this instance."""
         if "OPENAI_API_KEY" in os.environ:
             del os.environ["OPENAI_API_KEY"]
-        self.openai_api_key = None
\ No newline at end of file
+            _environment_overrides.cache_clear()
+        self.openai_api_key = None
+
+def _coerce(f: Field, value: str) -> Any:
+    """Convert an environment variable to the type of the field default"""
+    if isinstance(f.default, bool):
+        return value.lower() in ("true", "1", "t")
+    if isinstance(f.default, (int, float, Enum)):
+        return type(f.default)(value)
+    return value
+
+@lru_cache(maxsize=1)
+def _environment_overrides() -> dict[str, Any]:
+    """Snapshot of the configuration fields that are set as environment variables"""
+    return {
+        f.name: _coerce(f, os.environ[f.name.upper()])
+        for f in fields(Configuration)
+        if f.init and f.name.upper() in os.environ
+    }
\ No newline at end of file
@@ -0,0 +1,155 @@
+import math
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Encoding of models tiktoken does not know (e.g. local models behind an OpenAI-compatible API)
+DEFAULT_ENCODING = "cl100k_base"
+
+# Fallback estimate when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+# A source is cut to fit the total budget only if at least this many tokens are left for it
+MIN_SOURCE_TOKENS = 64
+
+
+class TokenCounter:
+    """Counts and truncates text in tokens of the model's tokenizer
+
+    Uses the tiktoken encoding of the model. When tiktoken is not installed or its encoding
+    files cannot be loaded (e.g. offline), it falls back to an estimate of 4 characters per token.
+    """
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+        self.encoding = _load_encoding(model)
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> Tuple[str, int, bool]:
+        """Returns the text cut to max_tokens, its token count and whether it was cut"""
+        if not text:
+            return "", 0, False
+        max_tokens = max(max_tokens, 0)
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text, len(tokens), False
+            return self.encoding.decode(tokens[:max_tokens]), max_tokens, True
+        if len(text) <= max_tokens * CHARS_PER_TOKEN:
+            return text, math.ceil(len(text) / CHARS_PER_TOKEN), False
+        return text[:max_tokens * CHARS_PER_TOKEN], max_tokens, True
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(model: Optional[str]):
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, estimating %d characters per token", CHARS_PER_TOKEN)
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning("Could not load the tokenizer of %s (%s), estimating %d characters per token",
+                       model, e, CHARS_PER_TOKEN)
+        return None
+
+
+@lru_cache(maxsize=32)
+def get_token_counter(model: Optional[str] = None) -> TokenCounter:
+    return TokenCounter(model)
+
+
+@dataclass
+class SourceUsage:
+    title: str
+    tokens: int  # tokens of the source in the formatted context, 0 if it was left out
+    truncated: bool = False
+    included: bool = True
+
+
+@dataclass
+class SourcesContext:
+    text: str
+    tokens: int
+    sources: List[SourceUsage] = field(default_factory=list)
+
+    @property
+    def dropped(self) -> int:
+        return sum(not source.included for source in self.sources)
+
+
+def _flatten_sources(search_response) -> list:
+    if isinstance(search_response, dict):
+        return search_response['results']
+    if isinstance(search_response, list):
+        sources_list = []
+        for response in search_response:
+            if isinstance(response, dict) and 'results' in response:
+                sources_list.extend(response['results'])
+            else:
+                sources_list.extend(response)
+        return sources_list
+    raise ValueError("Input must be either a dict with 'results' or a list of search results")
+
+
+def build_sources_context(search_response, max_tokens_per_source: int = 1000, max_total_tokens: Optional[int] = None,
+                          include_raw_content: bool = False, model: Optional[str] = None) -> SourcesContext:
+    """Deduplicate and format search results within per-source and total token budgets
+
+    Sources are deduplicated by their "id" (document chunks) or URL. The content (and raw content)
+    of each source is cut to max_tokens_per_source tokens of the model's tokenizer. Sources are
+    added in order until max_total_tokens is reached; the last one is cut to fit and the rest are
+    left out. The text is assembled once, in time linear in the size of the sources.
+    """
+    counter = get_token_counter(model)
+
+    unique_sources = {}
+    for source in _flatten_sources(search_response):
+        unique_sources.setdefault(source.get('id', source['url']), source)
+
+    parts = ["Sources:\n\n"]
+    total = counter.count(parts[0])
+    usage = []
+    for source in unique_sources.values():
+        remaining = max_total_tokens - total if max_total_tokens is not None else None
+        if remaining is not None and remaining < MIN_SOURCE_TOKENS:
+            usage.append(SourceUsage(source['title'], 0, included=False))
+            continue
+
+        content, _, truncated = counter.truncate(source['content'] or "", max_tokens_per_source)
+        block = (
+            f"Source {source['title']}:\n===\n"
+            f"URL: {source['url']}\n===\n"
+            f"Most relevant content from source: {content}\n===\n"
+        )
+        raw_content = source.get('raw_content') if include_raw_content else None
+        if raw_content:
+            raw_content, _, raw_truncated = counter.truncate(raw_content, max_tokens_per_source)
+            truncated = truncated or raw_truncated
+            block += f"Full source content limited to {max_tokens_per_source} tokens: {raw_content}{'... [truncated]' if raw_truncated else ''}\n\n"
+
+        tokens = counter.count(block)
+        if remaining is not None and tokens > remaining:
+            block, tokens, _ = counter.truncate(block, remaining)
+            truncated = True
+        parts.append(block)
+        total += tokens
+        usage.append(SourceUsage(source['title'], tokens, truncated=truncated))
+
+    return SourcesContext(text="".join(parts).strip(), tokens=total, sources=usage)
@@ -0,0 +1,126 @@
+import time
+import asyncio
+import hashlib
+from array import array
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from assistant.cache import DiskCache
+from assistant.configuration import Configuration
+from assistant.metrics import EMBEDDING_DURATION, EMBEDDING_REQUESTS, EMBEDDING_TEXTS
+from assistant.tracing import span
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed embedding cache in front of an embedding model
+
+    Vectors are keyed on (embedding model, sha256 of the text), so the same chunk or query is
+    only sent to the embedding endpoint once. The same instance is used when documents are added
+    to the vector store and when the retriever embeds a search query.
+    """
+    def __init__(self, embeddings: Embeddings, model_name: str, store: DiskCache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, texts: List[str]):
+        """Returns the cache keys, the cached vectors and the unique texts that need embedding"""
+        keys = [self._key(text) for text in texts]
+        cached = {key: list(array("f", value)) for key, value in self.store.get_many(keys).items()}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        return keys, cached, missing
+
+    def _store(self, cached: dict, missing_keys: List[str], vectors: List[List[float]]):
+        new_vectors = dict(zip(missing_keys, vectors))
+        self.store.set_many({key: array("f", vector).tobytes() for key, vector in new_vectors.items()})
+        cached.update(new_vectors)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = self._lookup(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._store(cached, list(missing.keys()), vectors)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, cached, missing = self._lookup([text])
+        if missing:
+            self._store(cached, keys, [self.embeddings.embed_query(text)])
+        return cached[keys[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            await asyncio.to_thread(self._store, cached, list(missing.keys()), vectors)
+        return [cached[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, cached, missing = await asyncio.to_thread(self._lookup, [text])
+        if missing:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self._store, cached, keys, [vector])
+        return cached[keys[0]]
+
+
+class MeteredEmbeddings(Embeddings):
+    """Records the requests, texts and latency of an embedding model in the metrics (and the trace of the run)"""
+    def __init__(self, embeddings: Embeddings, model_name: str):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self._requests = {operation: EMBEDDING_REQUESTS.labels(model_name, operation) for operation in ("documents", "query")}
+        self._texts = EMBEDDING_TEXTS.labels(model_name)
+        self._duration = EMBEDDING_DURATION.labels(model_name)
+
+    def _record(self, operation: str, texts: int, started: float):
+        self._duration.observe(time.perf_counter() - started)
+        self._requests[operation].inc()
+        self._texts.inc(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        with span("embed_documents", "embedding", texts=len(texts)) as embed_span:
+            vectors = self.embeddings.embed_documents(texts)
+            if embed_span is not None:
+                embed_span.set(chars=sum(len(text) for text in texts))
+        self._record("documents", len(texts), started)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        started = time.perf_counter()
+        with span("embed_query", "embedding", texts=1, chars=len(text)):
+            vector = self.embeddings.embed_query(text)
+        self._record("query", 1, started)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        with span("embed_documents", "embedding", texts=len(texts)) as embed_span:
+            vectors = await self.embeddings.aembed_documents(texts)
+            if embed_span is not None:
+                embed_span.set(chars=sum(len(text) for text in texts))
+        self._record("documents", len(texts), started)
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        started = time.perf_counter()
+        with span("embed_query", "embedding", texts=1, chars=len(text)):
+            vector = await self.embeddings.aembed_query(text)
+        self._record("query", 1, started)
+        return vector
+
+
+def with_embedding_cache(embeddings: Embeddings, model_name: str, path: Optional[str] = None) -> Embeddings:
+    """Wrap an embedding model with the on-disk embedding cache (if EMBEDDING_CACHE_PATH is set)"""
+    path = path or Configuration.embedding_cache_path
+    if not path:
+        return embeddings
+    store = DiskCache(path, max_bytes=Configuration.embedding_cache_max_bytes)
+    return CachedEmbeddings(embeddings, model_name=model_name, store=store)
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import time
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from assistant.cache import DiskCache, LRUCache
+from assistant.configuration import Configuration
+from assistant.llm import get_chat_model
+from assistant.metrics import DOCUMENT_GRADES
+from assistant.tracing import span
+from assistant.pooling import current_pool
+from assistant.prompts import document_grading_instructions, batch_document_grading_instructions, batch_document_template
+
+logger = logging.getLogger(__name__)
+
+# Changes to the grading prompt invalidate previously cached grades
+GRADING_PROMPT_VERSION = hashlib.sha256(document_grading_instructions.encode("utf-8")).hexdigest()[:12]
+
+GRADES = ("yes", "no")
+
+
+def _normalize_query(search_query: str) -> str:
+    return " ".join(search_query.lower().split())
+
+
+def _chunk_key(document: Document) -> str:
+    return f"{document.metadata.get('file_path')}#{document.metadata.get('chunk_id')}"
+
+
+class GradeCache:
+    """Cache of document relevance grades keyed on (normalized query, chunk, model, prompt version)
+
+    Grades at temperature 0 are deterministic, so a (search query, chunk) pair only needs to be
+    graded once. Grades are kept in an in-memory LRU with a time-to-live, optionally backed by an
+    on-disk layer that survives restarts.
+    """
+    def __init__(self, maxsize: int = 4096, ttl: Optional[float] = None, path: Optional[str] = None):
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(path) if path else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(search_query: str, document: Document, model: str) -> str:
+        raw = "\x00".join((_normalize_query(search_query), _chunk_key(document), model, GRADING_PROMPT_VERSION))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key])[0]
+
+    def set(self, key: str, grade: str) -> None:
+        self.set_many({key: grade})
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        """The cached grades of the keys (None when not cached), with one disk lookup for the memory misses"""
+        grades = [self.memory.get(key, count=False) for key in keys]
+        missing = [key for key, grade in zip(keys, grades) if grade is None]
+        if missing and self.disk is not None:
+            found = {}
+            for key, entry in self.disk.get_many(missing).items():
+                entry = json.loads(entry)
+                if not self.ttl or time.time() - entry["graded_at"] < self.ttl:
+                    found[key] = entry["grade"]
+                    self.memory.set(key, entry["grade"])
+            grades = [found.get(key) if grade is None else grade for key, grade in zip(keys, grades)]
+
+        misses = grades.count(None)
+        self.misses += misses
+        self.hits += len(grades) - misses
+        return grades
+
+    def set_many(self, grades: Dict[str, str]) -> None:
+        """Cache the grades, written to disk in one transaction"""
+        for key, grade in grades.items():
+            self.memory.set(key, grade)
+        if self.disk is not None:
+            graded_at = time.time()
+            self.disk.set_many({key: json.dumps({"grade": grade, "graded_at": graded_at}).encode("utf-8")
+                                for key, grade in grades.items()})
+
+    async def aget_many(self, keys: List[str]) -> List[Optional[str]]:
+        # the on-disk layer is SQLite, its reads and commits run in a worker thread
+        if self.disk is None:
+            return self.get_many(keys)
+        return await asyncio.to_thread(self.get_many, keys)
+
+    async def aset_many(self, grades: Dict[str, str]) -> None:
+        if self.disk is None:
+            return self.set_many(grades)
+        await asyncio.to_thread(self.set_many, grades)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+grade_cache = GradeCache(
+    maxsize=Configuration.grade_cache_size,
+    ttl=Configuration.grade_cache_ttl,
+    path=Configuration.grade_cache_path,
+)
+
+
+async def grade_documents(documents: List[Document], search_query: str, configurable: Configuration) -> List[str]:
+    """Grade the relevance of each document for the search query ("yes" or "no")
+
+    Cached grades are reused, only the remaining documents are sent to the LLM. Within a batch job
+    they are pooled with the documents of the other runs.
+    """
+    with span("grade_documents", "grading", documents=len(documents), mode=configurable.grading_mode) as grading_span:
+        keys = [grade_cache.key(search_query, doc, configurable.openai_model) for doc in documents]
+        grades = await grade_cache.aget_many(keys)
+        ungraded = [i for i, grade in enumerate(grades) if grade is None]
+        for grade in grades:
+            if grade is not None:
+                DOCUMENT_GRADES.labels(grade if grade in GRADES else "invalid", "cache").inc()
+
+        if ungraded:
+            pairs = [(search_query, documents[i]) for i in ungraded]
+            pool = current_pool()
+            new_grades = await (pool.grade_pairs(pairs) if pool is not None else grade_pairs(pairs, configurable))
+            for i, grade in zip(ungraded, new_grades):
+                grades[i] = grade
+                DOCUMENT_GRADES.labels(grade if grade in GRADES else "invalid", "llm").inc()
+            await grade_cache.aset_many({keys[i]: grades[i] for i in ungraded})
+
+        if grading_span is not None:
+            grading_span.set(cached=len(documents) - len(ungraded), graded=len(ungraded),
+                             relevant=sum(grade == "yes" for grade in grades))
+    return grades
+
+
+async def grade_pairs(pairs: List[Tuple[str, Document]], configurable: Configuration) -> List[str]:
+    """Grade (search query, document) pairs with the configured grading mode
+
+    "batch" grades all pairs in a single JSON-mode request and falls back to per-chunk grading
+    when the returned score array cannot be parsed. "per_chunk" makes one request per pair.
+    """
+    if configurable.grading_mode == "batch" and len(pairs) > 1:
+        grades = await _grade_batch(pairs, configurable)
+        if grades is not None:
+            return grades
+        logger.warning("Batch grading returned an invalid score array, falling back to per-chunk grading")
+    return await _grade_per_chunk(pairs, configurable)
+
+
+async def _grade_per_chunk(pairs: List[Tuple[str, Document]], configurable: Configuration) -> List[str]:
+    # grade documents and parse JSON
+    llm_json_mode = get_chat_model(configurable, json_mode=True)
+    responses = await llm_json_mode.abatch([
+        document_grading_instructions.format(search_query=search_query, document=document.page_content)
+        for search_query, document in pairs
+    ])
+    return [json.loads(response.content)['score'] for response in responses]
+
+
+async def _grade_batch(pairs: List[Tuple[str, Document]], configurable: Configuration) -> Optional[List[str]]:
+    documents = "\n\n".join(
+        batch_document_template.format(index=i, search_query=search_query, document=document.page_content)
+        for i, (search_query, document) in enumerate(pairs, 1)
+    )
+    llm_json_mode = get_chat_model(configurable, json_mode=True)
+    response = await llm_json_mode.ainvoke(batch_document_grading_instructions.format(documents=documents))
+
+    try:
+        scores = json.loads(response.content)['scores']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return None
+    if not isinstance(scores, list) or len(scores) != len(pairs):
+        return None
+    scores = [str(score).strip().lower() for score in scores]
+    if any(score not in GRADES for score in scores):
+        return None
+    return scores
@@ -1,124 +1,188 @@
 import json
-import asyncio
+import logging
 
 from typing import List
 from typing_extensions import Literal
 
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
 # from langchain_ollama import ChatOllama
 from langgraph.graph import START, END, StateGraph
+from langgraph.types import Send
 
 from assistant.configuration import Configuration, SearchAPI
-from assistant.utils import deduplicate_and_format_sources, format_sources, load_pkl_files #tavily_search, perplexity_search, duckduckgo_search 
-from assistant.state import SummaryState, SummaryStateInput, SummaryStateOutput
-from assistant.prompts import query_writer_instructions, summarizer_instructions, reflection_instructions, document_grading_instructions
-from assistant.vectorstore import VectorStore
+from assistant.utils import deduplicate_and_format_sources, format_sources #tavily_search, perplexity_search, duckduckgo_search 
+from assistant.state import SummaryState, SummaryStateInput, SummaryStateOutput, DocumentSearchState
+from assistant.prompts import query_writer_instructions, multi_query_writer_instructions, summarizer_instructions, incremental_summarizer_instructions, reflection_instructions
+from assistant.index import get_vectorstore
+from assistant.llm import get_chat_model
+from assistant.grading import grade_documents
+from assistant.streaming import FINAL_ANSWER_TAG
+from assistant.checkpoint import create_checkpointer
+from assistant.context import MIN_SOURCE_TOKENS, build_sources_context, get_token_counter
+from assistant.summary import summarize_incrementally
+from assistant.stopping import log_decision, loop_stats, stop_reason
+from assistant.metrics import RESEARCH_LOOPS, timed_node
+from assistant.tracing import traced_node
 
 from langchain_core.documents import Document
 
-# NOTE: This needs to be run uplong app initialization
-#from assistant.document_search import VectorStore, document_search, parse_documents, aadd_documents_to_vectorstore
+logger = logging.getLogger(__name__)
 
+# Tokens of the summarizer's message framing (tags around the topic, summary and search results)
+SUMMARY_MESSAGE_OVERHEAD_TOKENS = 32
 
-#Load the vectorstore and add documents --> TODO: clean this up
-async def load_vectorstore():
-    # Load the parsed document pkl files
-    pkl_dict = load_pkl_files(parsed_document_dir="./parsed_documents")
-    # Load the vectorstore
-    vectorstore = VectorStore()
-    vectorstore.add_pkl_dict_to_vectorstore(pkl_dict)
-    return vectorstore
-vectorstore = asyncio.run(load_vectorstore())
+def _format_search_response(documents:List[dict]):
+    return {
+        "results": [{
+            "id": f'{document["file_path"]}#{document["chunk_id"]}',
+            "title": document["title"],
+            "url": "n/a",
+            "content": document["content"]
+        } for document in documents],
+    }
 
 # Nodes
-def generate_query(state: SummaryState, config: RunnableConfig):
-    """ Generate a query for web search """
-
-    # Format the prompt
-    query_writer_instructions_formatted = query_writer_instructions.format(research_topic=state.research_topic)
+async def generate_query(state: SummaryState, config: RunnableConfig):
+    """ Generate one or more queries for web search """
 
     # Generate a query
     configurable = Configuration.from_runnable_config(config)
 
-    llm_json_mode = ChatOpenAI(model=configurable.openai_model,
-                               base_url=configurable.openai_base_url,
-                               api_key=configurable.openai_api_key,
-                               temperature=0.0,
-                               response_format={"type": "json_object"})
-    
-    
-    result = llm_json_mode.invoke(
-        [SystemMessage(content=query_writer_instructions_formatted),
-        HumanMessage(content=f"Generate a query for web search:")]
+    llm_json_mode = get_chat_model(configurable, json_mode=True)
+
+    if configurable.num_search_queries <= 1:
+        # Format the prompt
+        query_writer_instructions_formatted = query_writer_instructions.format(research_topic=state.research_topic)
+        
+        result = await llm_json_mode.ainvoke(
+            [SystemMessage(content=query_writer_instructions_formatted),
+            HumanMessage(content=f"Generate a query for web search:")]
+        )
+        query = json.loads(result.content)
+        return {"search_query": query['query'], "search_queries": [query['query']]}
+
+    # Generate diverse queries that are searched in parallel
+    result = await llm_json_mode.ainvoke(
+        [SystemMessage(content=multi_query_writer_instructions.format(research_topic=state.research_topic,
+                                                                      num_queries=configurable.num_search_queries)),
+        HumanMessage(content=f"Generate {configurable.num_search_queries} queries for web search:")]
     )
-    query = json.loads(result.content)
+    queries = [query['query'] for query in json.loads(result.content).get('queries', []) if query.get('query')]
 
-    return {"search_query": query['query']}
+    # JSON mode can fail in some cases, fall back to the research topic
+    queries = list(dict.fromkeys(queries))[:configurable.num_search_queries] or [state.research_topic]
+    return {"search_query": queries[0], "search_queries": queries}
 
+def fan_out_document_search(state: SummaryState) -> List[Send]:
+    """ Search every query of this loop in a parallel document_search branch """
+    search_queries = state.search_queries or [state.search_query]
+    return [
+        Send("document_search", DocumentSearchState(search_query=search_query, research_loop_count=state.research_loop_count))
+        for search_query in search_queries
+    ]
 
-def document_search(state: SummaryState, config: RunnableConfig):
+async def document_search(state: DocumentSearchState, config: RunnableConfig):
     """
-    Parses JSON string output from LLM grading response
+    Retrieves documents for the search query of a branch and keeps the ones the LLM grades as relevant
     Args:
-        state (dict): The current graph state
+        state (DocumentSearchState): The search query and research loop of this branch
 
     Returns:
-        list: List of parsed JSON grades
+        dict: The graded search results of this branch
     """
-    def _format_search_response(filtered_documents:List[Document]):
-        formatted_documents = []
-        for document in filtered_documents:
-            formatted_documents.append({
-                "title": document.metadata["filename"],
-                "url": "n/a",
-                "content": document.page_content
-            })
-        return {
-            "results": formatted_documents,
-        }
-
-    def _batch_instruction_template(docs:List[Document], search_query:str):
-        return [document_grading_instructions.format(
-            search_query=search_query,
-            document=doc.page_content
-        ) for doc in docs]
-
     # Configure
     configurable = Configuration.from_runnable_config(config)
     
     search_query = state.search_query
-    
-    llm_json_mode = ChatOpenAI(model=configurable.openai_model,
-                               base_url=configurable.openai_base_url,
-                               api_key=configurable.openai_api_key,
-                               temperature=0.0,
-                               response_format={"type": "json_object"})
-    
 
     if not isinstance(search_query, str) or not search_query.strip():
         raise ValueError("Search query must be a non-empty string")
 
-    # retrieve documents
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-    retrieved_documents = retriever.invoke(search_query)
+    # retrieve documents (waits until the search index is built)
+    vectorstore = await get_vectorstore()
+    retrieved_documents = await vectorstore.asearch(search_query, k=5)
 
-    # grade documents and parse JSON
-    result_json = llm_json_mode.batch(
-        _batch_instruction_template(retrieved_documents, search_query)
-    )
+    # grade documents (cached grades are reused)
+    grades = await grade_documents(retrieved_documents, search_query, configurable)
     
-    filtered_documents = []
-    for i, response in enumerate(result_json):
-        result = json.loads(response.content)
-        if result['score'] == "yes":
-            filtered_documents.append(retrieved_documents[i])
+    chunk_refs = {
+        document.metadata["_id"]: {
+            "file_path": document.metadata["file_path"],
+            "chunk_id": document.metadata["chunk_id"],
+            "title": document.metadata["filename"],
+            "grade": grade,
+            "score": document.metadata.get("_score"),
+            "loop": state.research_loop_count,
+        }
+        for document, grade in zip(retrieved_documents, grades) if grade == "yes"
+    }
 
-    search_results = _format_search_response(filtered_documents)
-    search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000, include_raw_content=True)
+    return {"chunk_refs": chunk_refs, "search_branch_results": [{
+        "loop": state.research_loop_count,
+        "search_query": search_query,
+        "retrieved": len(retrieved_documents),
+        "chunk_ids": list(chunk_refs),
+    }]}
 
-    return {"sources_gathered": [format_sources(search_results)], "research_loop_count": state.research_loop_count + 1, "document_search_results": [search_str]}
+async def merge_search_results(state: SummaryState, config: RunnableConfig):
+    """ Merge the chunk references found by this loop's document searches and decide whether it is the last loop """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    loop_chunk_ids = []
+    for branch in state.search_branch_results:
+        if branch["loop"] == state.research_loop_count:
+            loop_chunk_ids.extend(branch["chunk_ids"])
+    loop_chunk_ids = list(dict.fromkeys(loop_chunk_ids))
+
+    # decided before summarizing, so the last summary is streamed as the final answer
+    counter = get_token_counter(configurable.openai_model)
+    stats = loop_stats(state.research_loop_count, state.search_branch_results, loop_chunk_ids, state.chunk_refs,
+                       summary_tokens=counter.count(state.running_summary or ""),
+                       previous=state.loop_stats[-1] if state.loop_stats else None,
+                       summary_growth=state.summary_growth if configurable.summary_mode == "incremental" else None)
+    reason = stop_reason(stats, configurable)
+    log_decision(stats, reason)
+    RESEARCH_LOOPS.labels("true" if reason else "false").inc()
+
+    return {"loop_chunk_ids": loop_chunk_ids, "research_loop_count": state.research_loop_count + 1,
+            "loop_stats": [stats], "stop_reason": reason}
+
+async def build_search_context(state: SummaryState, configurable: Configuration) -> str:
+    """ Fetch the text of this loop's chunks and format them within the summarizer's token budget """
+
+    vectorstore = await get_vectorstore()
+    documents = await vectorstore.aget_documents(state.loop_chunk_ids)
+    search_results = _format_search_response([{
+        "title": document.metadata["filename"],
+        "file_path": document.metadata["file_path"],
+        "chunk_id": document.metadata["chunk_id"],
+        "content": document.page_content,
+    } for document in documents])
+
+    # the sources get what is left of the prompt budget after the instructions, the topic and the existing summary
+    counter = get_token_counter(configurable.openai_model)
+    if configurable.summary_mode == "incremental":
+        instructions_tokens = counter.count(incremental_summarizer_instructions)
+        summary_tokens = min(counter.count(state.running_summary or ""), configurable.summary_compact_tokens)
+    else:
+        instructions_tokens = counter.count(summarizer_instructions)
+        summary_tokens = counter.count(state.running_summary or "")
+    prompt_tokens = instructions_tokens + counter.count(state.research_topic) + summary_tokens + SUMMARY_MESSAGE_OVERHEAD_TOKENS
+    context = build_sources_context(search_results,
+                                    max_tokens_per_source=configurable.context_max_tokens_per_source,
+                                    max_total_tokens=max(configurable.context_max_tokens - prompt_tokens, MIN_SOURCE_TOKENS),
+                                    include_raw_content=True,
+                                    model=configurable.openai_model)
+    logger.info("Research loop %d context: %d tokens from %d sources (%d truncated, %d dropped)%s",
+                state.research_loop_count, context.tokens, len(context.sources),
+                sum(source.truncated for source in context.sources), context.dropped,
+                "" if counter.exact else " (estimated)")
+    for source in context.sources:
+        logger.debug("  %s: %d tokens%s", source.title, source.tokens,
+                     " (truncated)" if source.truncated else "" if source.included else " (dropped)")
+    return context.text
 
 def web_research(state: SummaryState, config: RunnableConfig):
     """ Gather information from the web """
@@ -152,15 +216,26 @@ def web_research(state: SummaryState, config: RunnableConfig):
     
     return {"sources_gathered": [format_sources(search_results)], "research_loop_count": state.research_loop_count + 1, "web_research_results": [search_str]}
 
-def summarize_sources(state: SummaryState, config: RunnableConfig):
+async def summarize_sources(state: SummaryState, config: RunnableConfig):
     """ Summarize the gathered sources """
 
+    configurable = Configuration.from_runnable_config(config)
+
+    # Most recent document search, rendered from the chunk references
+    most_recent_document_search = await build_search_context(state, configurable)
+
+    # Only the new facts are written and merged into a structured summary of bounded size
+    if configurable.summary_mode == "incremental":
+        summary_sections, running_summary, summary_growth = await summarize_incrementally(
+            state.research_topic, state.summary_sections, most_recent_document_search, configurable)
+        return {"running_summary": running_summary, "summary_sections": summary_sections,
+                "summary_growth": summary_growth}
+
     # Existing summary
     existing_summary = state.running_summary
 
     # Most recent web research
     #most_recent_web_research = state.web_research_results[-1]
-    most_recent_document_search = state.document_search_results[-1]
     
     # Build the human message
     if existing_summary:
@@ -178,14 +253,13 @@ def summarize_sources(state: SummaryState, config: RunnableConfig):
         )
 
     # Run the LLM
-    configurable = Configuration.from_runnable_config(config)
-    llm = ChatOpenAI(model=configurable.openai_model,
-                     base_url=configurable.openai_base_url,
-                     api_key=configurable.openai_api_key,
-                     temperature=0.0,)
-    
-    
-    result = llm.invoke(
+    llm = get_chat_model(configurable)
+
+    # Tokens of the last summary are streamed to the client as the final answer
+    if state.stop_reason:
+        llm = llm.with_config(tags=[FINAL_ANSWER_TAG])
+
+    result = await llm.ainvoke(
         [SystemMessage(content=summarizer_instructions),
         HumanMessage(content=human_message_content)]
     )
@@ -201,7 +275,7 @@ def summarize_sources(state: SummaryState, config: RunnableConfig):
 
     return {"running_summary": running_summary}
 
-def reflect_on_summary(state: SummaryState, config: RunnableConfig):
+async def reflect_on_summary(state: SummaryState, config: RunnableConfig):
     """ Reflect on the summary and generate a follow-up query """
 
     # Generate a query
@@ -209,15 +283,11 @@ def reflect_on_summary(state: SummaryState, config: RunnableConfig):
     
     
     #llm_json_mode = ChatOllama(base_url=configurable.ollama_base_url, model=configurable.local_llm, temperature=0, format="json")
-    llm_json_mode = ChatOpenAI(model=configurable.openai_model,
-                               base_url=configurable.openai_base_url,
-                               api_key=configurable.openai_api_key,
-                               temperature=0.0,
-                               response_format={"type": "json_object"})
+    llm_json_mode = get_chat_model(configurable, json_mode=True)
     
     
     
-    result = llm_json_mode.invoke(
+    result = await llm_json_mode.ainvoke(
         [SystemMessage(content=reflection_instructions.format(research_topic=state.research_topic)),
         HumanMessage(content=f"Identify a knowledge gap and generate a follow-up web search query based on our existing knowledge: {state.running_summary}")]
     )
@@ -230,50 +300,54 @@ def reflect_on_summary(state: SummaryState, config: RunnableConfig):
     if not query:
 
         # Fallback to a placeholder query
-        return {"search_query": f"Tell me more about {state.research_topic}"}
+        return {"search_query": f"Tell me more about {state.research_topic}", "search_queries": [f"Tell me more about {state.research_topic}"]}
 
     # Update search query with follow-up query
-    return {"search_query": follow_up_query['follow_up_query']}
+    return {"search_query": follow_up_query['follow_up_query'], "search_queries": [follow_up_query['follow_up_query']]}
 
-def finalize_summary(state: SummaryState):
+async def finalize_summary(state: SummaryState):
     """ Finalize the summary """
 
     # Format all accumulated sources into a single bulleted list
-    all_sources = "\n".join(source for source in state.sources_gathered)
+    document_sources = format_sources({"results": [
+        {"title": chunk_ref["title"], "url": "n/a"} for chunk_ref in state.chunk_refs.values()
+    ]})
+    all_sources = "\n".join(source for source in [document_sources, *state.sources_gathered] if source)
     state.running_summary = f"## Summary\n\n{state.running_summary}\n\n ### Sources:\n{all_sources}"
     return {"running_summary": state.running_summary}
 
-def route_research(state: SummaryState, config: RunnableConfig) -> Literal["finalize_summary", "document_search"]: # "web_research"
-    """ Route the research based on the follow-up query """
+def route_research(state: SummaryState) -> Literal["reflect_on_summary", "finalize_summary"]:
+    """ Finalize the summary of the last loop, or reflect on it to start another loop """
 
-    configurable = Configuration.from_runnable_config(config)
-    
-    # NOTE: TEST
-    print(f"research_loop_count: {state.research_loop_count}")
-    
-    
-    if state.research_loop_count <= configurable.max_research_loops:
-        return "document_search" # "web_research"
-    else:
+    logger.debug("research_loop_count: %d", state.research_loop_count)
+
+    if state.stop_reason:
         return "finalize_summary"
+    return "reflect_on_summary"
 
 # Add nodes and edges
 builder = StateGraph(SummaryState, input=SummaryStateInput, output=SummaryStateOutput, config_schema=Configuration)
-builder.add_node("generate_query", generate_query)
+def instrumented(name, node):
+    """ Record the node's run time in the metrics and, for traced runs, as a span """
+    return timed_node(name, traced_node(name, node))
+
+builder.add_node("generate_query", instrumented("generate_query", generate_query))
 #builder.add_node("web_research", web_research)
-builder.add_node("document_search", document_search)
-builder.add_node("summarize_sources", summarize_sources)
-builder.add_node("reflect_on_summary", reflect_on_summary)
-builder.add_node("finalize_summary", finalize_summary)
+builder.add_node("document_search", instrumented("document_search", document_search))
+builder.add_node("merge_search_results", instrumented("merge_search_results", merge_search_results))
+builder.add_node("summarize_sources", instrumented("summarize_sources", summarize_sources))
+builder.add_node("reflect_on_summary", instrumented("reflect_on_summary", reflect_on_summary))
+builder.add_node("finalize_summary", instrumented("finalize_summary", finalize_summary))
 
 # Add edges
 builder.add_edge(START, "generate_query")
-builder.add_edge("generate_query", "document_search")
-builder.add_edge("document_search", "summarize_sources")
+builder.add_conditional_edges("generate_query", fan_out_document_search, ["document_search"])
+builder.add_edge("document_search", "merge_search_results")
+builder.add_edge("merge_search_results", "summarize_sources")
 #builder.add_edge("generate_query", "web_research")
 #builder.add_edge("web_research", "summarize_sources")
-builder.add_edge("summarize_sources", "reflect_on_summary")
-builder.add_conditional_edges("reflect_on_summary", route_research)
+builder.add_conditional_edges("summarize_sources", route_research, ["reflect_on_summary", "finalize_summary"])
+builder.add_conditional_edges("reflect_on_summary", fan_out_document_search, ["document_search"])
 builder.add_edge("finalize_summary", END)
 
-graph = builder.compile()
\ No newline at end of file
+graph = builder.compile(checkpointer=create_checkpointer())
\ No newline at end of file
@@ -0,0 +1,93 @@
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SearchIndex:
+    """The vector store of the process, built in a background thread
+
+    Building the index loads the embedding models and embeds every parsed document that is not
+    indexed yet, which can take minutes. start() begins the build without blocking, so the API
+    answers health probes in the meantime; get() waits for the finished index and starts the
+    build on first use (scripts, batch jobs). The heavy imports happen in the build thread.
+    vectorstore_factory replaces VectorStore(), e.g. to serve with other embedding models.
+    """
+    def __init__(self, parsed_document_dir: str = "./parsed_documents", vectorstore_factory: Optional[Callable] = None):
+        self.parsed_document_dir = parsed_document_dir
+        self.vectorstore_factory = vectorstore_factory
+        self.vectorstore = None  # set as soon as the collection is open, indexing may still be running
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._future is None:
+            return "idle"
+        if not self._future.done():
+            return "loading"
+        return "failed" if self.error is not None else "ready"
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self) -> Future:
+        """Start building the index unless it is built or being built, returns the future of the vector store"""
+        with self._lock:
+            if self._future is None:
+                self._future = Future()
+                self.started_at = time.monotonic()
+                threading.Thread(target=self._build, name="index-build", daemon=True).start()
+            return self._future
+
+    def _build(self) -> None:
+        try:
+            from assistant.configuration import Configuration
+            from assistant.utils import iter_parsed_documents
+            from assistant.vectorstore import VectorStore
+
+            self.vectorstore = (self.vectorstore_factory or VectorStore)()
+            # Stream the parsed document pkl files into the vectorstore
+            parsed_documents = iter_parsed_documents(parsed_document_dir=self.parsed_document_dir,
+                                                     max_workers=Configuration.ingest_load_workers)
+            self.vectorstore.add_parsed_documents(parsed_documents)
+        except BaseException as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception("Building the search index failed")
+            self._future.set_exception(e)
+            return
+        self.ready_at = time.monotonic()
+        logger.info("Search index ready after %.1fs", self.ready_at - self.started_at)
+        self._future.set_result(self.vectorstore)
+
+    async def get(self):
+        """The vector store, waits until the index is built"""
+        return await asyncio.wrap_future(self.start())
+
+    def status(self) -> dict:
+        status = {"state": self.state}
+        if self.started_at is not None:
+            status["elapsed_seconds"] = round((self.ready_at or time.monotonic()) - self.started_at, 3)
+        if self.vectorstore is not None:
+            status["documents"] = len(self.vectorstore.manifest)
+            status["indexing"] = self.vectorstore.progress.as_dict()
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+# The search index of the process
+search_index = SearchIndex()
+
+
+async def get_vectorstore():
+    """The vector store of the process, built on first use"""
+    return await search_index.get()
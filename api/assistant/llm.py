@@ -0,0 +1,146 @@
+import time
+import asyncio
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_openai import ChatOpenAI
+
+from assistant.configuration import Configuration
+from assistant.metrics import LLM_DURATION, LLM_REQUESTS, LLM_TOKENS
+from assistant.tracing import start_span
+
+# Long-lived clients, one registry per event loop: async HTTP connections cannot be shared across loops
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, object]]" = weakref.WeakKeyDictionary()
+_sync_clients: Dict[Tuple, object] = {}
+_http_clients: Dict[str, httpx.Client] = {}
+_lock = threading.Lock()
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=Configuration.llm_max_connections,
+        max_keepalive_connections=Configuration.llm_max_keepalive_connections,
+        keepalive_expiry=Configuration.llm_keepalive_expiry,
+    )
+
+
+def _registry() -> Dict[Tuple, object]:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _sync_clients
+    registry = _clients.get(loop)
+    if registry is None:
+        registry = _clients[loop] = {}
+    return registry
+
+
+class LLMCallHandler(BaseCallbackHandler):
+    """Records the requests, latency and token usage of a chat model in the metrics
+
+    When the run is traced, each call is also recorded as a span with its prompt and response sizes.
+    """
+    # called in the caller's thread / event loop, no executor hop per callback
+    run_inline = True
+
+    def __init__(self, model: str):
+        self.model = model
+        self._started: Dict[UUID, float] = {}
+        self._spans: Dict[UUID, object] = {}
+        self._ok = LLM_REQUESTS.labels(model, "ok")
+        self._error = LLM_REQUESTS.labels(model, "error")
+        self._duration = LLM_DURATION.labels(model)
+        self._input_tokens = LLM_TOKENS.labels(model, "input")
+        self._output_tokens = LLM_TOKENS.labels(model, "output")
+
+    def _start(self, run_id: UUID, prompt_chars, tags) -> None:
+        self._started[run_id] = time.perf_counter()
+        span = start_span(f"llm {self.model}", "llm", tags=list(tags or ()))
+        if span is not None:
+            span.set(prompt_chars=prompt_chars())
+            self._spans[run_id] = span
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, tags=None, **kwargs: Any) -> None:
+        self._start(run_id, lambda: sum(len(str(message.content)) for batch in messages for message in batch), tags)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts, *, run_id: UUID, tags=None, **kwargs: Any) -> None:
+        self._start(run_id, lambda: sum(len(prompt) for prompt in prompts), tags)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self._duration.observe(time.perf_counter() - started)
+        self._ok.inc()
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+        self._input_tokens.inc(input_tokens)
+        self._output_tokens.inc(output_tokens)
+
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.end(response_chars=sum(len(generation.text) for generations in response.generations for generation in generations),
+                     input_tokens=input_tokens, output_tokens=output_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.pop(run_id, None)
+        self._error.inc()
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.end(error=type(error).__name__)
+
+
+def _create_chat_model(registry: Dict[Tuple, object], configurable: Configuration, json_mode: bool,
+                       temperature: float) -> ChatOpenAI:
+    # the HTTP clients are shared by every model talking to the same endpoint
+    base_url = configurable.openai_base_url
+    http_client = _http_clients.get(base_url)
+    if http_client is None:
+        http_client = _http_clients[base_url] = httpx.Client(limits=_http_limits())
+    http_async_client = registry.get(("http", base_url))
+    if http_async_client is None:
+        http_async_client = registry[("http", base_url)] = httpx.AsyncClient(limits=_http_limits())
+
+    return ChatOpenAI(
+        model=configurable.openai_model,
+        base_url=configurable.openai_base_url,
+        api_key=configurable.openai_api_key,
+        temperature=temperature,
+        model_kwargs={"response_format": {"type": "json_object"}} if json_mode else {},
+        # JSON responses are parsed whole, only free-text answers are streamed token by token
+        disable_streaming=json_mode,
+        # streamed answers report their token usage in the last chunk
+        stream_usage=True,
+        callbacks=[LLMCallHandler(configurable.openai_model)],
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+
+def get_chat_model(configurable: Optional[Configuration] = None, json_mode: bool = False,
+                   temperature: float = 0.0) -> ChatOpenAI:
+    """Returns a long-lived chat model for the resolved configuration
+
+    Models are keyed by (model, base URL, API key, JSON mode, temperature) and reuse pooled
+    keep-alive HTTP connections, so graph nodes and requests do not pay a new client and TLS
+    handshake per call.
+    """
+    configurable = configurable or Configuration()
+    key = (configurable.openai_model, configurable.openai_base_url, configurable.openai_api_key, json_mode, temperature)
+    registry = _registry()
+    model = registry.get(key)
+    if model is None:
+        with _lock:
+            model = registry.get(key)
+            if model is None:
+                model = registry[key] = _create_chat_model(registry, configurable, json_mode, temperature)
+    return model
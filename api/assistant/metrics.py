@@ -0,0 +1,288 @@
+"""Metrics of the research service in the Prometheus text format
+
+A small, dependency-free implementation of counters, gauges and histograms. Updating a metric
+is a dictionary lookup (cached per label set), a lock and a few arithmetic operations, so it can
+be called on every node run, LLM call and grade. Values that other components already track
+(scheduler, caches, search index) are read by collectors when /metrics is scraped.
+"""
+import time
+import bisect
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds, from a fast cache hit to a long research run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# (metric name, type, help, [(labels, value)]) as returned by collectors
+Sample = Tuple[Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labelvalues: str):
+        """The metric of one label set, keep it to skip the lookup on hot paths"""
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects the labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._child())
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for labelvalues, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, labelvalues))
+            for suffix, extra_labels, value in child.samples():
+                yield self.name + suffix, {**labels, **extra_labels}, value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self._samples())
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield "_total", {}, self.value
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, exposed as <name>_total"""
+    type = "counter"
+    _child = _CounterChild
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def samples(self):
+        yield "", {}, self.value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down"""
+    type = "gauge"
+    _child = _GaugeChild
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self):
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield "_bucket", {"le": _format_value(upper_bound)}, cumulative
+        yield "_sum", {}, self.sum
+        yield "_count", {}, cumulative
+
+
+class Histogram(_Metric):
+    """Observations counted in cumulative buckets, with their sum and count"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Registry:
+    """The metrics and collectors rendered at /metrics"""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """Register a function called on every scrape, it returns (name, type, help, samples) tuples"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Research runs
+NODE_DURATION = REGISTRY.register(Histogram(
+    "research_node_duration_seconds", "Run time of the research graph nodes", ["node"]))
+RESEARCH_RUNS_ACTIVE = REGISTRY.register(Gauge(
+    "research_runs_active", "Research runs in progress"))
+RESEARCH_RUNS = REGISTRY.register(Counter(
+    "research_runs", "Finished research runs", ["status"]))
+RESEARCH_LOOPS = REGISTRY.register(Counter(
+    "research_loops", "Research loops by whether they were the last loop of their run", ["last"]))
+
+# Retrieval and grading
+RETRIEVAL_DURATION = REGISTRY.register(Histogram(
+    "retrieval_duration_seconds", "Hybrid search time including the query embedding"))
+DOCUMENT_GRADES = REGISTRY.register(Counter(
+    "document_grades", "Relevance grades of retrieved chunks", ["grade", "source"]))
+
+# Model calls
+EMBEDDING_REQUESTS = REGISTRY.register(Counter(
+    "embedding_requests", "Requests to the embedding endpoint", ["model", "operation"]))
+EMBEDDING_TEXTS = REGISTRY.register(Counter(
+    "embedding_texts", "Texts sent to the embedding endpoint", ["model"]))
+EMBEDDING_DURATION = REGISTRY.register(Histogram(
+    "embedding_request_duration_seconds", "Embedding request latency", ["model"]))
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "llm_requests", "Chat model requests", ["model", "status"]))
+LLM_DURATION = REGISTRY.register(Histogram(
+    "llm_request_duration_seconds", "Chat model request latency", ["model"]))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens", "Tokens reported by the chat model", ["model", "direction"]))
+
+
+def timed_node(name: str, node: Callable) -> Callable:
+    """Wrap an async graph node to record its run time under the node's name"""
+    histogram = NODE_DURATION.labels(name)
+
+    @functools.wraps(node)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await node(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+@contextmanager
+def research_run():
+    """Count a research run as active while the block runs, and its outcome when it ends"""
+    RESEARCH_RUNS_ACTIVE.inc()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        # the client went away
+        status = "cancelled"
+        raise
+    finally:
+        RESEARCH_RUNS_ACTIVE.dec()
+        RESEARCH_RUNS.labels(status).inc()
+
+
+def stats_collector(prefix: str, stats: Callable[[], Optional[dict]], types: Dict[str, str],
+                    documentation: str = "") -> Callable[[], Iterable[Family]]:
+    """A collector exposing the numeric fields of a stats() dict, e.g. of the scheduler or a cache
+
+    types maps each exposed field to "gauge" or "counter"; counters get the _total suffix.
+    """
+    def collect():
+        values = stats()
+        if not values:
+            return
+        for field, metric_type in types.items():
+            value = values.get(field)
+            if isinstance(value, (int, float)):
+                name = f"{prefix}_{field}" + ("_total" if metric_type == "counter" else "")
+                yield name, metric_type, f"{documentation} {field}".strip(), [({}, float(value))]
+    return collect
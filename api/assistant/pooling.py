@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collects the items submitted within a short window and processes them with one call
+
+    A batch is flushed when max_batch_size items are pending or max_delay seconds after its
+    first item. process receives the list of items and returns one result per item; an
+    exception fails every submission of the batch.
+    """
+    def __init__(self, process: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 64,
+                 max_delay: float = 0.02):
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.batches = 0
+        self.items = 0
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.process([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class RequestPool:
+    """Embedding and grading requests pooled across the concurrent research runs of a batch job
+
+    The pool is made current for the runs with use_pool(); VectorStore.asearch and
+    grade_documents then submit their query embeddings and (query, chunk) grading pairs to it
+    instead of sending one request per run.
+    """
+    def __init__(self, embed_documents: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 grade_pairs: Callable[[List[Tuple[str, Document]]], Awaitable[List[str]]],
+                 embedding_batch_size: int = 64, grading_batch_size: int = 16, max_delay: float = 0.02):
+        self.embeddings = MicroBatcher(embed_documents, max_batch_size=embedding_batch_size, max_delay=max_delay)
+        self.grades = MicroBatcher(grade_pairs, max_batch_size=grading_batch_size, max_delay=max_delay)
+
+    async def embed_query(self, text: str) -> List[float]:
+        return await self.embeddings.submit(text)
+
+    async def grade_pairs(self, pairs: List[Tuple[str, Document]]) -> List[str]:
+        return list(await asyncio.gather(*(self.grades.submit(pair) for pair in pairs)))
+
+    def stats(self) -> dict:
+        return {"embeddings": self.embeddings.stats(), "grades": self.grades.stats()}
+
+
+_current_pool: ContextVar[Optional[RequestPool]] = ContextVar("request_pool", default=None)
+
+
+def current_pool() -> Optional[RequestPool]:
+    """The request pool of the running batch job, if any"""
+    return _current_pool.get()
+
+
+def use_pool(pool: Optional[RequestPool]) -> None:
+    """Make the pool current in this context (tasks created afterwards inherit it)"""
+    _current_pool.set(pool)
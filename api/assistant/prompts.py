@@ -23,6 +23,40 @@ Example output:
 
 Provide your response in JSON format:"""
 
+multi_query_writer_instructions="""Your goal is to generate {num_queries} diverse, targeted web search queries.
+Together the queries will gather information related to a specific topic, each one covering a different aspect of it.
+
+<TOPIC>
+{research_topic}
+</TOPIC>
+
+<FORMAT>
+Format your response as a JSON object with a single key "queries" holding a list of {num_queries} objects with ALL three of these exact keys:
+   - "query": The actual search query string
+   - "aspect": The specific aspect of the topic being researched
+   - "rationale": Brief explanation of why this query is relevant
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{{
+    "queries": [
+        {{
+            "query": "machine learning transformer architecture explained",
+            "aspect": "technical architecture",
+            "rationale": "Understanding the fundamental structure of transformer models"
+        }},
+        {{
+            "query": "transformer model training compute requirements",
+            "aspect": "training cost",
+            "rationale": "Understanding what it takes to train transformer models"
+        }}
+    ]
+}}
+</EXAMPLE>
+
+Provide your response in JSON format:"""
+
 summarizer_instructions="""
 <GOAL>
 Generate a high-quality summary of the web search results and keep it concise / related to the user topic.
@@ -48,6 +82,59 @@ When EXTENDING an existing summary:
 - Start directly with the updated summary, without preamble or titles. Do not use XML tags in the output.  
 < /FORMATTING >"""
 
+incremental_summarizer_instructions="""
+<GOAL>
+Extract what the new search results add to an existing summary about the user topic. Do NOT rewrite the existing summary.
+</GOAL>
+
+<REQUIREMENTS>
+1. Read the existing summary and the new search results carefully.
+2. Only report information that is relevant to the user topic and NOT already in the existing summary.
+3. Put each new fact under the title of the existing section it belongs to, or under a new, short section title.
+4. Write each fact as one self-contained sentence.
+5. If the search results add nothing new, return an empty list of sections.
+</REQUIREMENTS>
+
+<FORMAT>
+Format your response as a JSON object with a single key "sections" holding a list of objects with these exact keys:
+   - "title": The section title
+   - "points": A list of new facts for the section
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{{
+    "sections": [
+        {{
+            "title": "Training cost",
+            "points": ["Training the largest transformer models takes thousands of GPU days."]
+        }}
+    ]
+}}
+</EXAMPLE>
+
+Provide your response in JSON format:"""
+
+summary_compaction_instructions="""
+<GOAL>
+Condense a structured summary about the user topic to at most {max_tokens} tokens.
+</GOAL>
+
+<REQUIREMENTS>
+1. Merge duplicate or overlapping facts and sections.
+2. Drop the facts least relevant to the user topic first.
+3. Keep concrete details such as numbers, names and conditions.
+4. Do not add information that is not in the summary.
+</REQUIREMENTS>
+
+<FORMAT>
+Format your response as a JSON object with a single key "sections" holding a list of objects with these exact keys:
+   - "title": The section title
+   - "points": A list of facts for the section
+</FORMAT>
+
+Provide your response in JSON format:"""
+
 reflection_instructions = """You are an expert research assistant analyzing a summary about {research_topic}.
 
 <GOAL>
@@ -107,4 +194,40 @@ SCORING RULES:
 You MUST provide the binary score as a JSON with a single key 'score' and no premable or explaination:
 {{
     "score": "string" // "yes" or "no"
-}}"""
\ No newline at end of file
+}}"""
+
+batch_document_grading_instructions = """You are a precise document relevance evaluator. Your task is to assess how well each retrieved document matches its search query.
+INPUT:
+{documents}
+
+EVALUATION CRITERIA:
+1. Semantic Relevance:
+- Check if the document contains key concepts from the search query
+- Look for semantic matches, not just exact keyword matches
+- Consider contextual meaning and relationships between terms
+
+2. Information Value:
+- Assess if the document provides useful information for answering the query
+- Consider both direct and indirect relevance
+- Evaluate information density and specificity
+
+SCORING RULES:
+- Score "yes" if the document:
+* Contains relevant concepts or information
+* Would help answer or contextualize the query
+* Has meaningful semantic overlap with the query
+
+- Score "no" if the document:
+* Is completely unrelated to the query topic
+* Contains no useful information for the query
+* Has only incidental keyword matches
+
+You MUST provide exactly one binary score per document, in the order of the documents, as a JSON with a single key 'scores' and no premable or explaination:
+{{
+    "scores": ["string", ...] // "yes" or "no" for each document
+}}"""
+
+batch_document_template = """<DOCUMENT {index}>
+search_query: {search_query}
+document: {document}
+</DOCUMENT {index}>"""
@@ -0,0 +1,159 @@
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a research run is not admitted, retry_after is the suggested wait in seconds"""
+    def __init__(self, retry_after: int, message: str = "Too many queued research runs"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admitted research run
+
+    `async with ticket:` waits until the run may start and releases its slot on exit. cancel()
+    gives up the queue position or slot of a run that was never started (e.g. the client
+    disconnected before the response began); it does nothing once the run has finished.
+    """
+    def __init__(self, scheduler: "FairScheduler", client_id: str):
+        self.scheduler = scheduler
+        self.client_id = client_id
+        self.state = "queued"  # "queued", "running" or "done"
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.waiter: Optional[asyncio.Future] = None
+
+    @property
+    def queued(self) -> bool:
+        return self.state == "queued"
+
+    async def __aenter__(self) -> "Ticket":
+        await self.scheduler._acquire(self)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.scheduler._finish(self)
+
+    def cancel(self) -> None:
+        self.scheduler._finish(self)
+
+
+class FairScheduler:
+    """Admission control and fair scheduling of concurrent research runs
+
+    At most max_concurrent runs execute at once. Further runs wait in per-client queues that
+    are served round-robin, so a client sending many requests cannot starve the others. A run
+    is not admitted when the wait queue (or the client's share of it) is full; callers turn
+    the QueueFullError into a 429 with its retry_after estimate.
+
+    Usage:
+        ticket = scheduler.admit(client_id)   # raises QueueFullError
+        async with ticket:
+            ...
+    """
+    def __init__(self, max_concurrent: int = 8, max_queued: int = 32, max_queued_per_client: Optional[int] = None):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client or max_queued
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.avg_run_seconds: Optional[float] = None
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._wait_times: deque = deque(maxlen=1000)
+
+    def retry_after(self) -> int:
+        """Estimated seconds until a newly queued run would start"""
+        run_seconds = self.avg_run_seconds or 10.0
+        return max(1, math.ceil(run_seconds * (self.queued + 1) / self.max_concurrent))
+
+    def admit(self, client_id: str) -> Ticket:
+        """Admit a run of the client, it either holds a run slot or a place in the queue
+
+        Raises QueueFullError when the queue (or the client's share of it) is full.
+        """
+        ticket = Ticket(self, client_id)
+        if self.running < self.max_concurrent and self.queued == 0:
+            ticket.state = "running"
+            self.running += 1
+        else:
+            queue = self._queues.get(client_id, ())
+            if self.queued >= self.max_queued or len(queue) >= self.max_queued_per_client:
+                self.rejected += 1
+                retry_after = self.retry_after()
+                logger.warning("Rejected research run of %s: %d running, %d queued, retry after %ds",
+                               client_id, self.running, self.queued, retry_after)
+                raise QueueFullError(retry_after)
+            ticket.waiter = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(client_id, deque()).append(ticket)
+            self.queued += 1
+        self.admitted += 1
+        return ticket
+
+    async def _acquire(self, ticket: Ticket) -> None:
+        if ticket.state == "queued":
+            try:
+                await ticket.waiter
+            except asyncio.CancelledError:
+                self._finish(ticket)
+                raise
+        if ticket.state != "running":
+            raise RuntimeError("Research run ticket was cancelled")
+        ticket.started_at = time.monotonic()
+        self._wait_times.append(ticket.started_at - ticket.enqueued_at)
+
+    def _finish(self, ticket: Ticket) -> None:
+        if ticket.state == "queued":
+            queue = self._queues[ticket.client_id]
+            queue.remove(ticket)
+            self.queued -= 1
+            if not queue:
+                del self._queues[ticket.client_id]
+        elif ticket.state == "running":
+            if ticket.started_at is not None:
+                run_seconds = time.monotonic() - ticket.started_at
+                self.avg_run_seconds = run_seconds if self.avg_run_seconds is None else 0.9 * self.avg_run_seconds + 0.1 * run_seconds
+                self.completed += 1
+            self.running -= 1
+            self._dispatch()
+        ticket.state = "done"
+
+    def _dispatch(self) -> None:
+        # Round-robin over clients: the client that was served moves to the back of the line
+        while self.running < self.max_concurrent and self._queues:
+            client_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._queues.move_to_end(client_id)
+            else:
+                del self._queues[client_id]
+            ticket.state = "running"
+            self.running += 1
+            if not ticket.waiter.done():
+                ticket.waiter.set_result(None)
+
+    def stats(self) -> dict:
+        wait_times = sorted(self._wait_times)
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "queued_clients": len(self._queues),
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "avg_wait_seconds": round(sum(wait_times) / len(wait_times), 3) if wait_times else 0.0,
+            "p95_wait_seconds": round(wait_times[int(0.95 * (len(wait_times) - 1))], 3) if wait_times else 0.0,
+            "avg_run_seconds": round(self.avg_run_seconds, 3) if self.avg_run_seconds is not None else None,
+        }
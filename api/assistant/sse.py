@@ -0,0 +1,146 @@
+import json
+import time
+import uuid
+import asyncio
+import contextvars
+from json.encoder import encode_basestring_ascii
+from typing import AsyncIterator, Callable, Optional
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from assistant.streaming import StreamEvent
+
+DONE = "data: [DONE]\n\n"
+
+
+class ChunkEncoder:
+    """Server-sent event encoder for the chat.completion.chunk stream of one response
+
+    The completion id, timestamp and model are serialized once into an envelope template, so a
+    content chunk only costs escaping its text (with the C string encoder of the json module)
+    and a few string concatenations. The role is sent with the first chunk, like the OpenAI API.
+    With progress_as_content, progress messages are also sent as lines of content, so clients
+    that only render the content (the bundled UI) show them.
+    """
+    def __init__(self, model: str, id_prefix: str = "chatcmpl", progress_as_content: bool = False):
+        self.id = f"{id_prefix}-{uuid.uuid4().hex}"
+        self.created = int(time.time())
+        envelope = json.dumps({"id": self.id, "object": "chat.completion.chunk", "created": self.created, "model": model})
+        self._head = "data: " + envelope[:-1] + ',"choices":[{"index":0,"delta":'
+        self._role_sent = False
+        self.progress_as_content = progress_as_content
+
+    def _delta(self, content: Optional[str] = None) -> str:
+        if self._role_sent:
+            return "{}" if content is None else '{"content":' + encode_basestring_ascii(content) + "}"
+        self._role_sent = True
+        if content is None:
+            return '{"role":"assistant"}'
+        return '{"role":"assistant","content":' + encode_basestring_ascii(content) + "}"
+
+    def content(self, text: str) -> str:
+        """A chunk with a content delta"""
+        return self._head + self._delta(text) + ',"finish_reason":null}]}\n\n'
+
+    def progress(self, progress: dict) -> str:
+        """A chunk without content that carries a progress event in an extra field
+
+        OpenAI-compatible clients ignore the field.
+        """
+        content = progress["message"] + "\n\n" if self.progress_as_content and progress.get("message") else None
+        return self._head + self._delta(content) + ',"finish_reason":null}],"progress":' + json.dumps(progress) + "}\n\n"
+
+    def finish(self, finish_reason: str = "stop") -> str:
+        """The last chunk of the completion, with an empty delta and the finish reason"""
+        return self._head + '{},"finish_reason":' + json.dumps(finish_reason) + "}]}\n\n"
+
+    def event(self, event: StreamEvent) -> str:
+        """Encode a content or progress event of a research run"""
+        if event.type == "content":
+            return self.content(event.text)
+        return self.progress({"node": event.node, "message": event.text, **event.data})
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that calls on_close once the response is over
+
+    on_close runs however the response ends: streamed to the end, the client disconnected
+    mid-stream, or the client was gone before the body was started, in which case the body
+    generator never runs (and neither does its finally). A BackgroundTask only runs after a
+    complete response.
+    """
+    def __init__(self, content, on_close: Optional[Callable[[], None]] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+
+async def coalesce(events: AsyncIterator[StreamEvent], max_delay: float = 0.0,
+                   max_bytes: int = 0) -> AsyncIterator[StreamEvent]:
+    """Merge consecutive content deltas into fewer, larger chunks
+
+    Deltas are buffered until max_bytes (UTF-8) are collected or max_delay seconds passed since
+    the first buffered delta, also while no further event arrives (e.g. during a slow node). Any
+    other event and the end of the stream flush the buffer. Without limits the events pass
+    through as is.
+    """
+    if not max_delay and not max_bytes:
+        async for event in events:
+            yield event
+        return
+
+    # The next event is read in a task, so a flush on timeout does not cancel the upstream; all reads
+    # share one context, the upstream may set a context variable in one step and reset it in another
+    iterator = aiter(events)
+    context = contextvars.copy_context()
+
+    async def read_next():
+        return await anext(iterator, None)
+
+    buffer, size, started, node = [], 0, 0.0, None
+    next_event = None
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.create_task(read_next(), context=context)
+            if buffer and max_delay:
+                try:
+                    event = await asyncio.wait_for(asyncio.shield(next_event),
+                                                   max(started + max_delay - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    yield StreamEvent("content", "".join(buffer), node)
+                    buffer, size = [], 0
+                    continue
+            else:
+                event = await next_event
+            next_event = None
+            if event is None:
+                break
+
+            if event.type == "content":
+                if not buffer:
+                    started, node = time.monotonic(), event.node
+                buffer.append(event.text)
+                size += len(event.text.encode("utf-8"))
+                if (max_bytes and size >= max_bytes) or (max_delay and time.monotonic() - started >= max_delay):
+                    yield StreamEvent("content", "".join(buffer), node)
+                    buffer, size = [], 0
+                continue
+
+            if buffer:
+                yield StreamEvent("content", "".join(buffer), node)
+                buffer, size = [], 0
+            yield event
+    finally:
+        if next_event is not None:
+            next_event.cancel()
+
+    if buffer:
+        yield StreamEvent("content", "".join(buffer), node)
@@ -2,15 +2,34 @@ import operator
 from dataclasses import dataclass, field
 from typing_extensions import TypedDict, Annotated
 
+def merge_chunk_refs(existing: dict, new: dict) -> dict:
+    """Reducer of the chunk references, a chunk keeps the reference of the search that found it first"""
+    merged = dict(existing or {})
+    for point_id, chunk_ref in (new or {}).items():
+        merged.setdefault(point_id, chunk_ref)
+    return merged
+
 @dataclass(kw_only=True)
 class SummaryState:
     research_topic: str = field(default=None) # Report topic     
     search_query: str = field(default=None) # Search query
+    search_queries: list = field(default_factory=list) # Search queries of the current loop, searched in parallel
+    search_branch_results: Annotated[list, operator.add] = field(default_factory=list) # Point ids of the relevant chunks of each parallel search
+    chunk_refs: Annotated[dict, merge_chunk_refs] = field(default_factory=dict) # Distinct relevant chunks by point id (file path, chunk id, title, grade, score), no text
+    loop_chunk_ids: list = field(default_factory=list) # Point ids of the chunks to summarize in the current loop
+    loop_stats: Annotated[list, operator.add] = field(default_factory=list) # New chunk, relevance and summary growth signals of each loop
+    stop_reason: str = field(default=None) # Set when the current loop is the last one
     web_research_results: Annotated[list, operator.add] = field(default_factory=list) 
-    document_search_results: Annotated[list, operator.add] = field(default_factory=list)
     sources_gathered: Annotated[list, operator.add] = field(default_factory=list) 
     research_loop_count: int = field(default=0) # Research loop count
     running_summary: str = field(default=None) # Final report
+    summary_sections: list = field(default_factory=list) # Structured summary of the incremental summary mode
+    summary_growth: float = field(default=None) # Growth of the incremental summary by the last loop, before compaction
+
+@dataclass(kw_only=True)
+class DocumentSearchState:
+    search_query: str = field(default=None) # Search query of this branch
+    research_loop_count: int = field(default=0) # Research loop the search belongs to
 
 @dataclass(kw_only=True)
 class SummaryStateInput:
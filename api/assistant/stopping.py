@@ -0,0 +1,67 @@
+import logging
+from typing import List, Optional
+
+from assistant.configuration import Configuration
+
+logger = logging.getLogger(__name__)
+
+
+def loop_stats(research_loop_count: int, search_branch_results: List[dict], loop_chunk_ids: List[str],
+               chunk_refs: dict, summary_tokens: int, previous: Optional[dict] = None,
+               summary_growth: Optional[float] = None) -> dict:
+    """Retrieval and summary signals of the research loop whose searches ran at research_loop_count
+
+    - new_chunk_fraction: share of the loop's relevant chunks that no earlier loop found
+    - relevant_fraction: share of the retrieved chunks graded as relevant
+    - summary_growth: relative growth of the summary by the previous loop's summarize step
+      (None before the second summary). The incremental summary mode passes the growth it
+      measured before compacting; otherwise it is computed from the summary sizes.
+    """
+    branches = [branch for branch in search_branch_results if branch["loop"] == research_loop_count]
+    retrieved = sum(branch["retrieved"] for branch in branches)
+    relevant = sum(len(branch["chunk_ids"]) for branch in branches)
+    new_chunks = sum(chunk_refs[point_id]["loop"] == research_loop_count for point_id in loop_chunk_ids)
+
+    if summary_growth is None and previous is not None and previous["summary_tokens"]:
+        summary_growth = (summary_tokens - previous["summary_tokens"]) / previous["summary_tokens"]
+
+    return {
+        "loop": research_loop_count + 1,
+        "chunks": len(loop_chunk_ids),
+        "new_chunks": new_chunks,
+        "new_chunk_fraction": new_chunks / len(loop_chunk_ids) if loop_chunk_ids else 0.0,
+        "relevant_fraction": relevant / retrieved if retrieved else 0.0,
+        "summary_tokens": summary_tokens,
+        "summary_growth": summary_growth,
+    }
+
+
+def stop_reason(stats: dict, configurable: Configuration) -> Optional[str]:
+    """Why the research should stop after summarizing this loop, None to continue
+
+    max_research_loops is a hard cap. With adaptive_stop, the research also ends once a
+    follow-up loop mostly finds chunks already seen, finds few relevant chunks, or the previous
+    summary barely grew. A threshold of 0 disables its check; the first loop never stops early.
+    """
+    if stats["loop"] > configurable.max_research_loops:
+        return f"reached max_research_loops ({configurable.max_research_loops})"
+    if not configurable.adaptive_stop or stats["loop"] < 2:
+        return None
+
+    if stats["new_chunk_fraction"] < configurable.stop_min_new_chunk_fraction:
+        return (f"{stats['new_chunks']}/{stats['chunks']} new chunks "
+                f"(below {configurable.stop_min_new_chunk_fraction:.0%})")
+    if stats["relevant_fraction"] < configurable.stop_min_relevant_fraction:
+        return (f"{stats['relevant_fraction']:.0%} of the retrieved chunks are relevant "
+                f"(below {configurable.stop_min_relevant_fraction:.0%})")
+    if stats["summary_growth"] is not None and stats["summary_growth"] < configurable.stop_min_summary_growth:
+        return (f"the summary grew by {stats['summary_growth']:.0%} "
+                f"(below {configurable.stop_min_summary_growth:.0%})")
+    return None
+
+
+def log_decision(stats: dict, reason: Optional[str]) -> None:
+    growth = "n/a" if stats["summary_growth"] is None else f"{stats['summary_growth']:+.0%}"
+    logger.info("Research loop %d: %d/%d new chunks, %.0f%% relevant, summary growth %s -> %s",
+                stats["loop"], stats["new_chunks"], stats["chunks"], 100 * stats["relevant_fraction"], growth,
+                f"stop, {reason}" if reason else "continue")
@@ -0,0 +1,99 @@
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional
+
+from langchain_core.messages import AIMessageChunk
+
+from assistant.metrics import research_run
+
+# Tag of the summarizer call that writes the final answer, only its tokens are streamed as content
+FINAL_ANSWER_TAG = "final_answer"
+
+# Prefix finalize_summary puts in front of the running summary
+SUMMARY_HEADER = "## Summary\n\n"
+SOURCES_HEADER = "\n\n ### Sources:\n"
+
+
+@dataclass
+class StreamEvent:
+    """An event of a streamed research run
+
+    type is "progress" (a short status message of a node), "content" (a delta of the final
+    answer) or "final" (the complete final answer, sent last).
+    """
+    type: str
+    text: str
+    node: Optional[str] = None
+    data: dict = field(default_factory=dict)
+
+
+def _progress_events(node: str, update: Any, research_loop_count: int):
+    if not isinstance(update, dict):
+        return
+
+    if node == "generate_query":
+        for search_query in update.get("search_queries") or [update.get("search_query")]:
+            yield StreamEvent("progress", f"Searching for: {search_query}", node, {"search_query": search_query})
+
+    elif node == "document_search":
+        for branch in update.get("search_branch_results", []):
+            relevant, retrieved = len(branch["chunk_ids"]), branch["retrieved"]
+            yield StreamEvent("progress", f"Graded {relevant}/{retrieved} documents relevant for: {branch['search_query']}",
+                              node, {"search_query": branch["search_query"], "relevant": relevant, "retrieved": retrieved})
+
+    elif node == "merge_search_results":
+        sources = len(update.get("loop_chunk_ids", []))
+        yield StreamEvent("progress", f"Found {sources} relevant sources", node, {"sources": sources})
+        if update.get("stop_reason"):
+            yield StreamEvent("progress", f"Writing the final summary: {update['stop_reason']}", node,
+                              {"stop_reason": update["stop_reason"]})
+
+    elif node == "summarize_sources":
+        yield StreamEvent("progress", f"Summarized sources of research loop {research_loop_count}", node,
+                          {"research_loop_count": research_loop_count})
+
+    elif node == "reflect_on_summary":
+        search_query = update.get("search_query")
+        yield StreamEvent("progress", f"Follow-up query: {search_query}", node, {"search_query": search_query})
+
+
+async def stream_research(graph, inputs: dict, config: dict) -> AsyncIterator[StreamEvent]:
+    """Run the research graph and stream node progress events and the final answer's tokens
+
+    Progress events are sent as soon as a node finishes. Only the tokens of the final summarizer
+    call are streamed as content, followed by the sources once finalize_summary has run. The
+    concatenated content deltas equal the final answer.
+    """
+    streamed = ""
+    research_loop_count = 0
+
+    with research_run():
+        async for stream_mode, chunk in graph.astream(inputs, config, stream_mode=["messages", "updates"]):
+            if stream_mode == "messages":
+                message, metadata = chunk
+                if isinstance(message, AIMessageChunk) and message.content and FINAL_ANSWER_TAG in metadata.get("tags", ()):
+                    delta = message.content if streamed else SUMMARY_HEADER + message.content
+                    streamed += delta
+                    yield StreamEvent("content", delta, metadata.get("langgraph_node"))
+                continue
+
+            for node, update in chunk.items():
+                if node == "merge_search_results" and isinstance(update, dict):
+                    research_loop_count = update.get("research_loop_count", research_loop_count)
+
+                if node == "finalize_summary":
+                    running_summary = update["running_summary"]
+                    # send whatever was not streamed token by token (the sources, or everything if the
+                    # model did not stream or post-processing changed the summary)
+                    if running_summary.startswith(streamed):
+                        remainder = running_summary[len(streamed):]
+                    elif SOURCES_HEADER in running_summary:
+                        remainder = running_summary[running_summary.index(SOURCES_HEADER):]
+                    else:
+                        remainder = ""
+                    if remainder:
+                        yield StreamEvent("content", remainder, node)
+                    yield StreamEvent("final", running_summary, node)
+                    continue
+
+                for event in _progress_events(node, update, research_loop_count):
+                    yield event
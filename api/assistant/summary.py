@@ -0,0 +1,148 @@
+import json
+import logging
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from assistant.configuration import Configuration
+from assistant.context import get_token_counter
+from assistant.llm import get_chat_model
+from assistant.prompts import incremental_summarizer_instructions, summary_compaction_instructions
+
+logger = logging.getLogger(__name__)
+
+# A compacted summary is condensed to this share of the compaction threshold, so it is not compacted again on the next loop
+COMPACTION_TARGET_RATIO = 0.6
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def parse_sections(content: str) -> List[dict]:
+    """Parse the {"sections": [{"title", "points"}]} response of the incremental summarizer
+
+    Malformed entries are skipped; a response that is no JSON object yields no sections.
+    """
+    try:
+        response = json.loads(content)
+    except (TypeError, ValueError):
+        logger.warning("Incremental summarizer returned no JSON: %.200s", content)
+        return []
+    if not isinstance(response, dict) or not isinstance(response.get("sections"), list):
+        return []
+
+    sections = []
+    for section in response["sections"]:
+        if not isinstance(section, dict):
+            continue
+        title = str(section.get("title") or "").strip()
+        points = section.get("points") or []
+        if isinstance(points, str):
+            points = [points]
+        points = [str(point).strip() for point in points if str(point).strip()]
+        if title and points:
+            sections.append({"title": title, "points": points})
+    return sections
+
+
+def merge_sections(sections: List[dict], delta: List[dict]) -> Tuple[List[dict], int]:
+    """Merge a delta into the structured summary, returns the merged sections and the number of new points
+
+    Sections are matched on their normalized title and points already in a section are skipped.
+    The input sections are not modified.
+    """
+    merged = [{"title": section["title"], "points": list(section["points"])} for section in sections]
+    by_title = {_normalize(section["title"]): section for section in merged}
+    added = 0
+    for section in delta:
+        target = by_title.get(_normalize(section["title"]))
+        if target is None:
+            target = by_title[_normalize(section["title"])] = {"title": section["title"], "points": []}
+            merged.append(target)
+        known = {_normalize(point) for point in target["points"]}
+        for point in section["points"]:
+            if _normalize(point) not in known:
+                known.add(_normalize(point))
+                target["points"].append(point)
+                added += 1
+    return [section for section in merged if section["points"]], added
+
+
+def render_sections(sections: List[dict]) -> str:
+    """Render the structured summary as markdown, one heading per section and one bullet per point"""
+    return "\n\n".join(
+        f"### {section['title']}\n" + "\n".join(f"- {point}" for point in section["points"])
+        for section in sections
+    )
+
+
+async def compact_sections(sections: List[dict], research_topic: str, max_tokens: int,
+                           configurable: Configuration) -> List[dict]:
+    """Condense the structured summary to about max_tokens with one LLM call
+
+    Returns the input sections when the model returns nothing usable.
+    """
+    llm_json_mode = get_chat_model(configurable, json_mode=True)
+    result = await llm_json_mode.ainvoke(
+        [SystemMessage(content=summary_compaction_instructions.format(max_tokens=max_tokens)),
+         HumanMessage(content=(
+             f"<User Input> \n {research_topic} \n <User Input>\n\n"
+             f"<Summary> \n {json.dumps({'sections': sections})} \n <Summary>"
+         ))]
+    )
+    compacted = parse_sections(result.content)
+    if not compacted:
+        logger.warning("Summary compaction returned no sections, keeping the summary as is")
+        return sections
+    return compacted
+
+
+async def summarize_incrementally(research_topic: str, sections: List[dict], search_results: str,
+                                  configurable: Configuration) -> Tuple[List[dict], str, Optional[float]]:
+    """One loop of the incremental summary mode, returns the new sections, the rendered summary and its growth
+
+    The model only writes the facts the search results add (a delta), which are merged into the
+    structured summary. The existing summary in the prompt never exceeds summary_compact_tokens:
+    a summary that grows beyond it is condensed, so the prompt and the summary stay about the
+    same size however many research loops run. The growth is measured before the compaction
+    (None for the first summary), so condensing the summary does not read as a loop that
+    added nothing.
+    """
+    counter = get_token_counter(configurable.openai_model)
+    previous_tokens = counter.count(render_sections(sections))
+    existing_summary, _, _ = counter.truncate(render_sections(sections), configurable.summary_compact_tokens)
+
+    if existing_summary:
+        human_message_content = (
+            f"<User Input> \n {research_topic} \n <User Input>\n\n"
+            f"<Existing Summary> \n {existing_summary} \n <Existing Summary>\n\n"
+            f"<New Search Results> \n {search_results} \n <New Search Results>"
+        )
+    else:
+        human_message_content = (
+            f"<User Input> \n {research_topic} \n <User Input>\n\n"
+            f"<Search Results> \n {search_results} \n <Search Results>"
+        )
+
+    llm_json_mode = get_chat_model(configurable, json_mode=True)
+    result = await llm_json_mode.ainvoke(
+        [SystemMessage(content=incremental_summarizer_instructions),
+         HumanMessage(content=human_message_content)]
+    )
+    sections, added = merge_sections(sections, parse_sections(result.content))
+
+    running_summary = render_sections(sections)
+    summary_tokens = counter.count(running_summary)
+    growth = (summary_tokens - previous_tokens) / previous_tokens if previous_tokens else None
+    logger.info("Incremental summary: %d new points, %d sections, %d tokens (prompt %d tokens)",
+                added, len(sections), summary_tokens,
+                counter.count(incremental_summarizer_instructions) + counter.count(human_message_content))
+
+    if summary_tokens > configurable.summary_compact_tokens:
+        max_tokens = int(configurable.summary_compact_tokens * COMPACTION_TARGET_RATIO)
+        sections = await compact_sections(sections, research_topic, max_tokens, configurable)
+        running_summary = render_sections(sections)
+        logger.info("Compacted the summary from %d to %d tokens", summary_tokens, counter.count(running_summary))
+
+    return sections, running_summary, growth
@@ -0,0 +1,252 @@
+"""Opt-in span traces of research runs, without LangSmith
+
+A trace records a tree of spans for one run: the graph nodes and, below them, the retrieval,
+embedding, Qdrant, grading and LLM calls, each with its start, duration and payload sizes.
+Traces are kept in memory for the /v1/traces endpoints and can be written to a directory as
+JSON or in the Chrome trace event format (chrome://tracing, https://ui.perfetto.dev).
+
+The trace and the current span live in context variables, so they follow the run into the
+tasks LangGraph creates for its nodes and into asyncio.to_thread calls. Without an active trace
+span() and start_span() return immediately.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+import itertools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _lane() -> str:
+    # spans of one task (or worker thread) nest properly, so each gets its own row in the timeline
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return f"task {task.get_name()}"
+    return f"thread {threading.current_thread().name}"
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "category", "start", "duration", "lane", "attributes")
+
+    def __init__(self, trace: "Trace", span_id: int, parent_id: Optional[int], name: str, category: str,
+                 attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.category = category
+        self.start = time.perf_counter() - trace.t0
+        self.duration: Optional[float] = None
+        self.lane = _lane()
+        self.attributes = attributes
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, **attributes: Any) -> None:
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.trace.t0 - self.start
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {"span_id": self.span_id, "parent_id": self.parent_id, "name": self.name, "category": self.category,
+                "start_ms": round(1000 * self.start, 3),
+                "duration_ms": round(1000 * self.duration, 3) if self.duration is not None else None,
+                "attributes": self.attributes}
+
+
+class Trace:
+    """The spans of one research run"""
+    def __init__(self, trace_id: str, name: str = "research", **attributes: Any):
+        self.trace_id = trace_id
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Span] = []
+        self._ids = itertools.count(1)
+
+    def start_span(self, name: str, category: str = "", parent: Optional[Span] = None, **attributes: Any) -> Span:
+        span = Span(self, next(self._ids), parent.span_id if parent is not None else None, name, category, attributes)
+        self.spans.append(span)
+        return span
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.t0
+
+    def summary(self) -> dict:
+        return {"trace_id": self.trace_id, "name": self.name, "started_at": self.started_at,
+                "duration_ms": round(1000 * self.duration, 3) if self.duration is not None else None,
+                "spans": len(self.spans), "attributes": self.attributes}
+
+    def to_dict(self) -> dict:
+        """The trace with its spans as a tree (children ordered by start)"""
+        nodes = {span.span_id: {**span.to_dict(), "children": []} for span in self.spans}
+        roots = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            parent = nodes.get(span.parent_id)
+            (parent["children"] if parent is not None else roots).append(nodes[span.span_id])
+        return {**self.summary(), "spans": roots}
+
+    def to_chrome(self) -> dict:
+        """The trace in the Chrome trace event format, one row per task or worker thread"""
+        lanes = {}
+        for span in sorted(self.spans, key=lambda span: span.start):
+            lanes.setdefault(span.lane, len(lanes) + 1)
+        events = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": f"{self.name} {self.trace_id}"}}]
+        events.extend({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": lane}}
+                      for lane, tid in lanes.items())
+        for span in self.spans:
+            events.append({
+                "name": span.name, "cat": span.category or "span", "ph": "X", "pid": 1, "tid": lanes[span.lane],
+                "ts": round(1e6 * span.start, 3), "dur": round(1e6 * (span.duration or 0.0), 3),
+                "args": span.attributes,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.summary()}
+
+
+class TraceStore:
+    """The most recent traces in memory, optionally written to a directory as they finish"""
+    def __init__(self, max_traces: int = 50, directory: Optional[str] = None, format: str = "chrome"):
+        self.max_traces = max_traces
+        self.directory = directory
+        self.format = format
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces[trace.trace_id] = trace
+            self._traces.move_to_end(trace.trace_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        if self.directory:
+            self.dump(trace)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        return self._traces.get(trace_id)
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            return [trace.summary() for trace in reversed(self._traces.values())]
+
+    def dump(self, trace: Trace) -> Optional[str]:
+        path = os.path.join(self.directory, f"{trace.trace_id}.{'trace' if self.format == 'chrome' else 'spans'}.json")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(trace.to_chrome() if self.format == "chrome" else trace.to_dict(), f, default=str)
+        except OSError as e:
+            logger.warning("Could not write trace %s: %s", trace.trace_id, e)
+            return None
+        return path
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_run(trace_id: str, store: TraceStore, name: str = "research", **attributes: Any):
+    """Trace the run in the block and add the trace to the store when it ends"""
+    trace = Trace(trace_id, name, **attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        # an async generator may be closed from another context
+        try:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+        except ValueError:
+            pass
+        store.add(trace)
+
+
+def start_span(name: str, category: str = "", **attributes: Any) -> Optional[Span]:
+    """Start a child span of the current span that the caller ends, e.g. in callbacks; None when not tracing"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    return trace.start_span(name, category, _current_span.get(), **attributes)
+
+
+@contextmanager
+def span(name: str, category: str = "", **attributes: Any):
+    """Record the block as a span; spans started in the block become its children"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, category, _current_span.get(), **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.end()
+        _current_span.reset(token)
+
+
+def traced_node(name: str, node: Callable) -> Callable:
+    """Wrap an async graph node to record it as a span with the size of its state update"""
+    @functools.wraps(node)
+    async def wrapper(*args, **kwargs):
+        if _current_trace.get() is None:
+            return await node(*args, **kwargs)
+        with span(name, "node") as node_span:
+            update = await node(*args, **kwargs)
+            if isinstance(update, dict):
+                node_span.set(update_keys=sorted(update), update_bytes=len(json.dumps(update, default=str)))
+            return update
+    return wrapper
+
+
+def traceable(func: Optional[Callable] = None, *, name: Optional[str] = None, category: str = "function"):
+    """Record calls of the function as spans of the current trace
+
+    Drop-in for langsmith.traceable: when langsmith is installed the function is also traced
+    there (LangSmith itself stays off unless LANGSMITH_TRACING is set).
+    """
+    def decorate(func: Callable) -> Callable:
+        span_name = name or func.__name__
+        try:
+            from langsmith import traceable as langsmith_traceable
+            traced = langsmith_traceable(func)
+        except ImportError:
+            traced = func
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, category):
+                    return await traced(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return traced(*args, **kwargs)
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
@@ -1,16 +1,21 @@
 import os
 import pickle
+import multiprocessing
 import requests
-from typing import Dict, Any, List, Optional
-from langsmith import traceable
-from assistant.vectorstore import VectorStore
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from assistant.tracing import traceable
+from assistant.vectorstore import VectorStore, chunk_content_hash
+from assistant.context import build_sources_context
 #from tavily import TavilyClient
 #from duckduckgo_search import DDGS
 
-def deduplicate_and_format_sources(search_response, max_tokens_per_source, include_raw_content=False):
+def deduplicate_and_format_sources(search_response, max_tokens_per_source, include_raw_content=False,
+                                   max_total_tokens=None, model=None):
     """
     Takes either a single search response or list of responses from search APIs and formats them.
-    Limits the raw_content to approximately max_tokens_per_source.
+    Limits the content (and raw_content) of each source to max_tokens_per_source tokens and the
+    whole string to max_total_tokens, counted with the tokenizer of the model.
     include_raw_content specifies whether to include the raw_content from Tavily in the formatted string.
     
     Args:
@@ -21,44 +26,9 @@ def deduplicate_and_format_sources(search_response, max_tokens_per_source, inclu
     Returns:
         str: Formatted string with deduplicated sources
     """
-    # Convert input to list of results
-    if isinstance(search_response, dict):
-        sources_list = search_response['results']
-    elif isinstance(search_response, list):
-        sources_list = []
-        for response in search_response:
-            if isinstance(response, dict) and 'results' in response:
-                sources_list.extend(response['results'])
-            else:
-                sources_list.extend(response)
-    else:
-        raise ValueError("Input must be either a dict with 'results' or a list of search results")
-    
-    # Deduplicate by URL
-    unique_sources = {}
-    for source in sources_list:
-        if source['url'] not in unique_sources:
-            unique_sources[source['url']] = source
-    
-    # Format output
-    formatted_text = "Sources:\n\n"
-    for i, source in enumerate(unique_sources.values(), 1):
-        formatted_text += f"Source {source['title']}:\n===\n"
-        formatted_text += f"URL: {source['url']}\n===\n"
-        formatted_text += f"Most relevant content from source: {source['content']}\n===\n"
-        if include_raw_content:
-            # Using rough estimate of 4 characters per token
-            char_limit = max_tokens_per_source * 4
-            # Handle None raw_content
-            raw_content = source.get('raw_content', '')
-            if raw_content is None:
-                raw_content = ''
-                print(f"Warning: No raw_content found for source {source['url']}")
-            if len(raw_content) > char_limit:
-                raw_content = raw_content[:char_limit] + "... [truncated]"
-            formatted_text += f"Full source content limited to {max_tokens_per_source} tokens: {raw_content}\n\n"
-                
-    return formatted_text.strip()
+    return build_sources_context(search_response, max_tokens_per_source=max_tokens_per_source,
+                                 max_total_tokens=max_total_tokens, include_raw_content=include_raw_content,
+                                 model=model).text
 
 def format_sources(search_results):
     """Format search results into a bullet-point list of sources.
@@ -84,6 +54,66 @@ def load_pkl_files(parsed_document_dir:str="./parsed_documents"):
                 pkl_dict[key] = pickle.load(f)
     return pkl_dict
 
+def _load_parsed_document(pkl_path:str) -> Tuple[str, str, List[Tuple[str, dict]]]:
+    """Unpickles a parsed document in a worker process and reduces its chunks to plain
+    (page_content, metadata) tuples, so only the fields that are indexed are sent back."""
+    with open(pkl_path, 'rb') as f:
+        parsed_document = pickle.load(f)
+    chunks = [(doc.page_content, {
+        "filename": doc.metadata["filename"],
+        "file_path": doc.metadata["paper_path"],
+        "chunk_id": doc.metadata["chunk_num"],
+        "context": doc.metadata["context"]}) for doc in parsed_document['chunks']]
+    return os.path.splitext(os.path.basename(pkl_path))[0], chunk_content_hash(chunks), chunks
+
+def _worker_context():
+    """Start method of the loader processes: forkserver where available, spawn otherwise
+
+    The index is built in a thread while other threads import modules and log; forking the
+    process could hand the workers locks that are held and never released. The fork server
+    imports this module once, so its workers start without importing it again.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+def iter_parsed_documents(parsed_document_dir:str="./parsed_documents", max_workers:Optional[int]=None,
+                          prefetch:Optional[int]=None) -> Iterator[Tuple[str, str, List[Tuple[str, dict]]]]:
+    """Loads the .pkl files from directory in a process pool and yields them as they finish loading
+    
+    At most `prefetch` files are loaded ahead of the consumer, so memory stays bounded while
+    the consumer (embedding and upserting) overlaps with loading the next files.
+    
+    Yields:
+        tuple: (key, content_hash, chunks) where chunks is a list of (page_content, metadata) tuples
+    """
+    pkl_paths = sorted(
+        os.path.join(parsed_document_dir, pkl_file)
+        for pkl_file in os.listdir(parsed_document_dir) if pkl_file.endswith('.pkl')
+    )
+    if not pkl_paths:
+        return
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(pkl_paths))
+    prefetch = max(prefetch or 2 * max_workers, 1)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=_worker_context()) as executor:
+        pending_paths = iter(pkl_paths)
+        pending = set()
+        for pkl_path in pending_paths:
+            pending.add(executor.submit(_load_parsed_document, pkl_path))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                # refill the window before handing the document to the consumer
+                next_path = next(pending_paths, None)
+                if next_path is not None:
+                    pending.add(executor.submit(_load_parsed_document, next_path))
+                yield future.result()
+
 @traceable
 def duckduckgo_search(query: str, max_results: int = 3, fetch_full_page: bool = False) -> Dict[str, List[Dict[str, str]]]:
     """Search the web using DuckDuckGo.
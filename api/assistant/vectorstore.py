@@ -1,27 +1,213 @@
+import os
+import json
+import asyncio
 import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 
 from qdrant_client import QdrantClient, models
 from langchain_openai import OpenAIEmbeddings
-from langchain_qdrant import FastEmbedSparse, QdrantVectorStore, RetrievalMode
+from langchain_qdrant import FastEmbedSparse, QdrantVectorStore, RetrievalMode, SparseEmbeddings
 from langchain_core.documents import Document
-from typing import List
+from langchain_core.embeddings import Embeddings
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from assistant.configuration import Configuration
+from assistant.embeddings import MeteredEmbeddings, with_embedding_cache
+from assistant.metrics import RETRIEVAL_DURATION
+from assistant.tracing import span
+from assistant.pooling import current_pool
+
+logger = logging.getLogger(__name__)
+
+# Namespace for the stable, content independent point ids of document chunks
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c3d4e-2b8a-4c5e-9f0d-7a1b2c3d4e5f")
+
+def chunk_point_id(filename:str, chunk_id) -> str:
+    """Stable Qdrant point id for a chunk, derived from its document filename and chunk number"""
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{filename}#{chunk_id}"))
+
+def chunk_content_hash(chunks:Iterable[Tuple[str, dict]]) -> str:
+    """Hash of the (page_content, metadata) chunks of a document, used to detect changed documents"""
+    digest = hashlib.sha256()
+    for page_content, metadata in chunks:
+        digest.update(page_content.encode("utf-8"))
+        digest.update(json.dumps(metadata, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+def document_content_hash(documents:List[Document]) -> str:
+    """Hash of the chunk texts and metadata of a document, used to detect changed documents"""
+    return chunk_content_hash((doc.page_content, doc.metadata) for doc in documents)
+
+def batched(iterable:Iterable, batch_size:int) -> Iterator[list]:
+    """Split an iterable into lists of at most batch_size items, lazily"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+class IndexManifest:
+    """Side manifest of the indexed documents: filename -> content hash and point ids
+    
+    Gives O(1) "already indexed" checks by filename or content hash, independent of the
+    collection size. It is persisted as JSON next to the Qdrant storage when the index is on disk.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.documents: Dict[str, dict] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.documents = json.load(f)["documents"]
+        self._by_hash = {
+            entry["content_hash"]: filename for filename, entry in self.documents.items() if entry["content_hash"]
+        }
+
+    def __contains__(self, filename:str) -> bool:
+        return filename in self.documents
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def get(self, filename:str) -> Optional[dict]:
+        return self.documents.get(filename)
+
+    def filename_for_hash(self, content_hash:str) -> Optional[str]:
+        return self._by_hash.get(content_hash)
+
+    def set(self, filename:str, content_hash:Optional[str], point_ids:List[str]):
+        self.remove(filename)
+        self.documents[filename] = {"content_hash": content_hash, "point_ids": point_ids, "indexed_at": time.time()}
+        if content_hash:
+            self._by_hash[content_hash] = filename
+
+    def remove(self, filename:str) -> Optional[dict]:
+        entry = self.documents.pop(filename, None)
+        if entry and entry["content_hash"]:
+            self._by_hash.pop(entry["content_hash"], None)
+        return entry
+
+    def save(self):
+        if not self.path:
+            return
+        # write atomically so a crash never leaves a truncated manifest behind
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"documents": self.documents}, f)
+        os.replace(tmp_path, self.path)
+
+class IngestionProgress:
+    """Tracks ingestion throughput and logs it at most every report_interval seconds"""
+    def __init__(self, report_interval: float = 5.0):
+        self.report_interval = report_interval
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.documents = 0
+        self.skipped_documents = 0
+        self.chunks = 0
+        self._last_report = self.started_at
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.elapsed if self.elapsed > 0 else 0.0
+
+    def add_chunks(self, count: int):
+        self.chunks += count
+        now = time.monotonic()
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        logger.info(
+            "Ingestion: %d documents indexed, %d skipped, %d chunks in %.1fs (%.1f chunks/s)",
+            self.documents, self.skipped_documents, self.chunks, self.elapsed, self.chunks_per_second,
+        )
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+        self.report()
+
+    def as_dict(self) -> dict:
+        return {
+            "documents": self.documents,
+            "skipped_documents": self.skipped_documents,
+            "chunks": self.chunks,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "chunks_per_second": round(self.chunks_per_second, 1),
+            "finished": self.finished_at is not None,
+        }
+
+@dataclass
+class _PendingDocument:
+    """A document moving through the ingestion pipeline"""
+    filename: str
+    content_hash: str
+    point_ids: List[str] = field(default_factory=list)
+    chunk_ids: set = field(default_factory=set)
+    pending_batches: int = 0
+    submitted: bool = False
 
 class VectorStore:
-    """In memory vector store - supports dense and sparse embeddings"""
-    def __init__(self):
-        # in-memory
-        self.client = QdrantClient(":memory:")
-        self.collection_name="in_memory_collection"
+    """Qdrant vector store - supports dense and sparse embeddings
+    
+    The index lives in memory by default. When a path is given (or VECTORSTORE_PATH is set)
+    Qdrant's local on-disk storage is used instead, so an existing collection is reopened on
+    start-up and only documents that are not yet indexed have to be embedded.
+    The embedding models can be passed in (offline benchmarks use deterministic fakes); they
+    default to the OpenAI embeddings behind the embedding cache and FastEmbed BM25.
+    """
+    def __init__(self, path: Optional[str] = None, collection_name: Optional[str] = None,
+                 dense_embedding_model: Optional[Embeddings] = None,
+                 sparse_embedding_model: Optional[SparseEmbeddings] = None):
+        self.path = path or Configuration.vectorstore_path
+        self.collection_name = collection_name or Configuration.vectorstore_collection
+
+        if Configuration.qdrant_url:
+            # Qdrant server, the local path (if any) only holds the manifest
+            self.client = QdrantClient(url=Configuration.qdrant_url, api_key=Configuration.qdrant_api_key)
+            if self.path:
+                os.makedirs(self.path, exist_ok=True)
+        elif self.path:
+            # persistent, local on-disk storage
+            self.client = QdrantClient(path=self.path)
+        else:
+            # in-memory
+            self.client = QdrantClient(":memory:")
+
+        # local mode is not thread-safe, so upserts are serialized there
+        self._upsert_lock = nullcontext() if Configuration.qdrant_url else threading.Lock()
+        self._embedding_pool = ThreadPoolExecutor(
+            max_workers=Configuration.ingest_max_concurrent_embeddings, thread_name_prefix="ingest-embed")
+        self._upsert_pool = ThreadPoolExecutor(
+            max_workers=Configuration.ingest_upsert_workers, thread_name_prefix="ingest-upsert")
+        self.progress = IngestionProgress()
+        # incremented whenever the indexed documents change
+        self.version = 0
 
         # Initialize dense and sparse embedding models
-        self.dense_embedding_model = OpenAIEmbeddings(
-            model=Configuration.openai_embedding_model,
-            openai_api_key=Configuration.openai_api_key,
-            openai_api_base=Configuration.openai_base_url
+        # dense embeddings are memoized on disk, shared by ingestion and query-time retrieval
+        self.dense_embedding_model = dense_embedding_model or with_embedding_cache(
+            MeteredEmbeddings(
+                OpenAIEmbeddings(
+                    model=Configuration.openai_embedding_model,
+                    openai_api_key=Configuration.openai_api_key,
+                    openai_api_base=Configuration.openai_base_url
+                    ),
+                model_name=Configuration.openai_embedding_model,
+                ),
+            model_name=Configuration.openai_embedding_model,
             )
-        self.sparse_embedding_model = FastEmbedSparse(model_name="Qdrant/BM25")
+        self.sparse_embedding_model = sparse_embedding_model or FastEmbedSparse(model_name="Qdrant/BM25")
 
         # create the collection if it doesn't exist
         if not self.client.collection_exists(self.collection_name):
@@ -40,83 +226,299 @@ class VectorStore:
                 )
             },
             )
-            print(f"Collection '{self.collection_name}' created")
+            logger.info("Collection '%s' created", self.collection_name)
         else:
-            print(f"Loading existing collection: '{self.collection_name}'")
+            logger.info("Loading existing collection: '%s'", self.collection_name)
             
         # load the collection
         self._vector_store = self._as_vector_store(self.collection_name)
+
+        # load the manifest of indexed documents
+        self._lock = threading.Lock()
+        self.manifest = IndexManifest(
+            os.path.join(self.path, f"{self.collection_name}.manifest.json") if self.path else None
+        )
+        if not len(self.manifest) and self.client.count(self.collection_name).count:
+            self._rebuild_manifest()
         
     def as_retriever(self, search_kwargs={"k": 5}):
         return self._vector_store.as_retriever(search_kwargs=search_kwargs)
+
+    async def asearch(self, query:str, k:int = 5) -> List[Document]:
+        """Hybrid (dense + BM25, fused with RRF) search without blocking the event loop
+        
+        The query is embedded with the async embedding client and the Qdrant query runs in a worker
+        thread, so many searches can be in flight on a single event loop. Within a batch job the query
+        embedding is pooled with the queries of the other runs.
+        """
+        started = time.perf_counter()
+        with span("retrieval", "retrieval", query_chars=len(query), k=k) as retrieval_span:
+            pool = current_pool()
+            if pool is not None:
+                dense_vector = await pool.embed_query(query)
+            else:
+                dense_vector = await self.dense_embedding_model.aembed_query(query)
+            with span("sparse_embedding", "embedding"):
+                sparse_vector = await asyncio.to_thread(self.sparse_embedding_model.embed_query, query)
+            with span("qdrant_query", "qdrant", k=k):
+                documents = await asyncio.to_thread(self._hybrid_search, dense_vector, sparse_vector, k)
+            if retrieval_span is not None:
+                retrieval_span.set(results=len(documents), result_chars=sum(len(doc.page_content) for doc in documents))
+        RETRIEVAL_DURATION.observe(time.perf_counter() - started)
+        return documents
+
+    def _hybrid_search(self, dense_vector:List[float], sparse_vector, k:int) -> List[Document]:
+        # same query as QdrantVectorStore in RetrievalMode.HYBRID
+        points = self.client.query_points(
+            collection_name=self.collection_name,
+            prefetch=[
+                models.Prefetch(query=dense_vector, using="dense_vector", limit=k),
+                models.Prefetch(
+                    query=models.SparseVector(indices=sparse_vector.indices, values=sparse_vector.values),
+                    using="sparse_vector",
+                    limit=k,
+                ),
+            ],
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=k,
+            with_payload=True,
+        ).points
+        return [self._point_document(point, score=point.score) for point in points]
+
+    def _point_document(self, point, score:Optional[float] = None) -> Document:
+        metadata = {**point.payload[QdrantVectorStore.METADATA_KEY], "_id": point.id,
+                    "_collection_name": self.collection_name}
+        if score is not None:
+            metadata["_score"] = score
+        return Document(page_content=point.payload[QdrantVectorStore.CONTENT_KEY], metadata=metadata)
+
+    async def aget_documents(self, point_ids:List[str]) -> List[Document]:
+        """Fetch chunks by their point ids, in the given order
+
+        Research runs only keep references to the chunks they found and fetch the text when a
+        prompt is built. Chunks deleted in the meantime (re-indexed documents) are skipped.
+        """
+        if not point_ids:
+            return []
+        with span("qdrant_retrieve", "qdrant", ids=len(point_ids)):
+            records = await asyncio.to_thread(
+                self.client.retrieve, collection_name=self.collection_name, ids=list(point_ids),
+                with_payload=True, with_vectors=False)
+        documents = {str(record.id): self._point_document(record) for record in records}
+        missing = [point_id for point_id in point_ids if str(point_id) not in documents]
+        if missing:
+            logger.warning("%d referenced chunks are no longer in the vector store", len(missing))
+        return [documents[str(point_id)] for point_id in point_ids if str(point_id) in documents]
     
     def add_pkl_dict_to_vectorstore(self, pkl_dict:dict):
         """Adds a dictionary of parsed documents to the vector store
         Args:
             pkl_dict (dict): A dictionary of parsed documents created by llamaparser 
         """
-        start_time = time.time()
-        docs=[]
-        for i, key in enumerate(pkl_dict.keys()):
-            print(f" {i+1}. {key}, Adding to vector store...")
-            for doc in pkl_dict[key]['chunks']:
-                docs.append(Document(page_content=doc.page_content, metadata={
+        def _parsed_documents():
+            for key in pkl_dict.keys():
+                chunks = [(doc.page_content, {
                     "filename": doc.metadata["filename"],
                     "file_path": doc.metadata["paper_path"],
                     "chunk_id": doc.metadata["chunk_num"],
-                    "context": doc.metadata["context"]}))
-            
-        # add docs to vector store
-        self.add_documents(docs)
-        end_time = time.time()
-        print(f"Time taken to add documents to vector store: {round(end_time - start_time, 1)} seconds")
+                    "context": doc.metadata["context"]}) for doc in pkl_dict[key]['chunks']]
+                yield key, chunk_content_hash(chunks), chunks
+
+        self.add_parsed_documents(_parsed_documents())
+
+    def add_parsed_documents(self, parsed_documents:Iterable[Tuple[str, str, List[Tuple[str, dict]]]],
+                             batch_size:Optional[int] = None) -> IngestionProgress:
+        """Streams parsed documents into the vector store
+        
+        Chunks are converted to Documents lazily and embedded / upserted in fixed-size batches, so peak
+        memory is bounded by the batch size rather than the corpus size. Embedding requests and upserts
+        run concurrently, limited by the ingestion settings in Configuration.
+        Args:
+            parsed_documents: (key, content_hash, chunks) tuples as yielded by utils.iter_parsed_documents
+            batch_size (int): Number of chunks embedded and upserted per batch
+        Returns:
+            IngestionProgress: Document, chunk and throughput counters of this run
+        """
+        self.progress = progress = IngestionProgress()
+
+        def _documents_to_index():
+            for key, content_hash, chunks in parsed_documents:
+                if not chunks:
+                    logger.info("%s: no chunks to add, skipping", key)
+                    continue
+                filename = chunks[0][1]["filename"]
+                if self.has_document(filename, content_hash):
+                    logger.info("Document %s already exists in collection. Skipping upload.", filename)
+                    progress.skipped_documents += 1
+                    continue
+                docs = (Document(page_content=page_content, metadata=metadata) for page_content, metadata in chunks)
+                yield filename, content_hash, docs
+
+        for message in self._index_documents(_documents_to_index(), batch_size, progress):
+            logger.info(message)
+        progress.finish()
+        return progress
+
+    def has_document(self, filename:Optional[str] = None, content_hash:Optional[str] = None) -> bool:
+        """Check whether a document is indexed, by filename and/or content hash (O(1) manifest lookup)."""
+        if filename is None:
+            return self.manifest.filename_for_hash(content_hash) is not None
+        entry = self.manifest.get(filename)
+        if entry is None:
+            return False
+        return content_hash is None or entry["content_hash"] == content_hash
 
     def add_documents(self, documents:List[Document]):
-        """Add documents to the vectorstore."""
+        """Add documents to the vectorstore, skipping documents that are already indexed.
+        
+        The chunks are grouped by filename, so a batch may span several documents. Documents whose
+        content changed since they were indexed are replaced.
+        """
         # Skip if no documents are provided
         if not documents:
-            print("No documents to add, skipping...")
+            logger.info("No documents to add, skipping")
             return
         
-        # get filname in metadata
-        filename = documents[0].metadata["filename"]
+        grouped_documents: Dict[str, List[Document]] = {}
+        for doc in documents:
+            grouped_documents.setdefault(doc.metadata["filename"], []).append(doc)
 
-        # get the number of points in the collection
-        point_count = self.client.count(self.collection_name)
-        
-        # create a list of ids for the documents
-        ids = list(range(1, point_count.count))
-        
-        # Get the existing documents in the collection
-        records = self._vector_store.client.retrieve(
-            ids=ids,
-            collection_name=self.collection_name,
-            with_payload=True
-        )
+        messages = []
+        documents_to_index = []
+        for filename, docs in grouped_documents.items():
+            content_hash = document_content_hash(docs)
+            if self.has_document(filename, content_hash):
+                messages.append(f"Document {filename} already exists in collection. Skipping upload.")
+            else:
+                documents_to_index.append((filename, content_hash, docs))
+        messages.extend(self._index_documents(documents_to_index))
+        return " ".join(messages)
 
-        # Extract unique titles from metadata
-        existing_docs = list(set([record.payload['metadata']['filename'] for record in records]))
+    def add_document(self, filename:str, documents:List[Document]) -> str:
+        """Add the chunks of a single document, or replace them if the document content changed."""
+        content_hash = document_content_hash(documents)
+        if self.has_document(filename, content_hash):
+            return f"Document {filename} already exists in collection. Skipping upload."
+        return self.replace_document(filename, documents, content_hash=content_hash)
 
-        if filename in existing_docs:
-            message = f"Document {filename} already exists in collection. Skipping upload."
-            return message
+    def replace_document(self, filename:str, documents:List[Document], content_hash:Optional[str] = None) -> str:
+        """Upsert the chunks of a document and remove chunks left over from a previous version."""
+        content_hash = content_hash or document_content_hash(documents)
+        return " ".join(self._index_documents([(filename, content_hash, documents)]))
 
-        """ # Filter out documents that already exist
-        documents = [doc for doc in documents if doc.metadata["filename"] not in existing_docs]
+    def _index_documents(self, documents:Iterable[Tuple[str, str, Iterable[Document]]], batch_size:Optional[int] = None,
+                         progress:Optional[IngestionProgress] = None) -> Iterator[str]:
+        """Embed and upsert (filename, content_hash, chunks) documents through a bounded pipeline
         
-        # Skip if all documents already exist
-        if not documents:
-            print("All documents already exist in collection. Skipping upload.")
-            return """
-        
-        # create a list of ids for the documents
-        ids = list(range(point_count.count + 1, point_count.count + len(documents) + 1))
-        
-        # add the documents to the collection
-        self._vector_store.add_documents(documents=documents, ids=ids)
+        Batches are embedded on the embedding pool (at most ingest_max_concurrent_embeddings batches in
+        flight) and upserted on the upsert pool. A document is recorded in the manifest once all of its
+        batches are upserted. Yields a message per indexed document.
+        """
+        batch_size = batch_size or Configuration.ingest_batch_size
+        progress = progress or IngestionProgress()
+        max_embeddings_in_flight = Configuration.ingest_max_concurrent_embeddings
+        max_upserts_in_flight = 2 * Configuration.ingest_upsert_workers
+        embeddings_in_flight = deque()
+        upserts_in_flight = deque()
+
+        def _start_upsert():
+            document, chunk_count, future = embeddings_in_flight.popleft()
+            upserts_in_flight.append((document, chunk_count, self._upsert_pool.submit(self._upsert_points, future.result())))
 
-        message = f'{len(documents)} document chunks are added to the vector store'
-        return message
+        def _finish_upserts(max_in_flight:int):
+            # commit finished upserts, waiting until at most max_in_flight are left. Upserts are completed
+            # in submission order, so documents are committed in order
+            while upserts_in_flight and (len(upserts_in_flight) > max_in_flight or upserts_in_flight[0][2].done()):
+                document, chunk_count, future = upserts_in_flight.popleft()
+                future.result()
+                document.pending_batches -= 1
+                progress.add_chunks(chunk_count)
+                if document.submitted and not document.pending_batches:
+                    yield self._commit_document(document, progress)
+
+        for filename, content_hash, docs in documents:
+            document = _PendingDocument(filename, content_hash)
+            for batch in batched(docs, batch_size):
+                # point ids are derived from the chunk_id, a repeated one would overwrite an earlier chunk
+                for doc in batch:
+                    if doc.metadata["chunk_id"] in document.chunk_ids:
+                        raise ValueError(f"Document {filename} has more than one chunk with chunk_id {doc.metadata['chunk_id']}")
+                    document.chunk_ids.add(doc.metadata["chunk_id"])
+                batch_ids = [chunk_point_id(filename, doc.metadata["chunk_id"]) for doc in batch]
+                document.point_ids.extend(batch_ids)
+                document.pending_batches += 1
+                embeddings_in_flight.append(
+                    (document, len(batch), self._embedding_pool.submit(self._embed_points, batch, batch_ids)))
+
+                if len(embeddings_in_flight) >= max_embeddings_in_flight:
+                    _start_upsert()
+                yield from _finish_upserts(max_upserts_in_flight)
+            document.submitted = True
+            if not document.pending_batches:
+                yield self._commit_document(document, progress)
+
+        while embeddings_in_flight:
+            _start_upsert()
+        yield from _finish_upserts(0)
+
+    def _embed_points(self, documents:List[Document], ids:List[str]) -> List[models.PointStruct]:
+        """Compute the dense and sparse embeddings of a batch of chunks (runs on the embedding pool)"""
+        texts = [doc.page_content for doc in documents]
+        dense_vectors = self.dense_embedding_model.embed_documents(texts)
+        sparse_vectors = self.sparse_embedding_model.embed_documents(texts)
+        return [
+            models.PointStruct(
+                id=point_id,
+                vector={
+                    "dense_vector": dense_vector,
+                    "sparse_vector": models.SparseVector(indices=sparse_vector.indices, values=sparse_vector.values),
+                },
+                payload={
+                    QdrantVectorStore.CONTENT_KEY: doc.page_content,
+                    QdrantVectorStore.METADATA_KEY: doc.metadata,
+                },
+            )
+            for point_id, doc, dense_vector, sparse_vector in zip(ids, documents, dense_vectors, sparse_vectors)
+        ]
+
+    def _upsert_points(self, points:List[models.PointStruct]):
+        """Upsert a batch of points (runs on the upsert pool)"""
+        # the ids are stable, so re-adding a chunk overwrites its previous version
+        with self._upsert_lock:
+            self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+
+    def _commit_document(self, document:_PendingDocument, progress:IngestionProgress) -> str:
+        """Remove chunks left over from a previous version and record the document in the manifest"""
+        with self._lock:
+            previous = self.manifest.get(document.filename)
+            stale_ids = set(previous["point_ids"]) - set(document.point_ids) if previous else set()
+            if stale_ids:
+                self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.PointIdsList(points=list(stale_ids)),
+                )
+            self.manifest.set(document.filename, document.content_hash, document.point_ids)
+            self.manifest.save()
+            self.version += 1
+
+        progress.documents += 1
+        action = "replaced in" if previous else "added to"
+        return f"{len(document.point_ids)} document chunks of {document.filename} are {action} the vector store"
+
+    def delete_document(self, filename:Optional[str] = None, content_hash:Optional[str] = None) -> str:
+        """Delete all chunks of a document, identified by filename or content hash."""
+        filename = filename or self.manifest.filename_for_hash(content_hash)
+        with self._lock:
+            entry = self.manifest.remove(filename) if filename else None
+            if entry is None:
+                return f"Document {filename or content_hash} is not in the collection. Nothing to delete."
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.PointIdsList(points=entry["point_ids"]),
+            )
+            self.manifest.save()
+            self.version += 1
+        return f"{len(entry['point_ids'])} document chunks of {filename} are deleted from the vector store"
     
     def _as_vector_store(self, collection_name):
         return QdrantVectorStore(
@@ -129,22 +531,29 @@ class VectorStore:
             sparse_vector_name="sparse_vector",
         )
     
+    def _rebuild_manifest(self):
+        """Rebuild the manifest from the collection payloads (one-off scan for indexes built without one)."""
+        logger.info("Rebuilding manifest of collection '%s'", self.collection_name)
+        point_ids: Dict[str, List] = {}
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                with_payload=["metadata.filename"],
+                limit=1000,
+                offset=offset,
+            )
+            for record in records:
+                point_ids.setdefault(record.payload["metadata"]["filename"], []).append(record.id)
+            if offset is None:
+                break
+
+        # the content hash is unknown, so these documents are replaced the next time they are added
+        for filename, ids in point_ids.items():
+            self.manifest.set(filename, None, ids)
+        self.manifest.save()
+
     def _inspect_collection(self,):
         """inspect qdrant database collections"""
-        
-        # Get the existing documents in the collection
-        point_count = self.client.count(self.collection_name)
-        ids = list(range(1, point_count.count + 1))
-        
-        records = self.client.retrieve(
-            ids=ids,
-            collection_name=self.collection_name,
-            with_payload=True
-        )
-
-        # Extract unique titles from metadata
-        existing_docs = list(set([record.payload['metadata']['filename'] for record in records]))
-        print(f" Documents in collection:")
-        for i, doc_name in enumerate(existing_docs):
-            print(f"  {i+1}. {doc_name}")
-        print('\n')
\ No newline at end of file
+        logger.info("Documents in collection '%s':%s", self.collection_name,
+                    "".join(f"\n  {i+1}. {doc_name}" for i, doc_name in enumerate(self.manifest.documents)))
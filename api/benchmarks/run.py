@@ -0,0 +1,308 @@
+"""Offline micro-benchmarks of ingestion, retrieval, deduplication and prompt assembly
+
+Runs without network access or model downloads: the embedding models are deterministic fakes
+(benchmarks.synthetic) and Qdrant runs in local mode, so the numbers measure this code and the
+local Qdrant engine rather than the embedding endpoint. Every corpus and query set is seeded,
+so two runs of the same version do the same work.
+
+    cd api
+    python -m benchmarks.run --sizes 1000,10000 --output benchmark.json
+    python -m benchmarks.run --sizes 1000,10000 --baseline benchmark.json
+
+With --baseline the results are compared to an earlier run and the exit status is 1 when a
+metric got worse by more than --threshold (default 25%). Compare runs made on the same, otherwise
+idle machine; timings of the microsecond-scale benchmarks vary with CPU load and frequency.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.documents import Document
+
+from assistant.configuration import Configuration
+from assistant.context import get_token_counter
+from assistant.utils import deduplicate_and_format_sources
+from assistant.vectorstore import VectorStore
+from benchmarks.synthetic import FakeDenseEmbeddings, FakeSparseEmbeddings, SyntheticCorpus
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    """Linearly interpolated percentile of the values"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _latency_metrics(seconds: List[float], unit: str = "ms") -> Dict[str, float]:
+    scale = 1000 if unit == "ms" else 1_000_000
+    return {
+        f"p50_{unit}": round(scale * _percentile(seconds, 50), 3),
+        f"p90_{unit}": round(scale * _percentile(seconds, 90), 3),
+        f"p99_{unit}": round(scale * _percentile(seconds, 99), 3),
+        f"mean_{unit}": round(scale * statistics.fmean(seconds), 3),
+    }
+
+
+def _result(benchmark: str, params: dict, metrics: dict) -> dict:
+    return {"benchmark": benchmark, "params": params, "metrics": metrics}
+
+
+def bench_ingestion(store: VectorStore, parsed_documents: list, batch_size: Optional[int]) -> dict:
+    """Embed and upsert a corpus into an empty collection"""
+    num_chunks = sum(len(chunks) for _, _, chunks in parsed_documents)
+    started = time.perf_counter()
+    store.add_parsed_documents(iter(parsed_documents), batch_size=batch_size)
+    seconds = time.perf_counter() - started
+    return _result("ingestion", {"chunks": num_chunks, "batch_size": batch_size or Configuration.ingest_batch_size}, {
+        "seconds": round(seconds, 3),
+        "chunks_per_second": round(num_chunks / seconds, 1),
+    })
+
+
+def bench_retrieval(store: VectorStore, queries: List[str], k: int, warmup: int = 10) -> dict:
+    """Hybrid search latency (query embedding, sparse embedding and the fused Qdrant query)"""
+    async def _search_all() -> List[float]:
+        for query in queries[:warmup]:
+            await store.asearch(query, k=k)
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            await store.asearch(query, k=k)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    latencies = asyncio.run(_search_all())
+    return _result("retrieval", {"collection_chunks": store.client.count(store.collection_name).count,
+                                 "queries": len(queries), "k": k}, {
+        **_latency_metrics(latencies),
+        "queries_per_second": round(len(latencies) / sum(latencies), 1),
+    })
+
+
+def _median_seconds(func: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def bench_dedupe(store: VectorStore, parsed_documents: list, repeat: int = 7) -> List[dict]:
+    """Cost of re-adding documents that are already indexed, which must all be skipped
+
+    add_parsed_documents checks precomputed content hashes against the manifest; add_documents
+    also groups the chunks by filename and hashes them first. Each is timed repeat times, the
+    median is reported.
+    """
+    num_chunks = sum(len(chunks) for _, _, chunks in parsed_documents)
+    documents = [Document(page_content=page_content, metadata=metadata)
+                 for _, _, chunks in parsed_documents for page_content, metadata in chunks]
+    version = store.version
+
+    parsed_seconds = _median_seconds(lambda: store.add_parsed_documents(iter(parsed_documents)), repeat)
+    documents_seconds = _median_seconds(lambda: store.add_documents(documents), repeat)
+
+    if store.version != version:
+        raise RuntimeError("Re-adding indexed documents changed the vector store")
+    params = {"chunks": num_chunks, "documents": len(parsed_documents)}
+    return [
+        _result("dedupe_add_parsed_documents", params, {
+            "seconds": round(parsed_seconds, 6),
+            "us_per_chunk": round(1e6 * parsed_seconds / num_chunks, 3),
+        }),
+        _result("dedupe_add_documents", params, {
+            "seconds": round(documents_seconds, 6),
+            "us_per_chunk": round(1e6 * documents_seconds / num_chunks, 3),
+        }),
+    ]
+
+
+def bench_format_sources(corpus: SyntheticCorpus, iterations: int, branches: int, k: int,
+                         max_total_tokens: int, rounds: int = 5) -> dict:
+    """Throughput of deduplicate_and_format_sources on the search results of one research loop
+
+    The iterations are split into rounds and the fastest round is reported, which filters out
+    most of the noise of other processes on the machine.
+    """
+    responses = [corpus.search_responses(branches=branches, k=k, salt=salt) for salt in range(50)]
+    input_bytes = sum(len(source["content"]) for response in responses for branch in response
+                      for source in branch["results"]) / len(responses)
+
+    def _format(response):
+        return deduplicate_and_format_sources(response, max_tokens_per_source=Configuration.context_max_tokens_per_source,
+                                              include_raw_content=True, max_total_tokens=max_total_tokens,
+                                              model=Configuration.openai_model)
+
+    for response in responses:
+        _format(response)
+    fastest = None
+    for _ in range(rounds):
+        latencies = []
+        for iteration in range(max(iterations // rounds, 1)):
+            response = responses[iteration % len(responses)]
+            started = time.perf_counter()
+            _format(response)
+            latencies.append(time.perf_counter() - started)
+        if fastest is None or sum(latencies) < sum(fastest):
+            fastest = latencies
+
+    # tiktoken is much slower than the 4 characters per token estimate it falls back to without its
+    # encoding files, runs are only compared against a baseline that counted tokens the same way
+    seconds = sum(fastest)
+    return _result("format_sources", {"iterations": iterations, "branches": branches, "k": k,
+                                      "max_total_tokens": max_total_tokens,
+                                      "exact_tokens": get_token_counter(Configuration.openai_model).exact}, {
+        **_latency_metrics(fastest, unit="us"),
+        "calls_per_second": round(len(fastest) / seconds, 1),
+        "input_mb_per_second": round(len(fastest) * input_bytes / seconds / 1e6, 2),
+    })
+
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("per_second")
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Metrics of the current run that are worse than in the baseline by more than threshold (a fraction)"""
+    def _key(result):
+        return result["benchmark"], json.dumps(result["params"], sort_keys=True)
+
+    baseline_results = {_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = baseline_results.get(_key(result))
+        if previous is None:
+            continue
+        for metric, value in result["metrics"].items():
+            before = previous["metrics"].get(metric)
+            if not before or metric == "seconds":
+                continue
+            change = (value - before) / before
+            if (-change if _higher_is_better(metric) else change) > threshold:
+                regressions.append(f"{result['benchmark']} {result['params']} {metric}: {before} -> {value} ({change:+.0%})")
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(args: argparse.Namespace) -> dict:
+    from importlib.metadata import PackageNotFoundError, version
+    packages = {}
+    for package in ("qdrant-client", "langchain-qdrant", "langchain-core", "tiktoken"):
+        try:
+            packages[package] = version(package)
+        except PackageNotFoundError:
+            packages[package] = None
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "packages": packages,
+        "arguments": vars(args),
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    # the collections live in memory or in a scratch directory, never on a Qdrant server or in VECTORSTORE_PATH
+    Configuration.qdrant_url = None
+    Configuration.vectorstore_path = None
+
+    corpus = SyntheticCorpus(seed=args.seed, chunk_words=args.chunk_words)
+    queries = corpus.queries(args.queries)
+    results = []
+    progress: Callable[[str], None] = lambda message: print(message, file=sys.stderr, flush=True)
+
+    for size in args.sizes:
+        parsed_documents = list(corpus.parsed_documents(size, chunks_per_document=args.chunks_per_document))
+        with tempfile.TemporaryDirectory(prefix="benchmark-") if args.storage == "disk" else nullcontext() as path:
+            store = VectorStore(path=path, collection_name=f"benchmark_{size}",
+                                dense_embedding_model=FakeDenseEmbeddings(),
+                                sparse_embedding_model=FakeSparseEmbeddings())
+            try:
+                progress(f"ingesting {size} chunks")
+                results.append(bench_ingestion(store, parsed_documents, args.batch_size))
+                progress(f"retrieval over {size} chunks")
+                results.append(bench_retrieval(store, queries, args.k))
+                progress(f"re-adding {size} indexed chunks")
+                results.extend(bench_dedupe(store, parsed_documents))
+            finally:
+                store.client.close()
+
+    progress("formatting sources")
+    results.append(bench_format_sources(corpus, args.format_iterations, args.branches, args.k,
+                                        Configuration.context_max_tokens))
+    return {"metadata": _metadata(args), "results": results}
+
+
+def _print_results(report: dict) -> None:
+    for result in report["results"]:
+        params = ", ".join(f"{name}={value}" for name, value in result["params"].items())
+        metrics = ", ".join(f"{name}={value}" for name, value in result["metrics"].items())
+        print(f"{result['benchmark']:<28} {params}\n{'':<28} {metrics}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[1000, 5000],
+                        help="comma-separated collection sizes in chunks (default: 1000,5000)")
+    parser.add_argument("--queries", type=int, default=200, help="timed retrieval queries per collection size")
+    parser.add_argument("--k", type=int, default=5, help="chunks retrieved per query")
+    parser.add_argument("--chunk-words", type=int, default=250, help="words per synthetic chunk")
+    parser.add_argument("--chunks-per-document", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=None, help="ingestion batch size (default: INGEST_BATCH_SIZE)")
+    parser.add_argument("--format-iterations", type=int, default=2000)
+    parser.add_argument("--branches", type=int, default=3, help="parallel search branches per formatted context")
+    parser.add_argument("--storage", choices=("memory", "disk"), default="memory",
+                        help="in-memory Qdrant or local on-disk storage in a scratch directory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative change of a metric counted as a regression (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run(args)
+    _print_results(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions compared to {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions compared to {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Deterministic fake embeddings and synthetic corpora for the offline benchmarks
+
+The fake models hash words into vectors, so the same text always gets the same embedding without
+a network call or a model download, and similar texts still get similar vectors. The corpus is
+drawn from a seeded random generator with a Zipf-like word distribution, so every run of a
+benchmark sees exactly the same chunks and queries.
+"""
+import math
+import random
+import zlib
+from typing import Iterator, List, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import SparseEmbeddings, SparseVector
+
+from assistant.vectorstore import chunk_content_hash
+
+# Dimension of the dense_vector field of the collection (text-embedding-ada-002)
+DENSE_DIMENSION = 1536
+
+# Index range of the hashed sparse vectors
+SPARSE_DIMENSION = 2 ** 20
+
+
+def _word_hash(word: str) -> int:
+    return zlib.crc32(word.encode("utf-8"))
+
+
+class FakeDenseEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors of DENSE_DIMENSION, L2-normalized"""
+    def __init__(self, dimension: int = DENSE_DIMENSION):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        for word in text.lower().split():
+            word_hash = _word_hash(word)
+            # the sign bit spreads collisions around zero instead of piling them up
+            vector[word_hash % self.dimension] += 1.0 if word_hash & 0x80000000 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class FakeSparseEmbeddings(SparseEmbeddings):
+    """Hashed term-frequency vectors in place of FastEmbed BM25"""
+    def _embed(self, text: str) -> SparseVector:
+        counts = {}
+        for word in text.lower().split():
+            index = _word_hash(word) % SPARSE_DIMENSION
+            counts[index] = counts.get(index, 0.0) + 1.0
+        return SparseVector(indices=list(counts), values=list(counts.values()))
+
+    def embed_documents(self, texts: List[str]) -> List[SparseVector]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> SparseVector:
+        return self._embed(text)
+
+
+class SyntheticCorpus:
+    """Seeded generator of chunk texts and queries over a fixed vocabulary"""
+    def __init__(self, seed: int = 0, vocabulary_size: int = 20000, chunk_words: int = 250):
+        self.seed = seed
+        self.chunk_words = chunk_words
+        rng = random.Random(seed)
+        self.vocabulary = [
+            "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+            for _ in range(vocabulary_size)
+        ]
+        # Zipf-like weights, a few frequent words and a long tail like natural text
+        self._cumulative_weights = []
+        total = 0.0
+        for rank in range(1, vocabulary_size + 1):
+            total += 1.0 / rank
+            self._cumulative_weights.append(total)
+
+    def _words(self, rng: random.Random, count: int) -> str:
+        return " ".join(rng.choices(self.vocabulary, cum_weights=self._cumulative_weights, k=count))
+
+    def parsed_documents(self, num_chunks: int, chunks_per_document: int = 50,
+                         prefix: str = "doc") -> Iterator[Tuple[str, str, List[Tuple[str, dict]]]]:
+        """(key, content_hash, chunks) tuples like utils.iter_parsed_documents, num_chunks chunks in total"""
+        rng = random.Random(f"{self.seed}-{prefix}")
+        for document_number in range(math.ceil(num_chunks / chunks_per_document)):
+            filename = f"{prefix}_{document_number:05d}.pdf"
+            chunk_count = min(chunks_per_document, num_chunks - document_number * chunks_per_document)
+            chunks = [(self._words(rng, self.chunk_words), {
+                "filename": filename,
+                "file_path": f"./documents/{filename}",
+                "chunk_id": chunk_id,
+                "context": self._words(rng, 20)}) for chunk_id in range(chunk_count)]
+            yield filename, chunk_content_hash(chunks), chunks
+
+    def queries(self, count: int, words: int = 8) -> List[str]:
+        rng = random.Random(f"{self.seed}-queries")
+        return [self._words(rng, words) for _ in range(count)]
+
+    def search_responses(self, branches: int = 3, k: int = 5, overlap: float = 0.4,
+                         salt: int = 0) -> List[dict]:
+        """Search responses of parallel query branches as document_search formats them
+
+        Each branch returns k chunks; the given share of them was also found by an earlier branch.
+        """
+        rng = random.Random(f"{self.seed}-sources-{salt}")
+        seen, responses = [], []
+        for _ in range(branches):
+            results = []
+            for _ in range(k):
+                if seen and rng.random() < overlap:
+                    results.append(rng.choice(seen))
+                    continue
+                filename = f"doc_{rng.randrange(100000):05d}.pdf"
+                chunk_id = rng.randrange(1000)
+                source = {"id": f"./documents/{filename}#{chunk_id}", "title": filename, "url": "n/a",
+                          "content": self._words(rng, self.chunk_words)}
+                seen.append(source)
+                results.append(source)
+            responses.append({"results": results})
+        return responses
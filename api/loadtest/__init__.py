@@ -0,0 +1 @@
+"""Load-test harness for the chat endpoint against a local stub LLM server, run with python -m loadtest.run"""
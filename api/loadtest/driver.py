@@ -0,0 +1,236 @@
+"""Load driver for the SSE chat endpoint
+
+Opens concurrent streaming requests against /v1/chat/completions at increasing concurrency
+levels and reports, for each level:
+
+- time to first byte (first SSE event, usually a progress event)
+- time to the first token of the answer
+- gaps between consecutive SSE events
+- total duration of the stream
+- error rate, by kind: HTTP status (e.g. 429 when the research queue is full), a stream that
+  ends without [DONE], a timeout or a connection error
+
+    cd api
+    python -m loadtest.driver --url http://127.0.0.1:8000 --concurrency 1,4,16 --requests 32
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import httpx
+
+TOPICS = [
+    "How does texture affect the fatigue behaviour of magnesium alloys",
+    "Which heat treatments improve the ductility of AZ80 forgings",
+    "What controls twinning in hexagonal close packed metals",
+    "How do precipitates influence creep of wrought magnesium",
+    "Which processing routes weaken the basal texture of extruded bars",
+    "How is the residual stress of forged parts measured",
+]
+
+
+@dataclass
+class StreamResult:
+    """Timings of one streamed chat completion, in seconds from sending the request"""
+    status: Optional[int] = None
+    error: Optional[str] = None
+    first_byte: Optional[float] = None
+    first_content: Optional[float] = None
+    duration: Optional[float] = None
+    events: int = 0
+    content_chars: int = 0
+    gaps: List[float] = field(default_factory=list)
+
+
+async def stream_chat(client: httpx.AsyncClient, url: str, question: str, model: str, client_id: str,
+                      timeout: float) -> StreamResult:
+    """Send one chat completion request and time its server-sent events"""
+    result = StreamResult()
+    started = time.perf_counter()
+    last_event = None
+    done = False
+    try:
+        async with client.stream("POST", f"{url}/v1/chat/completions", timeout=timeout,
+                                 headers={"X-Client-Id": client_id},
+                                 json={"model": model, "messages": [{"role": "user", "content": question}],
+                                       "stream": True}) as response:
+            result.status = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                result.error = f"http {response.status_code}"
+                return result
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                now = time.perf_counter() - started
+                if last_event is None:
+                    result.first_byte = now
+                else:
+                    result.gaps.append(now - last_event)
+                last_event = now
+                result.events += 1
+
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    done = True
+                    break
+                chunk = json.loads(data)
+                content = chunk["choices"][0]["delta"].get("content") if chunk.get("choices") else None
+                # progress lines sent as content (STREAM_PROGRESS_AS_CONTENT) are not part of the answer
+                if content and "progress" not in chunk:
+                    result.content_chars += len(content)
+                    if result.first_content is None:
+                        result.first_content = now
+        if not done:
+            result.error = "incomplete stream"
+    except httpx.TimeoutException:
+        result.error = "timeout"
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        result.error = type(e).__name__
+    finally:
+        result.duration = time.perf_counter() - started
+    return result
+
+
+def _percentiles(values: List[float]) -> Optional[dict]:
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def percentile(p):
+        return round(1000 * ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)], 1)
+    return {"p50_ms": percentile(50), "p90_ms": percentile(90), "p99_ms": percentile(99),
+            "max_ms": round(1000 * ordered[-1], 1), "mean_ms": round(1000 * statistics.fmean(ordered), 1)}
+
+
+def summarize(concurrency: int, results: List[StreamResult], seconds: float) -> dict:
+    """The report of one concurrency level"""
+    ok = [result for result in results if result.error is None]
+    errors = Counter(result.error for result in results if result.error is not None)
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "succeeded": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": dict(errors),
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(ok) / seconds, 3) if seconds else 0.0,
+        "time_to_first_byte": _percentiles([result.first_byte for result in ok]),
+        "time_to_first_content": _percentiles([result.first_content for result in ok if result.first_content is not None]),
+        "inter_event_gap": _percentiles([gap for result in ok for gap in result.gaps]),
+        "duration": _percentiles([result.duration for result in ok]),
+        "events_per_stream": round(statistics.fmean(result.events for result in ok), 1) if ok else None,
+    }
+
+
+async def run_level(url: str, concurrency: int, requests: int, model: str, timeout: float,
+                    clients: int, level_index: int) -> dict:
+    """Send requests streams with at most concurrency in flight"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for number in range(requests):
+        # unique topics, so no run is answered from a cache
+        queue.put_nowait(f"{TOPICS[number % len(TOPICS)]}? (load test {level_index}.{number})")
+    results: List[StreamResult] = []
+
+    async def worker(worker_id: int):
+        client_id = f"loadtest-{worker_id % clients}"
+        while not queue.empty():
+            question = queue.get_nowait()
+            results.append(await stream_chat(client, url, question, model, client_id, timeout))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(worker_id) for worker_id in range(concurrency)))
+        seconds = time.perf_counter() - started
+    return summarize(concurrency, results, seconds)
+
+
+def _format_percentiles(values: Optional[dict]) -> str:
+    if values is None:
+        return "n/a"
+    return f"p50 {values['p50_ms']:.0f} / p99 {values['p99_ms']:.0f} ms"
+
+
+def print_level(report: dict) -> None:
+    errors = ", ".join(f"{kind}: {count}" for kind, count in report["errors"].items()) or "none"
+    print(f"concurrency {report['concurrency']}: {report['succeeded']}/{report['requests']} ok "
+          f"({report['requests_per_second']} req/s), errors: {errors}")
+    print(f"  first byte    {_format_percentiles(report['time_to_first_byte'])}")
+    print(f"  first content {_format_percentiles(report['time_to_first_content'])}")
+    print(f"  event gap     {_format_percentiles(report['inter_event_gap'])}")
+    print(f"  duration      {_format_percentiles(report['duration'])}", flush=True)
+
+
+async def wait_until_ready(url: str, timeout: float, check: Optional[Callable[[], None]] = None) -> None:
+    """Poll /readyz until the API has built its index and loaded the graph
+
+    /healthz tells a failed start-up from one still in progress; check, if given, is called on
+    every poll and raises when the servers under test have exited.
+    """
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            if check is not None:
+                check()
+            try:
+                response = await client.get(f"{url}/readyz", timeout=5)
+                if response.status_code == 200:
+                    return
+                health = await client.get(f"{url}/healthz", timeout=5)
+                if health.status_code != 200:
+                    raise RuntimeError(f"API failed to start: {health.text}")
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{url} was not ready after {timeout:.0f}s")
+            await asyncio.sleep(1)
+
+
+async def run(args: argparse.Namespace, check: Optional[Callable[[], None]] = None) -> List[dict]:
+    await wait_until_ready(args.url, args.ready_timeout, check)
+    reports = []
+    for level_index, concurrency in enumerate(args.concurrency):
+        requests = args.requests or 2 * concurrency
+        report = await run_level(args.url, concurrency, requests, args.model, args.timeout, args.clients or concurrency,
+                                 level_index)
+        print_level(report)
+        reports.append(report)
+    return reports
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")],
+                        default=[1, 2, 4, 8, 16], help="comma-separated concurrency levels (default: 1,2,4,8,16)")
+    parser.add_argument("--requests", type=int, default=0, help="requests per level (default: twice the concurrency)")
+    parser.add_argument("--clients", type=int, default=0,
+                        help="distinct X-Client-Id values, for the fair scheduler (default: one per stream)")
+    parser.add_argument("--model", default="loadtest")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a stream counts as timed out")
+    parser.add_argument("--ready-timeout", type=float, default=300, help="seconds to wait for /readyz")
+    parser.add_argument("--output", help="write the reports as JSON to this file")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load driver for the SSE chat endpoint")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of the API")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    reports = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": args.url, "levels": reports}, f, indent=2)
+        print(f"Reports written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Run a complete load test on one machine, without network access
+
+Starts the stub LLM server and the API (loadtest.serve) as subprocesses, waits until the API is
+ready, drives it at each concurrency level and stops both servers again.
+
+    cd api
+    python -m loadtest.run --concurrency 1,4,16 --latency 0.5 --tokens-per-second 30 --output load.json
+
+The API reads its other settings (MAX_CONCURRENT_RUNS, MAX_RESEARCH_LOOPS, ...) from the
+environment as usual, so the same command measures different configurations.
+"""
+import sys
+import json
+import asyncio
+import argparse
+import subprocess
+from typing import List, Optional
+
+from loadtest import driver
+
+
+def _start(module: str, arguments: List[str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", module, *arguments])
+
+
+def _check_running(servers: List[subprocess.Popen]) -> None:
+    for server in servers:
+        if server.poll() is not None:
+            raise RuntimeError(f"{' '.join(server.args[1:])} exited with code {server.returncode}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--api-port", type=int, default=8000)
+    parser.add_argument("--llm-port", type=int, default=9999)
+    parser.add_argument("--parsed-documents", default="./parsed_documents")
+    stub = parser.add_argument_group("stub LLM server")
+    stub.add_argument("--latency", type=float, default=0.2, help="seconds to the first token")
+    stub.add_argument("--tokens-per-second", type=float, default=50.0)
+    stub.add_argument("--answer-words", type=int, default=150)
+    stub.add_argument("--relevant-fraction", type=float, default=0.8)
+    stub.add_argument("--embedding-latency", type=float, default=0.02)
+    stub.add_argument("--error-rate", type=float, default=0.0)
+    driver.add_arguments(parser.add_argument_group("driver"))
+    args = parser.parse_args(argv)
+
+    stub_arguments = ["--port", str(args.llm_port), "--latency", str(args.latency),
+                      "--tokens-per-second", str(args.tokens_per_second), "--answer-words", str(args.answer_words),
+                      "--relevant-fraction", str(args.relevant_fraction),
+                      "--embedding-latency", str(args.embedding_latency), "--error-rate", str(args.error_rate)]
+    servers = [_start("loadtest.stub_llm", stub_arguments)]
+    try:
+        servers.append(_start("loadtest.serve", ["--port", str(args.api_port), "--parsed-documents", args.parsed_documents,
+                                                 "--llm-url", f"http://127.0.0.1:{args.llm_port}/v1"]))
+        args.url = f"http://127.0.0.1:{args.api_port}"
+        reports = asyncio.run(driver.run(args, check=lambda: _check_running(servers)))
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"stub": {name: getattr(args, name) for name in
+                                ("latency", "tokens_per_second", "answer_words", "relevant_fraction",
+                                 "embedding_latency", "error_rate")},
+                       "levels": reports}, f, indent=2)
+        print(f"Reports written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
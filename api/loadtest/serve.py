@@ -0,0 +1,70 @@
+"""Serve api.py for a load test, with every model call going to the stub LLM server
+
+The chat model and the dense embeddings use the OpenAI client against the stub (--llm-url).
+BM25 sparse embeddings would need the FastEmbed model download, so the offline hashed stand-in
+from the benchmarks is used instead. The index is built in memory from the parsed documents;
+the embedding and answer caches are off, so every request runs the full research graph.
+
+    cd api
+    python -m loadtest.serve --port 8000 --llm-url http://127.0.0.1:9999/v1
+"""
+import os
+import argparse
+
+
+def _configure_environment(args: argparse.Namespace) -> None:
+    # read by Configuration when the assistant package is imported
+    os.environ["OPENAI_BASE_URL"] = args.llm_url
+    os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+    os.environ["VECTORSTORE_PATH"] = ""  # the hashed sparse vectors must not end up in a real index
+    os.environ["QDRANT_URL"] = ""
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    os.environ["ANSWER_CACHE_ENABLED"] = "true" if args.answer_cache else "false"
+    # logging every LLM request would slow the API down at high concurrency
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def offline_vectorstore():
+    """The vector store of the load test: stub dense embeddings, hashed sparse embeddings"""
+    from langchain_openai import OpenAIEmbeddings
+
+    from assistant.configuration import Configuration
+    from assistant.embeddings import MeteredEmbeddings
+    from assistant.vectorstore import VectorStore
+    from benchmarks.synthetic import FakeSparseEmbeddings
+
+    dense_embedding_model = MeteredEmbeddings(
+        OpenAIEmbeddings(
+            model=Configuration.openai_embedding_model,
+            openai_api_key=Configuration.openai_api_key,
+            openai_api_base=Configuration.openai_base_url,
+            # no tiktoken download, the stub embeds text
+            check_embedding_ctx_length=False,
+        ),
+        model_name=Configuration.openai_embedding_model,
+    )
+    return VectorStore(dense_embedding_model=dense_embedding_model, sparse_embedding_model=FakeSparseEmbeddings())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the research API against the stub LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--llm-url", default="http://127.0.0.1:9999/v1", help="base URL of the stub LLM server")
+    parser.add_argument("--parsed-documents", default="./parsed_documents", help="directory of the parsed document pkl files")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer cache on")
+    args = parser.parse_args()
+    _configure_environment(args)
+
+    import uvicorn
+    from assistant.index import search_index
+
+    search_index.parsed_document_dir = args.parsed_documents
+    search_index.vectorstore_factory = offline_vectorstore
+
+    import api
+    uvicorn.run(api.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""OpenAI-compatible stub of the chat and embedding endpoints for load tests
+
+Answers /v1/chat/completions and /v1/embeddings locally with a configurable latency and token
+rate, so the research graph can run at any concurrency without calling OpenAI. JSON-mode requests
+(response_format json_object) get a response in the shape the instructions ask for: search
+queries, relevance grades, summary sections or a reflection. Other requests get prose.
+Responses are derived from a hash of the request, so the same prompt gets the same answer.
+
+    cd api
+    python -m loadtest.stub_llm --port 9999 --latency 0.3 --tokens-per-second 40
+"""
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import hashlib
+from dataclasses import dataclass
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.synthetic import FakeDenseEmbeddings
+
+
+@dataclass
+class StubSettings:
+    latency: float = 0.2  # seconds to the first token of a chat completion
+    tokens_per_second: float = 50.0  # generation speed after the first token, 0 answers at once
+    answer_words: int = 150  # words of a prose answer (the summaries)
+    relevant_fraction: float = 0.8  # share of the chunks graded as relevant
+    embedding_latency: float = 0.02  # seconds per embedding request
+    error_rate: float = 0.0  # share of requests answered with a 500
+
+
+settings = StubSettings()
+app = FastAPI()
+dense_embeddings = FakeDenseEmbeddings()
+
+
+def _rng(*parts) -> random.Random:
+    return random.Random(hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest())
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    # content parts of multimodal messages
+    return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def _words(text: str, rng: random.Random, count: int) -> List[str]:
+    words = re.findall(r"[A-Za-z][A-Za-z0-9-]{3,}", text) or ["research"]
+    return [rng.choice(words) for _ in range(count)]
+
+
+def _is_relevant(document: str) -> bool:
+    return _rng("grade", document.strip()).random() < settings.relevant_fraction
+
+
+def json_answer(instructions: str, prompt: str, rng: random.Random) -> dict:
+    """An answer in the shape the JSON-mode instructions ask for"""
+    if '"scores"' in instructions or "'scores'" in instructions:
+        documents = re.split(r"<DOCUMENT \d+>", prompt)[1:]
+        return {"scores": ["yes" if _is_relevant(document) else "no" for document in documents]}
+    if '"score"' in instructions or "'score'" in instructions:
+        return {"score": "yes" if _is_relevant(prompt) else "no"}
+    if '"sections"' in instructions:
+        return {"sections": [
+            {"title": " ".join(_words(prompt, rng, 2)).title(),
+             "points": [" ".join(_words(prompt, rng, 14)) + "." for _ in range(rng.randint(1, 3))]}
+            for _ in range(rng.randint(1, 3))
+        ]}
+    if '"follow_up_query"' in instructions:
+        return {"knowledge_gap": " ".join(_words(prompt, rng, 10)), "follow_up_query": " ".join(_words(prompt, rng, 6))}
+    if '"queries"' in instructions:
+        match = re.search(r"list of (\d+) objects", instructions)
+        return {"queries": [{"query": " ".join(_words(prompt, rng, 5)), "aspect": " ".join(_words(prompt, rng, 2)),
+                             "rationale": " ".join(_words(prompt, rng, 8))}
+                            for _ in range(int(match.group(1)) if match else 1)]}
+    return {"query": " ".join(_words(prompt, rng, 5)), "aspect": " ".join(_words(prompt, rng, 2)),
+            "rationale": " ".join(_words(prompt, rng, 8))}
+
+
+def answer(body: dict) -> str:
+    messages = [_text(message.get("content") or "") for message in body.get("messages", [])]
+    prompt = "\n".join(messages)
+    rng = _rng(body.get("model"), prompt)
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        return json.dumps(json_answer(messages[0] if messages else "", prompt, rng))
+    return " ".join(_words(prompt, rng, settings.answer_words))
+
+
+def _usage(body: dict, content: str) -> dict:
+    prompt_tokens = sum(len(_text(message.get("content") or "")) for message in body.get("messages", [])) // 4
+    completion_tokens = len(content.split())
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _failure() -> JSONResponse:
+    return JSONResponse({"error": {"message": "Injected stub failure", "type": "server_error"}}, status_code=500)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if settings.error_rate and random.random() < settings.error_rate:
+        return _failure()
+    content = answer(body)
+    tokens = [token + " " for token in content.split(" ")]
+    tokens[-1] = tokens[-1][:-1]
+    token_delay = 1 / settings.tokens_per_second if settings.tokens_per_second else 0.0
+    completion_id, created, model = f"chatcmpl-{uuid.uuid4().hex}", int(time.time()), body.get("model", "stub")
+
+    if not body.get("stream"):
+        await asyncio.sleep(settings.latency + token_delay * (len(tokens) - 1))
+        return {"id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": _usage(body, content)}
+
+    def chunk(delta: dict, finish_reason=None, **extra) -> str:
+        return "data: " + json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                      "model": model, "choices": [{"index": 0, "delta": delta,
+                                                                   "finish_reason": finish_reason}], **extra}) + "\n\n"
+
+    async def stream():
+        await asyncio.sleep(settings.latency)
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(token_delay)
+            yield chunk({"role": "assistant", "content": token} if index == 0 else {"content": token})
+        usage = {"usage": _usage(body, content)} if (body.get("stream_options") or {}).get("include_usage") else {}
+        yield chunk({}, "stop", **usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    if settings.error_rate and random.random() < settings.error_rate:
+        return _failure()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    # token arrays (clients that tokenize before embedding) are embedded as their token ids
+    texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+    await asyncio.sleep(settings.embedding_latency)
+    vectors = dense_embeddings.embed_documents(texts)
+    tokens = sum(len(text) for text in texts) // 4
+    return {"object": "list", "model": body.get("model", "stub"),
+            "data": [{"object": "embedding", "index": index, "embedding": vector} for index, vector in enumerate(vectors)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "loadtest"}]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--latency", type=float, default=settings.latency, help="seconds to the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=settings.tokens_per_second)
+    parser.add_argument("--answer-words", type=int, default=settings.answer_words, help="words of a prose answer")
+    parser.add_argument("--relevant-fraction", type=float, default=settings.relevant_fraction)
+    parser.add_argument("--embedding-latency", type=float, default=settings.embedding_latency)
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate, help="share of requests that fail")
+    args = parser.parse_args()
+
+    for name in vars(settings):
+        setattr(settings, name, getattr(args, name))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Eviction of the checkpointers in assistant/checkpoint.py
+
+BoundedMemorySaver and SqliteCheckpointSaver build on the storage and writes of MemorySaver,
+these tests catch a langgraph-checkpoint release that changes that layout.
+
+    cd api
+    python -m unittest discover tests
+"""
+import os
+import asyncio
+import operator
+import tempfile
+import unittest
+from typing import Annotated, TypedDict
+
+from langgraph.graph import StateGraph, START, END
+
+from assistant.checkpoint import BoundedMemorySaver, SqliteCheckpointSaver
+
+
+class State(TypedDict):
+    text: Annotated[str, operator.add]
+
+
+def _graph(checkpointer):
+    builder = StateGraph(State)
+    builder.add_node("write", lambda state: {"text": "x" * 2000})
+    builder.add_edge(START, "write")
+    builder.add_edge("write", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def _config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+class BoundedMemorySaverTest(unittest.TestCase):
+    def test_accounts_the_stored_bytes(self):
+        saver = BoundedMemorySaver()
+        _graph(saver).invoke({"text": ""}, _config("a"))
+        self.assertIn("a", saver)
+        self.assertGreater(saver.nbytes, 2000)
+        self.assertEqual(saver.nbytes, saver._thread_bytes["a"])
+        self.assertTrue(saver.writes)
+
+    def test_evicts_least_recently_used_threads(self):
+        saver = BoundedMemorySaver(max_bytes=10000)
+        graph = _graph(saver)
+        for thread_id in ("a", "b", "c", "d", "e"):
+            graph.invoke({"text": ""}, _config(thread_id))
+
+        self.assertGreater(saver.evictions, 0)
+        self.assertNotIn("a", saver)
+        self.assertNotIn("a", saver.storage)
+        self.assertFalse([key for key in saver.writes if key[0] == "a"])
+        self.assertIsNone(graph.get_state(_config("a")).values.get("text"))
+        self.assertEqual(graph.get_state(_config("e")).values["text"], "x" * 2000)
+        self.assertLessEqual(saver.nbytes, saver.max_bytes)
+        self.assertEqual(saver.nbytes, sum(saver._thread_bytes.values()))
+
+    def test_keeps_the_thread_being_written(self):
+        saver = BoundedMemorySaver(max_bytes=100)
+        graph = _graph(saver)
+        graph.invoke({"text": ""}, _config("a"))
+        self.assertEqual(graph.get_state(_config("a")).values["text"], "x" * 2000)
+
+    def test_delete_thread(self):
+        saver = BoundedMemorySaver()
+        _graph(saver).invoke({"text": ""}, _config("a"))
+        saver.delete_thread("a")
+        self.assertNotIn("a", saver)
+        self.assertEqual(saver.nbytes, 0)
+        self.assertFalse(saver.writes)
+
+
+class SqliteCheckpointSaverTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "checkpoints.sqlite")
+
+    def test_resumes_after_restart(self):
+        saver = SqliteCheckpointSaver(self.path)
+        self.addCleanup(saver._conn.close)
+        asyncio.run(_graph(saver).ainvoke({"text": ""}, _config("a")))
+
+        restarted = SqliteCheckpointSaver(self.path)
+        self.addCleanup(restarted._conn.close)
+        self.assertEqual(restarted.disk_bytes, saver.disk_bytes)
+        state = asyncio.run(_graph(restarted).aget_state(_config("a")))
+        self.assertEqual(state.values["text"], "x" * 2000)
+        self.assertIn("a", restarted)
+
+    def test_deletes_least_recently_used_threads(self):
+        saver = SqliteCheckpointSaver(self.path, max_bytes=10000)
+        self.addCleanup(saver._conn.close)
+        graph = _graph(saver)
+        for thread_id in ("a", "b", "c", "d", "e"):
+            graph.invoke({"text": ""}, _config(thread_id))
+
+        self.assertGreater(saver.evictions, 0)
+        self.assertLessEqual(saver.disk_bytes, saver.max_bytes)
+        threads = [row[0] for row in saver._conn.execute("SELECT thread_id FROM threads")]
+        self.assertNotIn("a", threads)
+        self.assertIn("e", threads)
+        self.assertIsNone(graph.get_state(_config("a")).values.get("text"))
+
+    def test_delete_thread(self):
+        saver = SqliteCheckpointSaver(self.path)
+        self.addCleanup(saver._conn.close)
+        _graph(saver).invoke({"text": ""}, _config("a"))
+        saver.delete_thread("a")
+        self.assertEqual(saver.disk_bytes, 0)
+        for table in ("checkpoints", "writes", "threads"):
+            self.assertEqual(saver._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
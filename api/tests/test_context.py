@@ -0,0 +1,117 @@
+"""Token budgets of the sources context in assistant/context.py
+
+The tests use the 4 characters per token estimate, so they do not depend on the tiktoken
+encoding files being available.
+
+    cd api
+    python -m unittest discover tests
+"""
+import unittest
+from unittest import mock
+
+from assistant import context
+from assistant.context import CHARS_PER_TOKEN, MIN_SOURCE_TOKENS, TokenCounter, build_sources_context
+
+
+def _estimating_counter() -> TokenCounter:
+    with mock.patch.object(context, "_load_encoding", return_value=None):
+        return TokenCounter("gpt-4o-mini")
+
+
+def _source(title: str, content: str, raw_content: str = None) -> dict:
+    return {"id": title, "title": title, "url": f"https://example.com/{title}", "content": content,
+            "raw_content": raw_content}
+
+
+class TokenCounterTest(unittest.TestCase):
+    def setUp(self):
+        self.counter = _estimating_counter()
+
+    def test_estimates_four_characters_per_token(self):
+        self.assertFalse(self.counter.exact)
+        self.assertEqual(self.counter.count(""), 0)
+        self.assertEqual(self.counter.count("a" * 8), 2)
+        self.assertEqual(self.counter.count("a" * 9), 3)
+
+    def test_truncate(self):
+        self.assertEqual(self.counter.truncate("a" * 8, 2), ("a" * 8, 2, False))
+        self.assertEqual(self.counter.truncate("a" * 10, 2), ("a" * 8, 2, True))
+        self.assertEqual(self.counter.truncate("abc", -1), ("", 0, True))
+        self.assertEqual(self.counter.truncate("", 5), ("", 0, False))
+
+
+class BuildSourcesContextTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(context, "get_token_counter", return_value=_estimating_counter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cuts_each_source_to_its_budget(self):
+        sources = [_source("a", "x" * 1000, raw_content="y" * 1000), _source("b", "short")]
+        result = build_sources_context({"results": sources}, max_tokens_per_source=10, include_raw_content=True)
+
+        self.assertIn("Most relevant content from source: " + "x" * 10 * CHARS_PER_TOKEN + "\n", result.text)
+        self.assertIn(": " + "y" * 10 * CHARS_PER_TOKEN + "... [truncated]", result.text)
+        self.assertNotIn("x" * (10 * CHARS_PER_TOKEN + 1), result.text)
+        self.assertEqual([(usage.title, usage.truncated) for usage in result.sources], [("a", True), ("b", False)])
+        self.assertIn("Most relevant content from source: short\n", result.text)
+
+    def test_raw_content_only_when_included(self):
+        result = build_sources_context({"results": [_source("a", "x", raw_content="raw")]}, include_raw_content=False)
+        self.assertNotIn("raw", result.text)
+
+    def _budget(self, whole_sources: int, extra: int) -> int:
+        """A total budget that fits the header, whole_sources sources and extra tokens"""
+        single = build_sources_context({"results": [_source("a", "a" * 400)]}, max_tokens_per_source=1000)
+        header = _estimating_counter().count("Sources:\n\n")
+        return header + whole_sources * (single.tokens - header) + extra
+
+    def test_fits_the_total_budget(self):
+        sources = [_source(title, title * 400) for title in "abcdef"]
+        budget = self._budget(2, MIN_SOURCE_TOKENS + 10)
+        result = build_sources_context({"results": sources}, max_tokens_per_source=1000, max_total_tokens=budget)
+
+        self.assertEqual(result.tokens, budget)
+        self.assertEqual(result.tokens, sum(usage.tokens for usage in result.sources) + _estimating_counter().count("Sources:\n\n"))
+        included = [usage for usage in result.sources if usage.included]
+        self.assertEqual([usage.title for usage in included], ["a", "b", "c"])
+        # the last source that fits is cut to the remaining budget
+        self.assertEqual([usage.truncated for usage in included], [False, False, True])
+        self.assertEqual(result.dropped, 3)
+
+    def test_dropped_sources_keep_their_order(self):
+        sources = [_source(title, title * 400) for title in "abcdef"]
+        result = build_sources_context({"results": sources}, max_tokens_per_source=1000,
+                                       max_total_tokens=self._budget(2, MIN_SOURCE_TOKENS))
+
+        self.assertEqual([usage.title for usage in result.sources], list("abcdef"))
+        self.assertEqual([usage.included for usage in result.sources], [True, True, True, False, False, False])
+        self.assertTrue(all(usage.tokens == 0 for usage in result.sources if not usage.included))
+        positions = [result.text.index(f"Source {title}:") for title in "abc"]
+        self.assertEqual(positions, sorted(positions))
+        for title in "def":
+            self.assertNotIn(f"Source {title}:", result.text)
+
+    def test_leaves_out_a_source_below_the_minimum(self):
+        counter = _estimating_counter()
+        first = build_sources_context({"results": [_source("a", "a" * 400)]}, max_tokens_per_source=1000)
+        # a budget that leaves fewer than MIN_SOURCE_TOKENS for the second source
+        budget = first.tokens + MIN_SOURCE_TOKENS - 1
+        result = build_sources_context({"results": [_source("a", "a" * 400), _source("b", "b" * 400)]},
+                                       max_tokens_per_source=1000, max_total_tokens=budget)
+        self.assertEqual([usage.included for usage in result.sources], [True, False])
+        self.assertEqual(result.tokens, first.tokens)
+        self.assertLessEqual(counter.count(result.text), budget)
+
+    def test_deduplicates_by_id_and_url(self):
+        chunk = _source("a", "first")
+        duplicate = {**_source("a", "second")}
+        web = {"title": "w", "url": "https://example.com/w", "content": "page"}
+        result = build_sources_context([{"results": [chunk, web]}, {"results": [duplicate, dict(web)]}])
+        self.assertEqual([usage.title for usage in result.sources], ["a", "w"])
+        self.assertIn("first", result.text)
+        self.assertNotIn("second", result.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Admission and fair scheduling of research runs in assistant/scheduler.py
+
+    cd api
+    python -m unittest discover tests
+"""
+import asyncio
+import unittest
+
+from assistant.scheduler import FairScheduler, QueueFullError
+from assistant.sse import ClosingStreamingResponse
+
+
+async def _drop_unstarted(response: ClosingStreamingResponse) -> None:
+    """Serve the response to a client that disconnected before the body was sent"""
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await asyncio.Event().wait()
+
+    await response({"type": "http", "asgi": {"spec_version": "2.0"}}, receive, send)
+
+
+class FairSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_queues_runs_past_max_concurrent(self):
+        scheduler = FairScheduler(max_concurrent=2)
+        tickets = [scheduler.admit("a") for _ in range(3)]
+        self.assertEqual([ticket.state for ticket in tickets], ["running", "running", "queued"])
+        self.assertEqual((scheduler.running, scheduler.queued, scheduler.admitted), (2, 1, 3))
+
+    async def test_serves_clients_round_robin(self):
+        scheduler = FairScheduler(max_concurrent=1)
+        first = scheduler.admit("a")
+        tickets = {name: scheduler.admit(name[0]) for name in ("a1", "a2", "a3", "b1", "c1", "b2")}
+
+        order, running = [], first
+        while scheduler.queued:
+            running.cancel()
+            running = next(ticket for ticket in tickets.values() if ticket.state == "running")
+            order.append(next(name for name, ticket in tickets.items() if ticket is running))
+        self.assertEqual(order, ["a1", "b1", "c1", "a2", "b2", "a3"])
+
+    async def test_full_queue_raises_with_retry_after(self):
+        scheduler = FairScheduler(max_concurrent=2, max_queued=2)
+        for _ in range(4):
+            scheduler.admit("a")
+        with self.assertRaises(QueueFullError) as raised:
+            scheduler.admit("b")
+        # 10s per run without finished runs, 3 runs ahead of the next one on 2 slots
+        self.assertEqual(raised.exception.retry_after, 15)
+        self.assertEqual(scheduler.rejected, 1)
+
+        scheduler.avg_run_seconds = 1.0
+        self.assertEqual(scheduler.retry_after(), 2)
+
+    async def test_client_share_of_the_queue(self):
+        scheduler = FairScheduler(max_concurrent=1, max_queued=8, max_queued_per_client=1)
+        scheduler.admit("a")
+        scheduler.admit("a")
+        with self.assertRaises(QueueFullError):
+            scheduler.admit("a")
+        self.assertEqual(scheduler.admit("b").state, "queued")
+
+    async def test_cancel_queued_ticket(self):
+        scheduler = FairScheduler(max_concurrent=1)
+        running, queued = scheduler.admit("a"), scheduler.admit("b")
+        queued.cancel()
+        self.assertEqual((scheduler.running, scheduler.queued), (1, 0))
+        self.assertEqual(running.state, "running")
+        with self.assertRaises(RuntimeError):
+            async with queued:
+                pass
+
+    async def test_cancel_running_ticket_starts_the_next(self):
+        scheduler = FairScheduler(max_concurrent=1)
+        running, queued = scheduler.admit("a"), scheduler.admit("b")
+        running.cancel()
+        running.cancel()
+        self.assertEqual((scheduler.running, scheduler.queued), (1, 0))
+        self.assertEqual(queued.state, "running")
+        # a run that never started is not counted as completed
+        self.assertEqual(scheduler.completed, 0)
+
+    async def test_finished_run_releases_its_slot(self):
+        scheduler = FairScheduler(max_concurrent=1)
+        first, second = scheduler.admit("a"), scheduler.admit("b")
+        waiting = asyncio.create_task(self._run(second))
+        async with first:
+            await asyncio.sleep(0)
+            self.assertFalse(waiting.done())
+        await waiting
+        first.cancel()
+        self.assertEqual((scheduler.running, scheduler.queued, scheduler.completed), (0, 0, 2))
+        self.assertIsNotNone(scheduler.avg_run_seconds)
+
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        scheduler = FairScheduler(max_concurrent=1)
+        scheduler.admit("a")
+        waiting = asyncio.create_task(self._run(scheduler.admit("b")))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual((scheduler.running, scheduler.queued), (1, 0))
+
+    @staticmethod
+    async def _run(ticket):
+        async with ticket:
+            pass
+
+
+class TicketReleaseTest(unittest.TestCase):
+    def test_unstarted_response_gives_up_the_ticket(self):
+        async def main():
+            scheduler = FairScheduler(max_concurrent=1)
+            running, queued = scheduler.admit("a"), scheduler.admit("b")
+            self.assertEqual((scheduler.running, scheduler.queued), (1, 1))
+
+            started = []
+
+            async def body():
+                started.append(True)
+                yield "data: [DONE]\n\n"
+
+            for ticket in (queued, running):
+                await _drop_unstarted(ClosingStreamingResponse(body(), on_close=ticket.cancel))
+            self.assertFalse(started)
+            self.assertEqual((scheduler.running, scheduler.queued), (0, 0))
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
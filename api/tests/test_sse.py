@@ -0,0 +1,138 @@
+"""Chunk encoding and coalescing of the chat completion stream in assistant/sse.py
+
+    cd api
+    python -m unittest discover tests
+"""
+import json
+import time
+import asyncio
+import contextvars
+import unittest
+
+from assistant.sse import ChunkEncoder, coalesce
+from assistant.streaming import StreamEvent
+
+
+def _parse(chunk: str) -> dict:
+    assert chunk.startswith("data: ") and chunk.endswith("\n\n")
+    return json.loads(chunk[len("data: "):])
+
+
+class ChunkEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.encoder = ChunkEncoder("gpt-4o-mini")
+
+    def _expected(self, delta: dict, finish_reason=None, encoder=None, **extra) -> dict:
+        # the chunk as the OpenAI API (and json.dumps) would write it
+        encoder = encoder or self.encoder
+        return json.loads(json.dumps({
+            "id": encoder.id, "object": "chat.completion.chunk", "created": encoder.created,
+            "model": "gpt-4o-mini", "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra,
+        }))
+
+    def test_content_matches_json_dumps(self):
+        for text in ("plain", 'quotes " and \\ backslashes', "new\nline\ttab", "umlaut ä, emoji \U0001f600", "\x00\x1f"):
+            encoder = ChunkEncoder("gpt-4o-mini")
+            chunk = encoder.content(text)
+            self.assertTrue(chunk.isascii())
+            self.assertEqual(_parse(chunk), self._expected({"role": "assistant", "content": text}, encoder=encoder))
+
+    def test_role_only_in_the_first_chunk(self):
+        self.assertEqual(_parse(self.encoder.content("a"))["choices"][0]["delta"], {"role": "assistant", "content": "a"})
+        self.assertEqual(_parse(self.encoder.content("b")), self._expected({"content": "b"}))
+
+    def test_progress(self):
+        progress = {"node": "web_research", "message": "Graded 3/5 documents", "relevant": 3}
+        self.assertEqual(_parse(self.encoder.progress(progress)), self._expected({"role": "assistant"}, progress=progress))
+        self.assertEqual(_parse(self.encoder.progress(progress)), self._expected({}, progress=progress))
+
+    def test_progress_as_content(self):
+        encoder = ChunkEncoder("gpt-4o-mini", progress_as_content=True)
+        chunk = _parse(encoder.progress({"node": None, "message": "Searching"}))
+        self.assertEqual(chunk["choices"][0]["delta"], {"role": "assistant", "content": "Searching\n\n"})
+        self.assertEqual(chunk["progress"], {"node": None, "message": "Searching"})
+
+    def test_finish(self):
+        self.encoder.content("a")
+        self.assertEqual(_parse(self.encoder.finish()), self._expected({}, "stop"))
+        self.assertEqual(_parse(self.encoder.finish("length")), self._expected({}, "length"))
+
+    def test_event(self):
+        self.encoder.content("")
+        self.assertEqual(self.encoder.event(StreamEvent("content", "a")), self.encoder.content("a"))
+        chunk = _parse(self.encoder.event(StreamEvent("progress", "Searching", "generate_query", {"search_query": "q"})))
+        self.assertEqual(chunk["progress"], {"node": "generate_query", "message": "Searching", "search_query": "q"})
+
+
+async def _events(*items):
+    """Yield the events, a number is a pause of that many seconds"""
+    for item in items:
+        if isinstance(item, (int, float)):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+def _content(text: str) -> StreamEvent:
+    return StreamEvent("content", text, "finalize_summary")
+
+
+class CoalesceTest(unittest.IsolatedAsyncioTestCase):
+    async def _collect(self, events, **limits):
+        return [(event.type, event.text) async for event in coalesce(events, **limits)]
+
+    async def test_without_limits_events_pass_through(self):
+        events = [_content("a"), _content("b"), StreamEvent("progress", "p")]
+        self.assertEqual(await self._collect(_events(*events)), [("content", "a"), ("content", "b"), ("progress", "p")])
+
+    async def test_merges_up_to_max_bytes(self):
+        events = _events(*[_content(text) for text in ("ab", "cd", "ä", "ef", "g")])
+        # "ä" is 2 bytes in UTF-8
+        self.assertEqual(await self._collect(events, max_bytes=4),
+                         [("content", "abcd"), ("content", "äef"), ("content", "g")])
+
+    async def test_other_events_flush_the_buffer(self):
+        events = _events(_content("a"), _content("b"), StreamEvent("progress", "p"), _content("c"))
+        self.assertEqual(await self._collect(events, max_bytes=100),
+                         [("content", "ab"), ("progress", "p"), ("content", "c")])
+
+    async def test_flushes_after_max_delay_while_the_upstream_stalls(self):
+        started = time.monotonic()
+        received = []
+        async for event in coalesce(_events(_content("a"), _content("b"), 0.5, _content("c")), max_delay=0.05):
+            received.append((event.text, time.monotonic() - started))
+
+        self.assertEqual([text for text, _ in received], ["ab", "c"])
+        self.assertLess(received[0][1], 0.3)
+        self.assertGreaterEqual(received[1][1], 0.5)
+
+    async def test_upstream_context_is_kept_across_steps(self):
+        variable = contextvars.ContextVar("variable", default=None)
+
+        async def upstream():
+            token = variable.set("set")
+            yield _content("a")
+            await asyncio.sleep(0.1)
+            yield _content(variable.get())
+            variable.reset(token)
+
+        self.assertEqual(await self._collect(upstream(), max_delay=0.02), [("content", "a"), ("content", "set")])
+
+    async def test_closing_stops_reading(self):
+        read = []
+
+        async def upstream():
+            for text in ("a", "b", "c"):
+                read.append(text)
+                yield _content(text)
+                await asyncio.sleep(0.1)
+
+        events = coalesce(upstream(), max_delay=0.01)
+        self.assertEqual((await anext(events)).text, "a")
+        await events.aclose()
+        await asyncio.sleep(0.2)
+        self.assertLessEqual(len(read), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Adaptive stopping of the research loops in assistant/stopping.py
+
+    cd api
+    python -m unittest discover tests
+"""
+import unittest
+
+from assistant.configuration import Configuration
+from assistant.stopping import loop_stats, stop_reason
+
+
+def _configuration(**overrides) -> Configuration:
+    values = {"max_research_loops": 3, "adaptive_stop": True, "stop_min_new_chunk_fraction": 0.25,
+              "stop_min_relevant_fraction": 0.2, "stop_min_summary_growth": 0.05}
+    return Configuration(**{**values, **overrides})
+
+
+def _stats(loop: int, new_chunks: int = 4, chunks: int = 4, relevant_fraction: float = 0.8,
+           summary_growth: float = 0.5) -> dict:
+    return {"loop": loop, "chunks": chunks, "new_chunks": new_chunks,
+            "new_chunk_fraction": new_chunks / chunks if chunks else 0.0, "relevant_fraction": relevant_fraction,
+            "summary_tokens": 100, "summary_growth": summary_growth}
+
+
+class StopReasonTest(unittest.TestCase):
+    def test_continues_while_loops_find_new_information(self):
+        for loop in (1, 2, 3):
+            self.assertIsNone(stop_reason(_stats(loop), _configuration()))
+
+    def test_hard_cap(self):
+        self.assertEqual(stop_reason(_stats(4), _configuration()), "reached max_research_loops (3)")
+        self.assertEqual(stop_reason(_stats(4), _configuration(adaptive_stop=False)), "reached max_research_loops (3)")
+        self.assertEqual(stop_reason(_stats(1), _configuration(max_research_loops=0)), "reached max_research_loops (0)")
+
+    def test_first_loop_never_stops_early(self):
+        stats = _stats(1, new_chunks=0, relevant_fraction=0.0, summary_growth=0.0)
+        self.assertIsNone(stop_reason(stats, _configuration()))
+
+    def test_few_new_chunks(self):
+        reason = stop_reason(_stats(2, new_chunks=0), _configuration())
+        self.assertEqual(reason, "0/4 new chunks (below 25%)")
+        self.assertIsNone(stop_reason(_stats(2, new_chunks=1), _configuration()))
+
+    def test_few_relevant_chunks(self):
+        reason = stop_reason(_stats(2, relevant_fraction=0.1), _configuration())
+        self.assertEqual(reason, "10% of the retrieved chunks are relevant (below 20%)")
+        self.assertIsNone(stop_reason(_stats(2, relevant_fraction=0.2), _configuration()))
+
+    def test_summary_barely_grew(self):
+        reason = stop_reason(_stats(3, summary_growth=0.01), _configuration())
+        self.assertEqual(reason, "the summary grew by 1% (below 5%)")
+        # compaction may shrink the summary, a negative growth is below any threshold
+        self.assertIsNotNone(stop_reason(_stats(3, summary_growth=-0.4), _configuration()))
+        self.assertIsNone(stop_reason(_stats(2, summary_growth=None), _configuration()))
+
+    def test_zero_threshold_disables_its_check(self):
+        stats = _stats(2, new_chunks=0, relevant_fraction=0.0, summary_growth=0.0)
+        configuration = _configuration(stop_min_new_chunk_fraction=0, stop_min_relevant_fraction=0,
+                                       stop_min_summary_growth=0)
+        self.assertIsNone(stop_reason(stats, configuration))
+
+    def test_without_adaptive_stop_only_the_cap_applies(self):
+        stats = _stats(2, new_chunks=0, relevant_fraction=0.0, summary_growth=0.0)
+        self.assertIsNone(stop_reason(stats, _configuration(adaptive_stop=False)))
+
+
+class LoopStatsTest(unittest.TestCase):
+    def test_signals_of_a_loop(self):
+        branches = [{"loop": 0, "retrieved": 5, "chunk_ids": ["a", "b"]},
+                    {"loop": 1, "retrieved": 5, "chunk_ids": ["b", "c"]},
+                    {"loop": 1, "retrieved": 5, "chunk_ids": ["d"]}]
+        chunk_refs = {"a": {"loop": 0}, "b": {"loop": 0}, "c": {"loop": 1}, "d": {"loop": 1}}
+        previous = loop_stats(0, branches, ["a", "b"], chunk_refs, summary_tokens=100)
+        self.assertIsNone(previous["summary_growth"])
+
+        stats = loop_stats(1, branches, ["b", "c", "d"], chunk_refs, summary_tokens=150, previous=previous)
+        self.assertEqual(stats["loop"], 2)
+        self.assertEqual((stats["chunks"], stats["new_chunks"]), (3, 2))
+        self.assertAlmostEqual(stats["new_chunk_fraction"], 2 / 3)
+        self.assertAlmostEqual(stats["relevant_fraction"], 0.3)
+        self.assertAlmostEqual(stats["summary_growth"], 0.5)
+
+    def test_measured_growth_takes_precedence(self):
+        previous = {"summary_tokens": 200}
+        stats = loop_stats(1, [], [], {}, summary_tokens=100, previous=previous, summary_growth=0.2)
+        self.assertEqual(stats["summary_growth"], 0.2)
+        self.assertEqual((stats["new_chunk_fraction"], stats["relevant_fraction"]), (0.0, 0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
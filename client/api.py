@@ -6,11 +6,11 @@ import warnings
 warnings.filterwarnings('ignore', category=UserWarning)
 
 import os
-import time
+import logging
 import uuid
-import json
+import asyncio
+import importlib
 import uvicorn
-import uuid
 
 from typing import List, Optional
 from pydantic import BaseModel
@@ -19,7 +19,11 @@ from fastapi.responses import StreamingResponse
 
 #from langgraph.checkpoint.memory import MemorySaver 
 
-from assistant.graph import graph
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+from assistant.configuration import Configuration
+from assistant.streaming import stream_research
+from assistant.sse import ChunkEncoder, DONE, coalesce
 
 # Load the environment variables for API credentials
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -46,11 +50,19 @@ class ChatRequest(BaseModel):
  
 # Initialize memory
 #memory = MemorySaver() 
-thread_id = str(uuid.uuid4())
 
 # Initialize FastAPI app
 app = FastAPI()
 
+# The research graph is imported on the first request, so the app starts serving without loading it
+graph = None
+
+async def get_graph():
+    global graph
+    if graph is None:
+        graph = (await asyncio.to_thread(importlib.import_module, "assistant.graph")).graph
+    return graph
+
 # Helper function to format and add system messages
 def add_system_message(messages: List[ChatMessage], system_prompt: Optional[str] = None) -> List[ChatMessage]:
     if not system_prompt:
@@ -115,51 +127,35 @@ async def chat(request: ChatRequest):
         if not request.model:
             raise HTTPException(status_code=400, detail="Model is required")
 
+        # Every request runs in its own thread
+        thread_id = str(uuid.uuid4())
+        research_graph = await get_graph()
+
         async def generate_stream():
-            async for token in graph.astream(
-                {"research_topic": messages[-1]["content"]},
-                {"configurable": {"thread_id": thread_id}},
-                stream_mode="updates" 
-            ):
-                if isinstance(token, dict):
-                    content = ""
-                    if 'generate_query' in token:
-                        content = f"Searching for: {token['generate_query']['search_query']}\n"
-                    elif 'finalize_summary' in token:
-                        content = token['finalize_summary']['running_summary']
-                    
-                    if content:
-                        chunk = {
-                            'id': f'chatcmpl-{str(uuid.uuid4())}',  # Updated to match OpenAI format
-                            'object': 'chat.completion.chunk',
-                            'created': int(time.time()),
-                            'model': request.model,
-                            'choices': [{
-                                'index': 0,
-                                'delta': {
-                                    'content': content
-                                },
-                                'finish_reason': None
-                            }]
-                        }
-                        yield f"data: {json.dumps(chunk)}\n\n"
+            # One completion id and timestamp for all chunks of the response
+            encoder = ChunkEncoder(request.model, progress_as_content=Configuration.stream_progress_as_content)
+
+            events = coalesce(
+                stream_research(
+                    research_graph,
+                    {"research_topic": messages[-1]["content"]},
+                    {"configurable": {"thread_id": thread_id}}
+                ),
+                max_delay=Configuration.stream_coalesce_ms / 1000,
+                max_bytes=Configuration.stream_coalesce_bytes
+            )
+            async for event in events:
+                if event.type == "final":
+                    continue
+
+                # Progress events carry no content, OpenAI-compatible clients ignore the extra field
+                yield encoder.event(event)
             
             # Send final chunk with finish_reason
-            final_chunk = {
-                'id': f'chatcmpl-{str(uuid.uuid4())}',
-                'object': 'chat.completion.chunk',
-                'created': int(time.time()),
-                'model': request.model,
-                'choices': [{
-                    'index': 0,
-                    'delta': {},
-                    'finish_reason': 'stop'
-                }]
-            }
-            yield f"data: {json.dumps(final_chunk)}\n\n"
-            yield "data: [DONE]\n\n"
+            yield encoder.finish()
+            yield DONE
 
-        return StreamingResponse(generate_stream(), media_type="text/event-stream")
+        return StreamingResponse(generate_stream(), media_type="text/event-stream", headers={"X-Thread-Id": thread_id})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")